@@ -0,0 +1,181 @@
+from collections import OrderedDict
+from threading import Lock
+from time import monotonic
+from typing import Any, Hashable, Optional, Type, Iterable, Dict, Tuple
+
+from django.core.cache import DEFAULT_CACHE_ALIAS, caches, BaseCache
+from django.db.models import Model
+
+
+class AncestorsCache:
+    """In-process cache of ancestor paths keyed by node.
+
+    Values are shared by all threads, so they should not be mutable objects
+    handed out to requests (paths are cached as plain fields values, see `Hierarchy.get_paths()`).
+
+    Bounded (least recently used entries are evicted first) and thread safe.
+    Entries expire after a timeout, so that moved or renamed nodes
+    are eventually reflected even without explicit invalidation.
+
+    """
+    def __init__(self, max_size: int = 10000, timeout: Optional[float] = 300):
+        """
+        :param max_size: Maximum number of entries to keep.
+        :param timeout: Number of seconds an entry is considered valid. None - never expires.
+
+        """
+        self.max_size = max_size
+        self.timeout = timeout
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """Returns a cached value or None.
+
+        :param key:
+
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+
+            if entry is None:
+                return None
+
+            expires, value = entry
+
+            if expires is not None and expires < monotonic():
+                del self._entries[key]
+                return None
+
+            self._entries.move_to_end(key)
+
+            return value
+
+    def set(self, key: Hashable, value: Any):
+        """Puts a value into cache.
+
+        :param key:
+        :param value:
+
+        """
+        timeout = self.timeout
+        expires = None if timeout is None else monotonic() + timeout
+
+        with self._lock:
+            entries = self._entries
+            entries[key] = (expires, value)
+            entries.move_to_end(key)
+
+            while len(entries) > self.max_size:
+                entries.popitem(last=False)
+
+    def delete(self, key: Hashable):
+        """Removes a value from cache.
+
+        :param key:
+
+        """
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        """Removes all values from cache."""
+        with self._lock:
+            self._entries.clear()
+
+
+class StatsCache:
+    """Children stats cache on top of Django cache framework.
+
+    Keeps (immediate children, all descendants) counts
+    and subtree rollups (see `Rollup`) per node.
+
+    """
+    def __init__(self, alias: str = DEFAULT_CACHE_ALIAS, timeout: Optional[float] = 3600, key_prefix: str = 'admirarchy'):
+        """
+        :param alias: Django cache alias to use.
+        :param timeout: Number of seconds an entry is considered valid. None - never expires.
+        :param key_prefix: Prefix for cache keys.
+
+        """
+        self.alias = alias
+        self.timeout = timeout
+        self.key_prefix = key_prefix
+
+    @property
+    def cache(self) -> BaseCache:
+        return caches[self.alias]
+
+    def get_key(self, model: Type[Model], pk: Any, kind: str = 'stats') -> str:
+        """Returns cache key for the given node.
+
+        :param model:
+        :param pk:
+        :param kind: Kind of cached data: stats, rollups.
+
+        """
+        return f'{self.key_prefix}:{kind}:{model._meta.label_lower}:{pk}'
+
+    def get_many(self, model: Type[Model], pks: Iterable[Any]) -> Dict[Any, Tuple[int, Optional[int]]]:
+        """Returns cached stats for the given nodes indexed by IDs.
+        Nodes missing from cache are omitted.
+
+        :param model:
+        :param pks:
+
+        """
+        keys = {self.get_key(model, pk): pk for pk in pks}
+        cached = self.cache.get_many(list(keys))
+
+        return {keys[key]: tuple(value) for key, value in cached.items()}
+
+    def set_many(self, model: Type[Model], stats: Dict[Any, Tuple[int, Optional[int]]]):
+        """Puts stats for the given nodes into cache.
+
+        :param model:
+        :param stats: Stats indexed by nodes IDs.
+
+        """
+        if stats:
+            self.cache.set_many(
+                {self.get_key(model, pk): value for pk, value in stats.items()},
+                timeout=self.timeout
+            )
+
+    def get_rollups_many(self, model: Type[Model], pks: Iterable[Any]) -> Dict[Any, Dict[str, Any]]:
+        """Returns cached rollups values for the given nodes indexed by IDs.
+        Nodes missing from cache are omitted.
+
+        :param model:
+        :param pks:
+
+        """
+        keys = {self.get_key(model, pk, kind='rollups'): pk for pk in pks}
+        cached = self.cache.get_many(list(keys))
+
+        return {keys[key]: value for key, value in cached.items()}
+
+    def set_rollups_many(self, model: Type[Model], rollups: Dict[Any, Dict[str, Any]]):
+        """Puts rollups values for the given nodes into cache.
+
+        :param model:
+        :param rollups: Values indexed by rollup keys (names with definitions signatures) indexed by nodes IDs.
+
+        """
+        if rollups:
+            self.cache.set_many(
+                {self.get_key(model, pk, kind='rollups'): value for pk, value in rollups.items()},
+                timeout=self.timeout
+            )
+
+    def delete_many(self, model: Type[Model], pks: Iterable[Any]):
+        """Removes stats and rollups for the given nodes from cache.
+
+        :param model:
+        :param pks:
+
+        """
+        keys = [self.get_key(model, pk, kind) for pk in pks for kind in ('stats', 'rollups')]
+
+        if keys:
+            self.cache.delete_many(keys)
@@ -0,0 +1,154 @@
+import logging
+from contextlib import contextmanager, ExitStack
+from time import perf_counter
+from typing import Callable, Dict, Iterable, Tuple, Optional, Any
+
+from django.db import connections
+from django.http import HttpRequest, HttpResponse
+
+from .signals import hierarchy_measured
+
+Measurements = Dict[str, Tuple[int, float]]
+"""Queries count and seconds spent indexed by measure name."""
+
+MeasurementsCallback = Callable[['HierarchicalModelAdmin', HttpRequest, Measurements], None]
+
+LOGGER = logging.getLogger('admirarchy')
+
+
+class Recorder:
+    """Records queries count and time spent in hierarchy routines
+    for a single request.
+
+    """
+    def __init__(self, using: Optional[Iterable[str]] = None):
+        """
+        :param using: Database aliases to count queries for.
+            None - all databases (hierarchies may read from a replica, see `Hierarchy.get_read_db()`).
+
+        """
+        self.using = None if using is None else list(using)
+        self.measurements: Dict[str, Tuple[int, float]] = {}
+
+    @contextmanager
+    def measure(self, name: str):
+        """Records queries count and time spent within the block.
+        Measurements of the same name are summed up.
+
+        :param name:
+
+        """
+        queries = 0
+
+        def count(execute, sql, params, many, context):
+            nonlocal queries
+            queries += 1
+            return execute(sql, params, many, context)
+
+        started = perf_counter()
+
+        try:
+            with ExitStack() as stack:
+
+                for alias in (connections if self.using is None else self.using):
+                    stack.enter_context(connections[alias].execute_wrapper(count))
+
+                yield
+
+        finally:
+            queries_total, seconds_total = self.measurements.get(name, (0, 0.0))
+            self.measurements[name] = (queries_total + queries, seconds_total + perf_counter() - started)
+
+
+class Instrumentation:
+    """Reports per-request queries counts and timings of hierarchy routines
+    (hooks, stats, upper level link, paths).
+
+    Measurements are sent with `admirarchy.signals.hierarchy_measured` signal
+    and passed to callbacks.
+
+    """
+    def __init__(self, callbacks: Iterable[MeasurementsCallback] = (), server_timing: bool = False):
+        """
+        :param callbacks: Callables accepting model admin, request and measurements.
+            See `log_measurements` and `StatsdCallback`.
+
+        :param server_timing: Add `Server-Timing` header to responses,
+            so that measurements are shown by browser developer tools.
+
+        """
+        self.callbacks = list(callbacks)
+        self.server_timing = server_timing
+
+    def report(
+            self,
+            model_admin: 'HierarchicalModelAdmin',
+            request: HttpRequest,
+            response: Optional[HttpResponse],
+            measurements: Measurements
+    ):
+        """Reports measurements for the given request.
+
+        :param model_admin:
+        :param request:
+        :param response:
+        :param measurements:
+
+        """
+        hierarchy_measured.send(
+            sender=model_admin.model, model_admin=model_admin, request=request, measurements=measurements)
+
+        for callback in self.callbacks:
+            callback(model_admin, request, measurements)
+
+        if self.server_timing and response is not None and measurements:
+            response['Server-Timing'] = ', '.join(
+                f'admirarchy-{name};dur={seconds * 1000:.2f};desc="{queries} queries"'
+                for name, (queries, seconds) in measurements.items()
+            )
+
+
+def log_measurements(model_admin: 'HierarchicalModelAdmin', request: HttpRequest, measurements: Measurements):
+    """Instrumentation callback writing measurements to `admirarchy` logger (DEBUG level).
+
+    :param model_admin:
+    :param request:
+    :param measurements:
+
+    """
+    if not LOGGER.isEnabledFor(logging.DEBUG):
+        return
+
+    LOGGER.debug(
+        '%s %s: %s',
+        model_admin.model._meta.label_lower,
+        request.get_full_path(),
+        ', '.join(
+            f'{name} {queries}q {seconds * 1000:.2f}ms'
+            for name, (queries, seconds) in measurements.items()
+        )
+    )
+
+
+class StatsdCallback:
+    """Instrumentation callback sending measurements to statsd-style client
+    having `timing(name, milliseconds)` and `incr(name, count)` methods.
+
+    """
+    def __init__(self, client: Any, prefix: str = 'admirarchy'):
+        """
+        :param client: Statsd client (e.g. `statsd.StatsClient` instance).
+        :param prefix: Prefix for metrics names.
+
+        """
+        self.client = client
+        self.prefix = prefix
+
+    def __call__(self, model_admin: 'HierarchicalModelAdmin', request: HttpRequest, measurements: Measurements):
+        client = self.client
+        opts = model_admin.model._meta
+        prefix = f'{self.prefix}.{opts.app_label}.{opts.model_name}'
+
+        for name, (queries, seconds) in measurements.items():
+            client.timing(f'{prefix}.{name}', seconds * 1000)
+            client.incr(f'{prefix}.{name}.queries', queries)
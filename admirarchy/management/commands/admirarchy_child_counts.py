@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from ...utils import ChildCountMaintainer, get_hierarchical_admins
+
+
+class Command(BaseCommand):
+
+    help = 'Recomputes denormalized children counts for models registered with hierarchical admins.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'models', nargs='*',
+            help='Models to process (app_label.ModelName). All configured models are processed if omitted.')
+
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Number of objects to update with one query.')
+
+    def handle(self, *args, **options):
+
+        targets = {}
+
+        for model, model_admin in get_hierarchical_admins().items():
+            hierarchy = model_admin.hierarchy
+
+            if hierarchy.child_count_field and hierarchy.supports('get_child_count_subquery'):
+                targets[model._meta.label_lower] = (model, hierarchy)
+
+        labels = [label.lower() for label in options['models']] or list(targets)
+
+        for label in labels:
+
+            if label not in targets:
+                raise CommandError(f'{label} is not registered with a hierarchy having `child_count_field`.')
+
+            model, hierarchy = targets[label]
+            processed = ChildCountMaintainer(model, hierarchy).repair(batch_size=options['batch_size'])
+
+            self.stdout.write(f'{label}: {processed} object(s) processed.')
@@ -0,0 +1,78 @@
+from time import monotonic
+
+from django.core.management.base import BaseCommand, CommandError
+
+from ...utils import NestedSet, NestedSetBuilder, get_hierarchical_admins
+
+
+class Command(BaseCommand):
+
+    help = 'Rebuilds nested set numbering from parent foreign key and verifies it.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('model', help='Model to process (app_label.ModelName).')
+
+        parser.add_argument(
+            '--parent-field', default='parent',
+            help='Name of a foreign key field pointing to a parent.')
+
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Number of objects to read and to update with one query.')
+
+        parser.add_argument(
+            '--check', action='store_true',
+            help='Only verify numbering, do not rebuild.')
+
+        parser.add_argument(
+            '--no-parent', action='store_true',
+            help='Do not check parents when verifying (e.g. no parent field in model).')
+
+    def handle(self, *args, **options):
+
+        label = options['model'].lower()
+        hierarchy = None
+
+        for model, model_admin in get_hierarchical_admins().items():
+
+            if model._meta.label_lower == label:
+                hierarchy = model_admin.hierarchy
+                break
+
+        if not isinstance(hierarchy, NestedSet):
+            raise CommandError(f'{label} is not registered with a NestedSet hierarchy.')
+
+        parent_field = None if options['no_parent'] else options['parent_field']
+
+        if parent_field is None and not options['check']:
+            raise CommandError('Parent field is required to rebuild.')
+
+        builder = NestedSetBuilder(model, hierarchy, parent_field=parent_field)
+        batch_size = options['batch_size']
+
+        if not options['check']:
+            started = monotonic()
+
+            def progress(processed):
+                elapsed = monotonic() - started
+                self.stdout.write(f'{label}: {processed} object(s) processed ({processed / (elapsed or 1):.0f}/s).')
+
+            processed, unreachable = builder.rebuild(batch_size=batch_size, progress=progress)
+
+            self.stdout.write(f'{label}: rebuilt {processed} object(s) in {monotonic() - started:.1f}s.')
+
+            if unreachable:
+                self.stderr.write(
+                    f'{label}: {unreachable} object(s) are unreachable from roots '
+                    f'(dangling parents or cycles) and left intact.')
+
+        problems = 0
+
+        for problem in builder.verify(batch_size=batch_size):
+            problems += 1
+            self.stderr.write(f'{label}: {problem}')
+
+        if problems:
+            raise CommandError(f'{label}: {problems} problem(s) found.')
+
+        self.stdout.write(f'{label}: numbering is valid.')
@@ -0,0 +1,25 @@
+from django.dispatch import Signal
+
+
+hierarchy_measured = Signal()
+"""Sent after a change list is built if instrumentation is enabled
+for a model admin (see `HierarchicalModelAdmin.hierarchy_instrumentation`).
+
+Arguments:
+    sender: Model class.
+    model_admin: Model admin instance.
+    request: HTTP request.
+    measurements: Dictionary {measure name: (queries count, seconds)}.
+
+"""
+
+
+hierarchy_changed = Signal()
+"""Sent after nodes are changed in bulk (e.g. moved) bypassing model signals.
+Caches of children stats (if any) are invalidated on it.
+
+Arguments:
+    sender: Model class.
+    affected_ids: IDs of nodes whose children stats are affected.
+
+"""
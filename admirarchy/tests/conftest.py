@@ -6,4 +6,10 @@ pytest_plugins = configure_djangoapp_plugin(
          'LANGUAGE_CODE': 'ru',
     },
     admin_contrib=True,
+    extend_DATABASES={
+        'replica': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': ':memory:',
+        },
+    },
 )
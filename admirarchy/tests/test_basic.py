@@ -1,11 +1,35 @@
+from copy import copy
+
+import pytest
 from django import VERSION
 
-from .testapp.models import AdjacencyListModel, NestedSetModel
+from admirarchy.toolbox import AdjacencyList
+
+from .testapp.models import (
+    AdjacencyListModel, NestedSetModel, MaterializedPathModel, ClosureTableModel, ClosureTableModelRelation,
+)
 
 
 VERSION_PRE_19 = VERSION < (1, 9)
 
 
+def make_closure_node(title, parent=None):
+    """Creates a closure table node along with its closure rows."""
+    node = ClosureTableModel.objects.create(title=title)
+
+    relations = [ClosureTableModelRelation(ancestor=node, descendant=node, depth=0)]
+
+    if parent is not None:
+        relations.extend(
+            ClosureTableModelRelation(ancestor_id=relation.ancestor_id, descendant=node, depth=relation.depth + 1)
+            for relation in ClosureTableModelRelation.objects.filter(descendant=parent)
+        )
+
+    ClosureTableModelRelation.objects.bulk_create(relations)
+
+    return node
+
+
 def actual_test(model_id, user_create, request_client):
 
     user = user_create(superuser=True)
@@ -43,7 +67,9 @@ def actual_test(model_id, user_create, request_client):
         assert '/2/change/?_changelist_filters=pid%3D1' in resp.rendered_content
         assert '/3/change/?_changelist_filters=pid%3D1' in resp.rendered_content
 
-    assert model_id + '_parent' not in resp.rendered_content
+    # Parent is only mentioned in breadcrumbs.
+    assert '&rsaquo; %s_parent\n</div>' % model_id in resp.rendered_content
+    assert model_id + '_parent' not in resp.rendered_content.split('id="content-main"')[1]
     assert model_id + '_child1' in resp.rendered_content
     assert model_id + '_child2' in resp.rendered_content
 
@@ -90,3 +116,1854 @@ def test_nested_set(request_client, user_create):
     make_node('child3', left=5, right=6, level=2)
 
     actual_test('nestedsetmodel', user_create, request_client)
+
+
+def test_materialized_path(request_client, user_create):
+
+    def make_node(title, path):
+        node = MaterializedPathModel(title=title, path=path, depth=len(path) // 4)
+        node.save()
+        return node
+
+    make_node('parent', '0001')
+    make_node('child1', '00010001')
+    make_node('child2', '00010002')
+    make_node('child3', '000100020001')
+
+    actual_test('materializedpathmodel', user_create, request_client)
+
+
+def test_closure_table(request_client, user_create):
+
+    parent = make_closure_node('parent')
+    make_closure_node('child1', parent=parent)
+    child2 = make_closure_node('child2', parent=parent)
+    make_closure_node('child3', parent=child2)
+
+    actual_test('closuretablemodel', user_create, request_client)
+
+    client = request_client()
+    client.force_login(user_create(superuser=True))
+
+    resp = client.get('/admin/testapp/closuretablemodel/').rendered_content
+    assert 'Объектов внутри: 2, всего: 3' in resp
+
+
+def test_adjacency_list_count_in_query(request_client, user_create, db_queries, monkeypatch):
+    from django.contrib import admin
+
+    monkeypatch.setattr(admin.site._registry[AdjacencyListModel], 'hierarchy', AdjacencyList(count_in_query=True))
+
+    parent = AdjacencyListModel.objects.create(title='parent')
+    child = AdjacencyListModel.objects.create(title='child1', parent=parent)
+    AdjacencyListModel.objects.create(title='child2', parent=parent)
+    AdjacencyListModel.objects.create(title='child3', parent=child)
+
+    user = user_create(superuser=True)
+    client = request_client()
+    assert client.login(username=user.username, password='password')
+
+    db_queries.clear()
+    resp = client.get('/admin/testapp/adjacencylistmodel/').rendered_content
+
+    assert f'href="?pid={parent.pk}"' in resp
+    assert 'Объектов внутри: 2' in resp
+
+    resp = client.get(f'/admin/testapp/adjacencylistmodel/?pid={parent.pk}').rendered_content
+
+    assert f'href="?pid={child.pk}"' in resp
+    assert 'Объектов внутри: 1' in resp
+
+    # No separate children stats query with `IN (...)` list.
+    assert not [sql for sql in db_queries.sql() if '"parent_id" IN (' in sql]
+
+    # Only objects of the page are annotated, counting is not.
+    assert [sql for sql in db_queries.sql() if 'admirarchy_child_count' in sql]
+    assert not [sql for sql in db_queries.sql() if 'COUNT(*)' in sql and 'admirarchy_child_count' in sql]
+
+
+def test_nested_set_counts(request_client, user_create, db_queries):
+
+    def make_node(title, left, right, level):
+        return NestedSetModel.objects.create(title=title, lft=left, rgt=right, level=level)
+
+    parent = make_node('parent', left=1, right=12, level=0)
+    make_node('child1', left=2, right=3, level=1)
+    child2 = make_node('child2', left=4, right=9, level=1)
+    make_node('child21', left=5, right=6, level=2)
+    make_node('child22', left=7, right=8, level=2)
+    child3 = make_node('child3', left=10, right=11, level=1)
+
+    user = user_create(superuser=True)
+    client = request_client()
+    assert client.login(username=user.username, password='password')
+
+    resp = client.get('/admin/testapp/nestedsetmodel/').rendered_content
+    assert 'Объектов внутри: 3, всего: 5' in resp
+
+    db_queries.clear()
+    resp = client.get(f'/admin/testapp/nestedsetmodel/?pid={parent.pk}').rendered_content
+
+    assert f'href="?pid={child2.pk}" class="icon icon-folder" title="Объектов внутри: 2"' in resp
+    assert f'href="?pid={child3.pk}"' not in resp
+
+    # Leaf nodes are detected without queries, children of others are counted at once.
+    assert len([sql for sql in db_queries.sql() if 'GROUP BY' in sql]) == 1
+
+
+def test_nested_set_count_children_many(db_queries):
+    from admirarchy.toolbox import NestedSet
+
+    NestedSetModel.objects.bulk_create([
+        NestedSetModel(title=f'{kind}{idx}', lft=idx * 4 + offset, rgt=idx * 4 + offset + width, level=level)
+        for idx in range(600)
+        for kind, offset, width, level in (('parent', 1, 3, 0), ('child', 2, 1, 1))
+    ])
+    parents = list(NestedSetModel.objects.filter(level=0))
+
+    db_queries.clear()
+    counts = NestedSet().count_children(NestedSetModel.objects.all(), parents)
+
+    # One grouped query with a parameter per object (fits SQLite variables limit).
+    assert len(db_queries) == 1
+    assert set(counts.values()) == {1}
+    assert len(counts) == 600
+
+
+def make_chain(model):
+    """Creates root > a > b > c chain of nodes."""
+    if model is AdjacencyListModel:
+        nodes = []
+        parent = None
+
+        for title in ('root', 'a', 'b', 'c'):
+            parent = model.objects.create(title=title, parent=parent)
+            nodes.append(parent)
+
+        return nodes
+
+    if model is ClosureTableModel:
+        nodes = []
+        parent = None
+
+        for title in ('root', 'a', 'b', 'c'):
+            parent = make_closure_node(title, parent=parent)
+            nodes.append(parent)
+
+        return nodes
+
+    if model is MaterializedPathModel:
+        return [
+            model.objects.create(title=title, path='0001' * (idx + 1), depth=idx + 1)
+            for idx, title in enumerate(('root', 'a', 'b', 'c'))
+        ]
+
+    return [
+        model.objects.create(title=title, lft=idx + 1, rgt=8 - idx, level=idx)
+        for idx, title in enumerate(('root', 'a', 'b', 'c'))
+    ]
+
+
+@pytest.mark.parametrize('model', [AdjacencyListModel, NestedSetModel, MaterializedPathModel, ClosureTableModel])
+def test_breadcrumbs(model, request_client, user_create, db_queries, monkeypatch):
+    from django.contrib import admin
+    from admirarchy.toolbox import AncestorsCache
+
+    model_admin = admin.site._registry[model]
+    hierarchy = copy(model_admin.hierarchy) if model is not AdjacencyListModel else AdjacencyList()
+    hierarchy.ancestors_cache = AncestorsCache()
+    monkeypatch.setattr(model_admin, 'hierarchy', hierarchy)
+
+    root, a, b, c = make_chain(model)
+
+    user = user_create(superuser=True)
+    client = request_client()
+    assert client.login(username=user.username, password='password')
+
+    url = f'/admin/testapp/{model._meta.model_name}/?pid={c.pk}'
+
+    db_queries.clear()
+    resp = client.get(url).rendered_content
+
+    assert (
+        '<div class="hierarchy-breadcrumbs">\n    '
+        '<a href="./">Корневой уровень</a> &rsaquo; '
+        f'<a href="?pid={root.pk}">{root}</a> &rsaquo; '
+        f'<a href="?pid={a.pk}">{a}</a> &rsaquo; '
+        f'<a href="?pid={b.pk}">{b}</a> &rsaquo; '
+        f'{c}\n</div>'
+    ) in resp
+
+    # Upper level link.
+    assert f'href="?pid={b.pk}" class="icon icon-folder-up"' in resp
+
+    path_queries = len(db_queries)
+
+    # Ancestors path is taken from cache.
+    db_queries.clear()
+    assert str(b) in client.get(url).rendered_content
+    assert len(db_queries) == path_queries - 1
+
+    # Every call gets its own objects, not shared with other requests.
+    query_set = model.objects.all()
+    path = hierarchy.get_path(query_set, c.pk)
+    path_again = hierarchy.get_path(query_set, c.pk)
+    assert [node.pk for node in path] == [node.pk for node in path_again] == [root.pk, a.pk, b.pk, c.pk]
+    assert not any(node is node_again for node, node_again in zip(path, path_again))
+    assert not any(hasattr(node, 'hierarchy_context') for node in path_again)
+    assert [str(node) for node in path_again] == [str(root), str(a), str(b), str(c)]
+
+
+def test_stats_cache(request_get, user_create, db_queries):
+    from django.contrib import admin
+    from admirarchy.toolbox import HierarchicalModelAdmin, StatsCache
+
+    class CachedAdmin(HierarchicalModelAdmin):
+
+        hierarchy = AdjacencyList()
+        hierarchy_stats_cache = StatsCache(key_prefix='cachetest')
+
+    model_admin = CachedAdmin(AdjacencyListModel, admin.site)
+
+    try:
+        root = AdjacencyListModel.objects.create(title='root')
+        branch = AdjacencyListModel.objects.create(title='branch', parent=root)
+        AdjacencyListModel.objects.create(title='leaf', parent=branch)
+
+        user = user_create(superuser=True)
+
+        def get_nav(pid=None):
+            url = f'/?pid={pid}' if pid else '/'
+            changelist = model_admin.get_changelist_instance(request_get(url, user=user))
+            return {obj.pk: obj.child_count for obj in changelist.result_list if obj.pk}
+
+        def count_stats_queries():
+            return len([sql for sql in db_queries.sql() if 'COUNT(' in sql and 'GROUP BY' in sql])
+
+        db_queries.clear()
+        assert get_nav(root.pk) == {branch.pk: 1}
+        assert count_stats_queries() == 1
+
+        # Stats are taken from cache.
+        db_queries.clear()
+        assert get_nav(root.pk) == {branch.pk: 1}
+        assert count_stats_queries() == 0
+
+        # New child invalidates its parent stats.
+        leaf2 = AdjacencyListModel.objects.create(title='leaf2', parent=branch)
+        assert get_nav(root.pk) == {branch.pk: 2}
+
+        # Reparenting invalidates both the old and the new parents (and ancestors).
+        assert get_nav() == {root.pk: 1}
+        leaf2.parent = root
+        leaf2.save()
+        assert get_nav(root.pk) == {branch.pk: 1, leaf2.pk: 0}
+        assert get_nav() == {root.pk: 2}
+
+        # Deletion.
+        branch.delete()
+        assert get_nav(root.pk) == {leaf2.pk: 0}
+        assert get_nav() == {root.pk: 1}
+
+    finally:
+        model_admin.hierarchy_disconnect()
+
+
+def test_hierarchy_signals_disconnect(request_get, user_create):
+    from django.contrib import admin
+    from django.db.models import signals
+    from admirarchy.toolbox import HierarchicalModelAdmin, StatsCache
+
+    class CustomAdjacencyList(AdjacencyList):
+
+        def __init__(self):
+            # Base classes initializers are not called: `Hierarchy` class level defaults are used.
+            self.pid_field = 'parent'
+            self.pid_field_real = 'parent_id'
+            self.count_in_query = False
+
+    class CustomAdmin(HierarchicalModelAdmin):
+
+        hierarchy = CustomAdjacencyList()
+        hierarchy_stats_cache = StatsCache(key_prefix='disconnecttest')
+
+    def has_receivers():
+        return signals.post_save.has_listeners(AdjacencyListModel) and any(
+            str(id(CustomAdmin.hierarchy)) in str(lookup_key)
+            for lookup_key, _ in signals.post_save.receivers)
+
+    model_admin = CustomAdmin(AdjacencyListModel, admin.site)
+
+    try:
+        root = AdjacencyListModel.objects.create(title='root')
+        AdjacencyListModel.objects.create(title='leaf', parent=root)
+
+        changelist = model_admin.get_changelist_instance(request_get('/', user=user_create(superuser=True)))
+        assert [obj.child_count for obj in changelist.result_list] == [1]
+        assert has_receivers()
+
+    finally:
+        model_admin.hierarchy_disconnect()
+
+    assert not has_receivers()
+
+    # Nothing to disconnect.
+    model_admin.hierarchy_disconnect()
+
+
+def test_child_count_field(request_get, user_create, db_queries, command_run, capsys, monkeypatch):
+    from django.contrib import admin
+    from admirarchy.utils import ChildCountMaintainer
+
+    hierarchy = AdjacencyList(child_count_field='children_num', child_count_maintain=True)
+    maintainer = ChildCountMaintainer(AdjacencyListModel, hierarchy)
+    maintainer.connect()
+
+    def get_counts():
+        return dict(AdjacencyListModel.objects.values_list('title', 'children_num'))
+
+    try:
+        root = AdjacencyListModel.objects.create(title='root')
+        branch = AdjacencyListModel.objects.create(title='branch', parent=root)
+        leaf = AdjacencyListModel.objects.create(title='leaf', parent=branch)
+        AdjacencyListModel.objects.create(title='leaf2', parent=branch)
+
+        assert get_counts() == {'root': 1, 'branch': 2, 'leaf': 0, 'leaf2': 0}
+
+        # Reparent.
+        leaf.parent = root
+        leaf.save()
+        assert get_counts() == {'root': 2, 'branch': 1, 'leaf': 0, 'leaf2': 0}
+
+        # Save without moving.
+        leaf.title = 'leaf1'
+        leaf.save()
+        assert get_counts() == {'root': 2, 'branch': 1, 'leaf1': 0, 'leaf2': 0}
+
+        # New parent is read from the instance, old one only queried for existing objects.
+        db_queries.clear()
+        added = AdjacencyListModel.objects.create(title='leaf3', parent=branch)
+        assert len([sql for sql in db_queries.sql() if sql.startswith('SELECT')]) == 0
+
+        db_queries.clear()
+        added.title = 'leaf33'
+        added.save(update_fields=['title'])
+        assert len(db_queries) == 1
+
+        added.parent = root
+        added.save(update_fields=['parent'])
+        assert get_counts() == {'root': 3, 'branch': 1, 'leaf1': 0, 'leaf2': 0, 'leaf33': 0}
+
+        added.delete()
+        assert get_counts() == {'root': 2, 'branch': 1, 'leaf1': 0, 'leaf2': 0}
+
+        # Delete.
+        leaf.delete()
+        assert get_counts() == {'root': 1, 'branch': 1, 'leaf2': 0}
+
+    finally:
+        maintainer.disconnect()
+
+    # Counts are read from objects.
+    model_admin = admin.site._registry[AdjacencyListModel]
+    monkeypatch.setattr(model_admin, 'hierarchy', hierarchy)
+
+    db_queries.clear()
+    changelist = model_admin.get_changelist_instance(request_get(f'/?pid={root.pk}', user=user_create(superuser=True)))
+    assert [obj.child_count for obj in changelist.result_list if obj.pk] == [1]
+    assert not [sql for sql in db_queries.sql() if 'GROUP BY' in sql]
+
+    # Repair command.
+    AdjacencyListModel.objects.update(children_num=10)
+    command_run('admirarchy_child_counts', args=['testapp.AdjacencyListModel'], options={'batch_size': 2})
+
+    assert get_counts() == {'root': 1, 'branch': 1, 'leaf2': 0}
+    assert 'testapp.adjacencylistmodel: 3 object(s) processed.' in capsys.readouterr().out
+
+
+def test_get_hierarchical_admins():
+    from django.contrib.admin import AdminSite, ModelAdmin
+    from admirarchy.toolbox import HierarchicalModelAdmin, NestedSet
+    from admirarchy.utils import get_hierarchical_admins
+    from .testapp.models import ItemModel
+
+    site = AdminSite(name='other')
+    site.register(ItemModel, type('ItemModelAdmin', (HierarchicalModelAdmin,), {'hierarchy': NestedSet()}))
+    site.register(AdjacencyListModel, ModelAdmin)
+
+    admins = get_hierarchical_admins()
+
+    # Models registered with any site are found, hierarchies are initialized.
+    assert isinstance(admins[ItemModel].hierarchy, NestedSet)
+    assert isinstance(admins[AdjacencyListModel], HierarchicalModelAdmin)
+    assert ClosureTableModel in admins
+
+
+def test_nested_set_trees(request_client, user_create, monkeypatch):
+    from django.contrib import admin
+    from admirarchy.toolbox import NestedSet
+
+    monkeypatch.setattr(
+        admin.site._registry[NestedSetModel], 'hierarchy', NestedSet(tree_id_field='tree_id'))
+
+    def make_node(title, left, right, level, tree_id):
+        return NestedSetModel.objects.create(title=title, lft=left, rgt=right, level=level, tree_id=tree_id)
+
+    # Two trees numbered independently.
+    root1 = make_node('root1', left=1, right=6, level=0, tree_id=1)
+    make_node('child11', left=2, right=3, level=1, tree_id=1)
+    make_node('child12', left=4, right=5, level=1, tree_id=1)
+
+    root2 = make_node('root2', left=1, right=4, level=0, tree_id=2)
+    child21 = make_node('child21', left=2, right=3, level=1, tree_id=2)
+
+    client = request_client()
+    client.force_login(user_create(superuser=True))
+
+    resp = client.get('/admin/testapp/nestedsetmodel/').rendered_content
+
+    assert 'nestedsetmodel_root1' in resp
+    assert 'nestedsetmodel_root2' in resp
+    assert f'href="?pid={root1.pk}" class="icon icon-folder" title="Объектов внутри: 2"' in resp
+    assert f'href="?pid={root2.pk}" class="icon icon-folder" title="Объектов внутри: 1"' in resp
+
+    resp = client.get(f'/admin/testapp/nestedsetmodel/?pid={root2.pk}').rendered_content.split('id="content-main"')[1]
+
+    assert 'nestedsetmodel_child21' in resp
+    assert 'nestedsetmodel_child1' not in resp
+
+    resp = client.get(f'/admin/testapp/nestedsetmodel/?pid={child21.pk}').rendered_content
+
+    assert f'<a href="?pid={root2.pk}">nestedsetmodel_root2</a>' in resp
+    assert 'nestedsetmodel_root1' not in resp
+
+
+def test_custom_hierarchy_unsupported(request_client, request_get, user_create):
+    from django.contrib import admin
+    from django.db.models import Count
+    from admirarchy.toolbox import HierarchicalModelAdmin, Rollup
+    from django.http import Http404
+    from admirarchy.utils import Hierarchy
+
+    class ChildrenOnly(Hierarchy):
+        """Custom hierarchy implementing navigation only."""
+
+        def hook_get_queryset(self, changelist, request):
+            changelist.hierarchy_context.pid = self.get_pid_from_request(changelist, request)
+
+        def hook_filter_queryset(self, changelist, query_set):
+            if changelist.query:
+                return query_set
+            return self.filter_children(query_set, changelist.hierarchy_context.pid)
+
+        def filter_children(self, query_set, node):
+            return query_set.filter(parent=node)
+
+    class CustomAdmin(HierarchicalModelAdmin):
+
+        hierarchy = ChildrenOnly()
+        search_fields = ['title']
+        hierarchy_search_in_branch = True
+        hierarchy_tree_depth = 3
+        hierarchy_export = True
+        hierarchy_move = True
+        hierarchy_delete = True
+        hierarchy_rollups = {'subtree_size': Rollup(Count)}
+        list_display = ['title', 'subtree_size']
+
+    model_admin = CustomAdmin(AdjacencyListModel, admin.site)
+    hierarchy = model_admin.hierarchy
+
+    assert hierarchy.supports('filter_children')
+    assert not hierarchy.supports('filter_subtree')
+    assert not hierarchy.can_move()
+    assert not hierarchy.can_delete(AdjacencyListModel)
+
+    root = AdjacencyListModel.objects.create(title='root')
+    AdjacencyListModel.objects.create(title='leaf', parent=root)
+    AdjacencyListModel.objects.create(title='leaf_other')
+
+    user = user_create(superuser=True)
+    request = request_get(f'/?pid={root.pk}&q=leaf&tree=2', user=user)
+
+    # Search is not scoped, tree display mode and rollups are off.
+    changelist = model_admin.get_changelist_instance(request)
+    assert not changelist.hierarchy_context.search_scoped
+    assert changelist.tree_depth is None
+    assert changelist.hierarchy_context.tree_links == []
+    assert changelist.hierarchy_context.export_links == []
+    assert 'subtree_size' not in changelist.list_display
+    assert sorted(obj.title for obj in changelist.result_list if obj.pk) == ['leaf', 'leaf_other']
+
+    actions = model_admin.get_actions(request)
+    assert 'hierarchy_move_selected' not in actions
+    assert 'hierarchy_delete_selected' not in actions
+    assert 'delete_selected' in actions
+
+    with pytest.raises(Http404):
+        model_admin.hierarchy_export_view(request)
+
+    model_admin.hierarchy_disconnect()
+
+
+def test_level_size(request_get, user_create, db_queries):
+    from django.contrib import admin
+    from admirarchy.toolbox import HierarchicalModelAdmin
+
+    class SizedAdmin(HierarchicalModelAdmin):
+
+        hierarchy = AdjacencyList(child_count_field='children_num')
+        list_per_page = 2
+        show_full_result_count = False
+        search_fields = ['title']
+
+    model_admin = SizedAdmin(AdjacencyListModel, admin.site)
+
+    root = AdjacencyListModel.objects.create(title='root', children_num=3)
+
+    for idx in range(3):
+        AdjacencyListModel.objects.create(title=f'child{idx}', parent=root)
+
+    user = user_create(superuser=True)
+
+    def get_changelist(query):
+        db_queries.clear()
+        return model_admin.get_changelist_instance(request_get(f'/?pid={root.pk}{query}', user=user))
+
+    def count_queries():
+        return len([sql for sql in db_queries.sql() if 'COUNT(*)' in sql])
+
+    # Level size is taken from parent.
+    changelist = get_changelist('&p=2')
+    assert changelist.result_count == 3
+    assert changelist.paginator.num_pages == 2
+    assert [obj.title for obj in changelist.result_list if obj.pk] == ['child0']
+    assert count_queries() == 0
+
+    # Search and filters require counting.
+    changelist = get_changelist('&q=child')
+    assert changelist.result_count == 3
+    assert count_queries() == 1
+
+    changelist = get_changelist('&title=child1')
+    assert changelist.result_count == 1
+    assert count_queries() == 1
+
+    # Restricted query set requires counting.
+    class RestrictedAdmin(SizedAdmin):
+
+        def get_queryset(self, request):
+            return super().get_queryset(request).exclude(title='child2')
+
+    model_admin = RestrictedAdmin(AdjacencyListModel, admin.site)
+
+    changelist = get_changelist('')
+    assert changelist.result_count == 2
+    assert count_queries() == 1
+
+    # Unless explicitly allowed.
+    model_admin.hierarchy_level_size_from_stats = True
+
+    changelist = get_changelist('')
+    assert changelist.result_count == 3
+    assert count_queries() == 0
+
+
+def test_keyset_pagination(request_get, user_create, db_queries):
+    from urllib.parse import parse_qs
+    from django.contrib import admin
+    from django.contrib.admin.options import IncorrectLookupParameters
+    from admirarchy.toolbox import HierarchicalModelAdmin, NestedSet
+
+    class KeysetAdmin(HierarchicalModelAdmin):
+
+        hierarchy = NestedSet()
+        hierarchy_keyset_pagination = True
+        list_per_page = 2
+
+    model_admin = KeysetAdmin(NestedSetModel, admin.site)
+
+    root = NestedSetModel.objects.create(pk=1, title='root', lft=1, rgt=12, level=0)
+
+    for idx in range(5):
+        left = 2 + idx * 2
+        # Primary keys are in reverse order to make sure objects are sorted by left.
+        NestedSetModel.objects.create(pk=10 - idx, title=f'child{idx}', lft=left, rgt=left + 1, level=1)
+
+    user = user_create(superuser=True)
+
+    def get_changelist(query=''):
+        db_queries.clear()
+        return model_admin.get_changelist_instance(request_get(f'/?pid={root.pk}&_popup=1{query}', user=user))
+
+    def get_titles(changelist):
+        return [obj.title for obj in changelist.result_list if not getattr(obj, 'dummy', False)]
+
+    def get_query(url):
+        assert url.startswith('?')
+        query = parse_qs(url[1:])
+        assert query['pid'] == [str(root.pk)]
+        assert query['_popup'] == ['1']
+        return '&cursor=%s' % query['cursor'][0] if 'cursor' in query else ''
+
+    changelist = get_changelist()
+    assert get_titles(changelist) == ['child0', 'child1']
+    assert changelist.keyset_previous_url is None
+
+    changelist = get_changelist(get_query(changelist.keyset_next_url))
+    assert get_titles(changelist) == ['child2', 'child3']
+    assert not [sql for sql in db_queries.sql() if 'OFFSET' in sql]
+
+    # Navigation links start from the first page and keep popup mode.
+    upper = changelist.result_list[0]
+    nav = model_admin.hierarchy_nav(upper)
+    assert '_popup=1' in nav
+    assert 'cursor' not in nav
+
+    changelist_last = get_changelist(get_query(changelist.keyset_next_url))
+    assert get_titles(changelist_last) == ['child4']
+    assert changelist_last.keyset_next_url is None
+
+    changelist = get_changelist(get_query(changelist_last.keyset_previous_url))
+    assert get_titles(changelist) == ['child2', 'child3']
+
+    changelist = get_changelist(get_query(changelist.keyset_previous_url))
+    assert get_titles(changelist) == ['child0', 'child1']
+    assert changelist.keyset_previous_url is None
+
+    # Sorting by a column falls back to page numbers.
+    changelist = get_changelist('&o=-2&p=2')
+    assert changelist.keyset_ordering is None
+    assert get_titles(changelist) == ['child2', 'child3']
+
+    with pytest.raises(IncorrectLookupParameters):
+        get_changelist('&cursor=bogus')
+
+    # Rendered.
+    content = model_admin.changelist_view(request_get(f'/?pid={root.pk}', user=user)).rendered_content
+    assert 'cursor=' in content
+    assert '?p=' not in content
+
+
+@pytest.mark.parametrize('model', [AdjacencyListModel, NestedSetModel, MaterializedPathModel, ClosureTableModel])
+def test_children_endpoint(model, request_client, user_create, monkeypatch):
+    from django.contrib import admin
+
+    model_admin = admin.site._registry[model]
+    root, a, b, c = make_chain(model)
+
+    user = user_create(superuser=True)
+    client = request_client()
+    assert client.login(username=user.username, password='password')
+
+    url = f'/admin/testapp/{model._meta.model_name}/hierarchy/children/'
+
+    # Endpoint is off unless inline expansion is enabled.
+    assert client.get(url).status_code == 404
+
+    page_url = f'/admin/testapp/{model._meta.model_name}/?pid={a.pk}'
+    assert 'data-hierarchy-pid' not in client.get(page_url).rendered_content
+
+    monkeypatch.setattr(model_admin, 'hierarchy_expand_inline', True, raising=False)
+
+    data = client.get(url).json()
+    assert data['pid'] is None
+    assert [(item['id'], item['child_count']) for item in data['results']] == [(str(root.pk), 1)]
+    assert data['next'] is None
+
+    data = client.get(f'{url}?pid={a.pk}').json()
+    assert data['pid'] == str(a.pk)
+    assert data['results'] == [{
+        'id': str(b.pk),
+        'title': str(b),
+        'url': f'/admin/testapp/{model._meta.model_name}/{b.pk}/change/',
+        'child_count': 1,
+        'descendant_count': data['results'][0]['descendant_count'],
+    }]
+
+    data = client.get(f'{url}?pid={c.pk}').json()
+    assert data['results'] == []
+
+    # Inline expansion.
+    content = client.get(page_url).rendered_content
+    assert f'href="?pid={b.pk}" class="icon icon-folder" title="Объектов внутри: 1" data-hierarchy-pid="{b.pk}"' in content
+    assert f"var expandUrl = '{url}'" in content
+
+
+def test_level_urls_encoded(request_get, user_create, monkeypatch):
+    from django.contrib import admin
+
+    model_admin = admin.site._registry[AdjacencyListModel]
+    monkeypatch.setattr(model_admin, 'hierarchy_export', True, raising=False)
+
+    changelist = model_admin.get_changelist_instance(request_get('/', user=user_create(superuser=True)))
+    context = changelist.hierarchy_context
+
+    assert context.get_url() == './'
+    assert context.get_url('a&b#c') == '?pid=a%26b%23c'
+
+    context.pid = 'a&b#c'
+    assert [url for url, _ in context.export_links] == [
+        '/admin/testapp/adjacencylistmodel/hierarchy/export/?pid=a%26b%23c&format=csv',
+        '/admin/testapp/adjacencylistmodel/hierarchy/export/?pid=a%26b%23c&format=jsonl',
+    ]
+
+
+def test_children_endpoint_paging(request_client, user_create, monkeypatch):
+    from django.contrib import admin
+
+    model_admin = admin.site._registry[AdjacencyListModel]
+    monkeypatch.setattr(model_admin, 'list_per_page', 2)
+    monkeypatch.setattr(model_admin, 'hierarchy_expand_inline', True)
+
+    root = AdjacencyListModel.objects.create(title='root')
+
+    for idx in range(3):
+        AdjacencyListModel.objects.create(title=f'child{idx}', parent=root)
+
+    user = user_create(superuser=True)
+    client = request_client()
+    assert client.login(username=user.username, password='password')
+
+    url = f'/admin/testapp/adjacencylistmodel/hierarchy/children/?pid={root.pk}'
+
+    data = client.get(url).json()
+    assert [item['title'] for item in data['results']] == ['adjacencylistmodel_child2', 'adjacencylistmodel_child1']
+    assert data['next']
+
+    data = client.get(f"{url}&cursor={data['next']}").json()
+    assert [item['title'] for item in data['results']] == ['adjacencylistmodel_child0']
+    assert data['next'] is None
+
+    assert client.get(f'{url}&cursor=bogus').status_code == 404
+
+    # Permissions are checked.
+    staff = user_create(attributes={'is_staff': True})
+    client = request_client()
+    assert client.login(username=staff.username, password='password')
+    assert client.get(url).status_code == 403
+
+
+@pytest.mark.parametrize('model', [AdjacencyListModel, NestedSetModel, MaterializedPathModel, ClosureTableModel])
+def test_search_paths(model, request_client, user_create, db_queries, monkeypatch):
+    from django.contrib import admin
+    from admirarchy.toolbox import AncestorsCache
+
+    model_admin = admin.site._registry[model]
+    hierarchy = copy(model_admin.hierarchy) if model is not AdjacencyListModel else AdjacencyList()
+    monkeypatch.setattr(model_admin, 'hierarchy', hierarchy)
+
+    root, a, b, c = make_chain(model)
+
+    # Paths for a page are fetched with one query.
+    db_queries.clear()
+    paths = hierarchy.get_paths(model.objects.all(), [root, b, c])
+    assert len(db_queries) == 1
+    assert paths == {root.pk: [root], b.pk: [root, a, b], c.pk: [root, a, b, c]}
+
+    # Common ancestors are cached.
+    hierarchy.ancestors_cache = AncestorsCache()
+    hierarchy.get_paths(model.objects.all(), [c])
+
+    db_queries.clear()
+    assert hierarchy.get_paths(model.objects.all(), [a, b]) == {a.pk: [root, a], b.pk: [root, a, b]}
+    assert len(db_queries) == 0
+
+    user = user_create(superuser=True)
+    client = request_client()
+    assert client.login(username=user.username, password='password')
+
+    url = f'/admin/testapp/{model._meta.model_name}/?q=c'
+
+    content = client.get(url).rendered_content
+    assert 'Расположение' in content
+    assert (
+        f'<a href="?pid={root.pk}">{root}</a> &rsaquo; '
+        f'<a href="?pid={a.pk}">{a}</a> &rsaquo; '
+        f'<a href="?pid={b.pk}">{b}</a>'
+    ) in content
+
+    assert 'Расположение' not in client.get(f'/admin/testapp/{model._meta.model_name}/').rendered_content
+
+    monkeypatch.setattr(model_admin, 'hierarchy_search_paths', False, raising=False)
+    assert 'Расположение' not in client.get(url).rendered_content
+
+
+@pytest.mark.parametrize('model', [AdjacencyListModel, NestedSetModel, MaterializedPathModel, ClosureTableModel])
+def test_search_in_branch(model, request_get, user_create, monkeypatch):
+    from django.contrib import admin
+
+    model_admin = admin.site._registry[model]
+    root, a, b, c = make_chain(model)
+
+    user = user_create(superuser=True)
+
+    def search(query, pid):
+        changelist = model_admin.get_changelist_instance(request_get(f'/?q={query}&pid={pid}', user=user))
+        return [obj.pk for obj in changelist.result_list if not getattr(obj, 'dummy', False)]
+
+    # Global search by default.
+    assert search('a', a.pk) == [a.pk]
+
+    monkeypatch.setattr(model_admin, 'hierarchy_search_in_branch', True, raising=False)
+
+    assert search('a', a.pk) == []
+    assert search('c', a.pk) == [c.pk]
+    assert search('b', b.pk) == []
+    assert search('b', root.pk) == [b.pk]
+
+    content = model_admin.changelist_view(request_get(f'/?pid={b.pk}', user=user)).rendered_content
+    assert f'<input type="hidden" name="pid" value="{b.pk}" form="changelist-search">' in content
+
+
+def test_nested_set_rebuild(command_run, capsys):
+    from django.core.management.base import CommandError
+    from admirarchy.toolbox import NestedSet, NestedSetBuilder
+
+    def make_node(title, parent=None):
+        return NestedSetModel.objects.create(title=title, parent=parent, lft=0, rgt=0, level=0)
+
+    root = make_node('root')
+    a = make_node('a', parent=root)
+    a1 = make_node('a1', parent=a)
+    b = make_node('b', parent=root)
+    root2 = make_node('root2')
+
+    def get_numbering():
+        return {
+            title: values for title, *values in
+            NestedSetModel.objects.values_list('title', 'lft', 'rgt', 'level', 'tree_id')
+        }
+
+    with pytest.raises(CommandError):
+        command_run('admirarchy_rebuild', args=['testapp.NestedSetModel'], options={'check': True})
+
+    assert 'overlap at lft=0' in capsys.readouterr().err
+
+    command_run('admirarchy_rebuild', args=['testapp.NestedSetModel'], options={'batch_size': 2})
+
+    out = capsys.readouterr().out
+    assert 'testapp.nestedsetmodel: 4 object(s) processed' in out
+    assert 'testapp.nestedsetmodel: rebuilt 5 object(s)' in out
+    assert 'numbering is valid' in out
+
+    assert get_numbering() == {
+        'root': [1, 8, 0, 1],
+        'a': [2, 5, 1, 1],
+        'a1': [3, 4, 2, 1],
+        'b': [6, 7, 1, 1],
+        'root2': [9, 10, 0, 1],
+    }
+
+    # Separate trees.
+    builder = NestedSetBuilder(NestedSetModel, NestedSet(tree_id_field='tree_id'))
+    assert builder.rebuild() == (5, 0)
+    assert list(builder.verify()) == []
+    assert get_numbering()['root2'] == [1, 2, 0, 2]
+
+    # Objects within cycles are left intact.
+    cycled1 = make_node('cycled1')
+    cycled2 = make_node('cycled2', parent=cycled1)
+    NestedSetModel.objects.filter(pk=cycled1.pk).update(parent=cycled2)
+
+    assert NestedSetBuilder(NestedSetModel, NestedSet(tree_id_field='tree_id')).rebuild(batch_size=1) == (5, 2)
+    assert get_numbering()['a1'] == [3, 4, 2, 1]
+    assert get_numbering()['cycled2'] == [0, 0, 0, 1]
+    NestedSetModel.objects.filter(pk__in=[cycled1.pk, cycled2.pk]).delete()
+
+    # Problems are detected.
+    NestedSetModel.objects.filter(title='a1').update(level=5)
+    NestedSetModel.objects.filter(title='b').update(lft=7, rgt=9, parent=root2)
+
+    assert list(builder.verify()) == [
+        f'{a1.pk}: level mismatch 5 (expected 2)',
+        f'{b.pk}: gap at lft=7 (expected 6)',
+        f'{b.pk}: overlap with {root.pk} at rgt=9',
+        f'{b.pk}: parent mismatch {root2.pk} (expected {root.pk})',
+        f'{b.pk}: gap at rgt=9 (expected 8)',
+        f'{root.pk}: overlap at rgt=8 (expected 10)',
+    ]
+
+
+@pytest.mark.parametrize('model', [AdjacencyListModel, NestedSetModel, MaterializedPathModel, ClosureTableModel])
+def test_export(model, request_client, user_create, monkeypatch):
+    import json
+    from django.contrib import admin
+
+    model_admin = admin.site._registry[model]
+    root, a, b, c = make_chain(model)
+
+    user = user_create(superuser=True)
+    client = request_client()
+    assert client.login(username=user.username, password='password')
+
+    url_base = f'/admin/testapp/{model._meta.model_name}/'
+    url = f'{url_base}hierarchy/export/'
+
+    assert client.get(url).status_code == 403
+    assert 'hierarchy/export/' not in client.get(url_base).rendered_content
+
+    monkeypatch.setattr(model_admin, 'hierarchy_export', True, raising=False)
+
+    assert f'href="{url}?pid={a.pk}&amp;format=jsonl"' in client.get(f'{url_base}?pid={a.pk}').rendered_content
+
+    def read(response):
+        return b''.join(response.streaming_content).decode()
+
+    response = client.get(f'{url}?pid={a.pk}')
+    assert response['Content-Type'] == 'text/csv'
+    assert f'{model._meta.model_name}-{a.pk}.csv' in response['Content-Disposition']
+
+    lines = read(response).splitlines()
+    assert lines[0].startswith('hierarchy_depth,hierarchy_path,id,title')
+    assert [line.split(',')[:4] for line in lines[1:]] == [
+        ['0', f'{a}', str(a.pk), 'a'],
+        ['1', f'{a} / {b}', str(b.pk), 'b'],
+        ['2', f'{a} / {b} / {c}', str(c.pk), 'c'],
+    ]
+
+    response = client.get(f'{url}?format=jsonl')
+    rows = [json.loads(line) for line in read(response).splitlines()]
+    assert [(row['hierarchy_depth'], row['hierarchy_path'], row['id']) for row in rows] == [
+        (0, f'{root}', root.pk),
+        (1, f'{root} / {a}', a.pk),
+        (2, f'{root} / {a} / {b}', b.pk),
+        (3, f'{root} / {a} / {b} / {c}', c.pk),
+    ]
+
+    assert client.get(f'{url}?format=xml').status_code == 404
+    assert client.get(f'{url}?pid=9999').status_code == 404
+
+
+def test_instrumentation(request_get, user_create, caplog):
+    import logging
+    from django.contrib import admin
+    from admirarchy.signals import hierarchy_measured
+    from admirarchy.toolbox import HierarchicalModelAdmin, Instrumentation, StatsdCallback, log_measurements
+
+    class StatsdClient:
+
+        def __init__(self):
+            self.sent = []
+
+        def timing(self, name, value):
+            self.sent.append(('timing', name))
+
+        def incr(self, name, count):
+            self.sent.append(('incr', name, count))
+
+    statsd = StatsdClient()
+    reported = []
+
+    class InstrumentedAdmin(HierarchicalModelAdmin):
+
+        hierarchy = AdjacencyList()
+        hierarchy_instrumentation = Instrumentation(
+            callbacks=[log_measurements, StatsdCallback(statsd)],
+            server_timing=True,
+        )
+
+    model_admin = InstrumentedAdmin(AdjacencyListModel, admin.site)
+
+    def on_measured(sender, model_admin, request, measurements, **kwargs):
+        reported.append((sender, measurements))
+
+    hierarchy_measured.connect(on_measured)
+
+    root, a, b, c = make_chain(AdjacencyListModel)
+    user = user_create(superuser=True)
+
+    try:
+        with caplog.at_level(logging.DEBUG, logger='admirarchy'):
+            response = model_admin.changelist_view(request_get(f'/?pid={a.pk}', user=user))
+
+    finally:
+        hierarchy_measured.disconnect(on_measured)
+
+    sender, measurements = reported[0]
+    assert sender is AdjacencyListModel
+
+    assert {name: queries for name, (queries, _) in measurements.items()} == {
+        'get_queryset': 0,
+        'filter_queryset': 0,
+        'level_size': 0,
+        'get_results': 2,
+        'stats': 1,
+        'upper_level': 1,
+    }
+    assert all(seconds >= 0 for _, seconds in measurements.values())
+
+    assert 'admirarchy-stats;dur=' in response['Server-Timing']
+    assert 'desc="1 queries"' in response['Server-Timing']
+
+    assert ('incr', 'admirarchy.testapp.adjacencylistmodel.upper_level.queries', 1) in statsd.sent
+    assert ('timing', 'admirarchy.testapp.adjacencylistmodel.stats') in statsd.sent
+
+    assert f'testapp.adjacencylistmodel /?pid={a.pk}: get_queryset 0q' in caplog.text
+
+    # Disabled by default.
+    response = admin.site._registry[AdjacencyListModel].changelist_view(request_get(f'/?pid={a.pk}', user=user))
+    assert 'Server-Timing' not in response
+    assert len(reported) == 1
+
+
+@pytest.mark.parametrize('model', [AdjacencyListModel, NestedSetModel, MaterializedPathModel, ClosureTableModel])
+def test_tree_mode(model, request_get, user_create, monkeypatch):
+    from django.contrib import admin
+
+    model_admin = admin.site._registry[model]
+    root, a, b, c = make_chain(model)
+
+    user = user_create(superuser=True)
+
+    def get_tree(query):
+        changelist = model_admin.get_changelist_instance(request_get(f'/?{query}', user=user))
+        return changelist, [
+            (obj.pk, getattr(obj, 'hierarchy_depth', None)) for obj in changelist.result_list
+            if not getattr(obj, 'dummy', False)
+        ]
+
+    # Disabled by default.
+    changelist, _ = get_tree(f'pid={root.pk}&tree=2')
+    assert changelist.tree_depth is None
+
+    monkeypatch.setattr(model_admin, 'hierarchy_tree_depth', 3)
+
+    changelist, tree = get_tree(f'pid={root.pk}&tree=2')
+    assert changelist.tree_depth == 2
+    assert tree == [(a.pk, 1), (b.pk, 2)]
+
+    changelist, tree = get_tree(f'pid={a.pk}&tree=10')
+    assert changelist.tree_depth == 3  # Capped.
+    assert tree == [(b.pk, 1), (c.pk, 2)]
+
+    _, tree = get_tree('tree=2')
+    assert tree[:2] == [(root.pk, 1), (a.pk, 2)]
+
+    monkeypatch.setattr(model_admin, 'list_max_show_all', 1)
+
+    changelist, tree = get_tree(f'pid={root.pk}&tree=3')
+    assert changelist.tree_truncated
+    assert tree == [(a.pk, 1)]
+
+    content = model_admin.changelist_view(request_get(f'/?pid={root.pk}&tree=3', user=user)).rendered_content
+    assert 'padding-left: 0.0em' in content
+    assert '<p class="hierarchy-note">' in content
+    assert f'<li><a href="?pid={root.pk}">' in content
+
+    content = model_admin.changelist_view(request_get(f'/?pid={root.pk}', user=user)).rendered_content
+    assert f'<li><a href="?pid={root.pk}&amp;tree=3">' in content
+
+
+@pytest.mark.parametrize('model', [AdjacencyListModel, ClosureTableModel])
+def test_fetch_tree_limit(model, db_queries):
+    from django.contrib import admin
+
+    hierarchy = admin.site._registry[model].hierarchy
+
+    if model is AdjacencyListModel:
+        def make_node(title, parent=None):
+            return model.objects.create(title=title, parent=parent)
+
+    else:
+        make_node = make_closure_node
+
+    r1 = make_node('r1')
+    c2 = make_node('c2', parent=r1)
+    r3 = make_node('r3')
+    c4 = make_node('c4', parent=r3)
+    g5 = make_node('g5', parent=c2)
+    c6 = make_node('c6', parent=r1)
+
+    def fetch(node, depth, limit=None):
+        db_queries.clear()
+        tree = hierarchy.fetch_tree(model.objects.all(), node, depth, limit=limit)
+        return [(obj.title, depth) for obj, depth in tree]
+
+    # Depth-first, siblings ordered by ID.
+    assert fetch(None, 3) == [('r1', 1), ('c2', 2), ('g5', 3), ('c6', 2), ('r3', 1), ('c4', 2)]
+    assert fetch(None, 1) == [('r1', 1), ('r3', 1)]
+    assert fetch(r1.pk, 2) == [('c2', 1), ('g5', 2), ('c6', 1)]
+
+    # Limit is applied by DB.
+    assert fetch(None, 3, limit=4) == [('r1', 1), ('c2', 2), ('g5', 3), ('c6', 2)]
+    assert 'LIMIT' in db_queries.sql()[0]
+
+    # Subtrees of objects missing from query set are skipped.
+    tree = hierarchy.fetch_tree(model.objects.exclude(pk=c2.pk), None, 3)
+    assert [obj.title for obj, _ in tree] == ['r1', 'c6', 'r3', 'c4']
+
+    if model is AdjacencyListModel:
+        # Cycle back to the root is not followed.
+        model.objects.filter(pk=r1.pk).update(parent=g5)
+        assert fetch(r1.pk, 5) == [('c2', 1), ('g5', 2), ('c6', 1)]
+
+
+@pytest.mark.parametrize('tree_id_field', [None, 'tree_id'])
+def test_nested_set_move(tree_id_field, db_queries):
+    from django.core.exceptions import ValidationError
+    from admirarchy.toolbox import NestedSet, NestedSetBuilder
+
+    hierarchy = NestedSet(tree_id_field=tree_id_field, parent_field='parent')
+    builder = NestedSetBuilder(NestedSetModel, hierarchy)
+
+    def make_node(title, parent=None):
+        return NestedSetModel.objects.create(title=title, parent=parent, lft=0, rgt=0, level=0)
+
+    root = make_node('root')
+    a = make_node('a', parent=root)
+    a1 = make_node('a1', parent=a)
+    b = make_node('b', parent=root)
+    root2 = make_node('root2')
+    c = make_node('c', parent=root2)
+
+    builder.rebuild()
+
+    def move(nodes, target):
+        if target is not None:
+            target.refresh_from_db()
+
+        db_queries.clear()
+        moved = hierarchy.move(NestedSetModel.objects.filter(pk__in=[node.pk for node in nodes]), target)
+        queries = len(db_queries)
+
+        assert list(builder.verify()) == []
+        return moved, queries
+
+    def get_parent(node):
+        node.refresh_from_db()
+        return node.parent_id
+
+    # To the right.
+    assert move([a], b)[0] == 1
+    assert get_parent(a) == b.pk
+    assert get_parent(a1) == a.pk
+
+    # To the left and into another tree.
+    assert move([c], a)[0] == 1
+    assert get_parent(c) == a.pk
+
+    # Nested selection is moved along with its ancestor.
+    moved, queries = move([b, a1], root2)
+    assert moved == 1
+    assert queries <= 10
+    assert get_parent(b) == root2.pk
+    assert get_parent(a1) == a.pk
+
+    # To the root level.
+    assert move([a], None)[0] == 1
+    assert get_parent(a) is None
+
+    a.refresh_from_db()
+    assert a.level == 0
+    assert NestedSetModel.objects.get(pk=c.pk).level == 1
+
+    # Several subtrees are moved with one update per tree involved (and one for parents).
+    assert move([a1, c, b], root)[0] == 3
+    assert len([sql for sql in db_queries.sql() if sql.startswith('UPDATE')]) == (4 if tree_id_field else 2)
+    assert {get_parent(a1), get_parent(c), get_parent(b)} == {root.pk}
+
+    with pytest.raises(ValidationError):
+        move([root], b)
+
+    with pytest.raises(ValidationError):
+        move([a], a)
+
+
+def test_adjacency_list_move(db_queries):
+    from django.core.exceptions import ValidationError
+
+    hierarchy = AdjacencyList(child_count_field='children_num')
+
+    root, a, b, c = make_chain(AdjacencyListModel)
+    d = AdjacencyListModel.objects.create(title='d', parent=root)
+
+    def move(nodes, target):
+        db_queries.clear()
+        moved = hierarchy.move(AdjacencyListModel.objects.filter(pk__in=[node.pk for node in nodes]), target)
+        return moved, len(db_queries)
+
+    def get_parent(node):
+        node.refresh_from_db()
+        return node.parent_id
+
+    with pytest.raises(ValidationError):
+        move([a], c)
+
+    with pytest.raises(ValidationError):
+        move([d, a], a)
+
+    from admirarchy.signals import hierarchy_changed
+
+    changed = []
+
+    def on_change(sender, affected_ids, **kwargs):
+        changed.append(set(affected_ids))
+
+    hierarchy_changed.connect(on_change, sender=AdjacencyListModel)
+
+    try:
+        moved, queries = move([b, c, d], a)
+
+    finally:
+        hierarchy_changed.disconnect(on_change, sender=AdjacencyListModel)
+
+    assert changed == [{root.pk, a.pk}]
+    assert moved == 2  # c is moved along with b.
+    assert queries <= 10
+    assert get_parent(b) == a.pk
+    assert get_parent(c) == b.pk
+    assert get_parent(d) == a.pk
+
+    assert {obj.title: obj.children_num for obj in AdjacencyListModel.objects.filter(pk__in=[root.pk, a.pk])} == {
+        'root': 1,
+        'a': 2,
+    }
+
+    assert move([b], None)[0] == 1
+    assert get_parent(b) is None
+
+
+def test_move_action(request_client, user_create, monkeypatch):
+    from django.contrib import admin
+
+    model_admin = admin.site._registry[AdjacencyListModel]
+    root, a, b, c = make_chain(AdjacencyListModel)
+
+    user = user_create(superuser=True)
+    client = request_client()
+    assert client.login(username=user.username, password='password')
+
+    url_base = '/admin/testapp/adjacencylistmodel/'
+
+    assert 'hierarchy_move_selected' not in client.get(url_base).rendered_content
+
+    monkeypatch.setattr(model_admin, 'hierarchy_move', True)
+
+    assert 'value="hierarchy_move_selected"' in client.get(url_base).rendered_content
+
+    data = {'action': 'hierarchy_move_selected', '_selected_action': [c.pk]}
+    url = f'{url_base}?pid={b.pk}'  # Selection comes from the current level.
+
+    response = client.post(url, data)
+    assert response.status_code == 200
+    assert 'id="id_hierarchy_target"' in response.rendered_content
+    assert 'adjacencylistmodel_c' in response.rendered_content
+
+    # Cycle.
+    client.post(url, {**data, 'post': 'yes', 'hierarchy_target': c.pk})
+    assert AdjacencyListModel.objects.get(pk=c.pk).parent_id == b.pk
+
+    response = client.post(url, {**data, 'post': 'yes', 'hierarchy_target': a.pk})
+    assert response.status_code == 302
+    assert AdjacencyListModel.objects.get(pk=c.pk).parent_id == a.pk
+
+    client.post(f'{url_base}?pid={a.pk}', {**data, 'post': 'yes', 'hierarchy_target': ''})
+    assert AdjacencyListModel.objects.get(pk=c.pk).parent_id is None
+
+
+@pytest.mark.parametrize('spread', [0, 8])
+@pytest.mark.parametrize('tree_id_field', [None, 'tree_id'])
+def test_nested_set_insert(spread, tree_id_field, db_queries):
+    from admirarchy.toolbox import NestedSet, NestedSetBuilder
+
+    hierarchy = NestedSet(tree_id_field=tree_id_field, parent_field='parent', spread=spread)
+    builder = NestedSetBuilder(NestedSetModel, hierarchy)
+
+    def add(title, parent=None):
+        obj = NestedSetModel(title=title, parent=parent)
+        hierarchy.insert(NestedSetModel.objects.all(), obj, parent)
+        obj.save()
+        return obj
+
+    root = add('root')
+    root2 = add('root2')
+    nodes = [root]
+
+    db_queries.clear()
+
+    # Deep and wide enough to run out of gaps a few times.
+    for idx in range(30):
+        nodes.append(add(f'n{idx}', parent=nodes[idx // 3]))
+
+    updates = len([sql for sql in db_queries.sql() if sql.startswith('UPDATE')])
+
+    add('other', parent=root2)
+
+    assert list(builder.verify()) == []
+
+    levels = dict(NestedSetModel.objects.values_list('title', 'level'))
+    assert levels['n0'] == 1
+    assert levels['n29'] == 3
+
+    nodes[1].refresh_from_db()
+    children = NestedSetModel.objects.filter(**hierarchy.get_immediate_children_filter(nodes[1]))
+    assert [obj.title for obj in children.order_by('lft')] == ['n3', 'n4', 'n5']
+
+    if not spread:
+        assert updates == 30
+        return
+
+    assert updates <= 10  # Most inserts only write new rows.
+    assert hierarchy.get_descendant_count(root) is None
+
+    # There is room in a new folder: only the new row is written.
+    root3 = add('root3')
+    db_queries.clear()
+    add('leaf', parent=root3)
+    assert len([sql for sql in db_queries.sql() if sql.startswith('UPDATE')]) == 0
+
+
+def test_add_view(request_client, user_create, monkeypatch):
+    from django.contrib import admin
+    from admirarchy.toolbox import NestedSet
+
+    root, a, b, c = make_chain(AdjacencyListModel)
+
+    user = user_create(superuser=True)
+    client = request_client()
+    assert client.login(username=user.username, password='password')
+
+    # Parent is prefilled from the level add button is clicked on.
+    content = client.get(f'/admin/testapp/adjacencylistmodel/add/?_changelist_filters=pid%3D{b.pk}').rendered_content
+    assert f'name="parent" value="{b.pk}"' in content
+
+    root = NestedSetModel.objects.create(title='root', lft=1, rgt=4, level=0)
+    child = NestedSetModel.objects.create(title='child', lft=2, rgt=3, level=1)
+
+    url = f'/admin/testapp/nestedsetmodel/add/?_changelist_filters=pid%3D{root.pk}'
+
+    # Numbering is not managed by default: add and change forms are intact.
+    content = client.get(url).rendered_content
+    assert 'name="lft"' in content
+
+    response = client.post(url, {'title': 'manual', 'lft': 10, 'rgt': 11, 'level': 0, 'tree_id': 1})
+    assert response.status_code == 302
+    assert NestedSetModel.objects.filter(title='manual', lft=10, rgt=11, level=0).exists()
+
+    response = client.post(f'/admin/testapp/nestedsetmodel/{child.pk}/change/', {
+        'title': 'child', 'lft': 2, 'rgt': 3, 'level': 1, 'tree_id': 1, 'parent': root.pk})
+    assert response.status_code == 302
+
+    root.refresh_from_db()
+    child.refresh_from_db()
+    assert (root.lft, root.rgt) == (1, 4)
+    assert (child.lft, child.rgt, child.parent_id) == (2, 3, root.pk)
+
+    NestedSetModel.objects.filter(title='manual').delete()
+
+    monkeypatch.setattr(admin.site._registry[NestedSetModel], 'hierarchy', NestedSet(manage_numbering=True))
+
+    content = client.get(url).rendered_content
+    assert 'name="lft"' not in content
+
+    # Level to add to is validated by the form.
+    response = client.post('/admin/testapp/nestedsetmodel/add/?_changelist_filters=pid%3D99999', {
+        'title': 'orphan', 'tree_id': 1})
+    assert response.status_code == 200
+    assert 'errornote' in response.rendered_content
+    assert not NestedSetModel.objects.filter(title='orphan').exists()
+
+    response = client.post(url, {'title': 'added', 'tree_id': 1})
+    assert response.status_code == 302
+
+    added = NestedSetModel.objects.get(title='added')
+    assert (added.lft, added.rgt, added.level) == (4, 5, 1)
+
+    root.refresh_from_db()
+    child.refresh_from_db()
+    assert (root.lft, root.rgt) == (1, 6)
+    assert (child.lft, child.rgt) == (2, 3)
+
+    response = client.post('/admin/testapp/nestedsetmodel/add/', {'title': 'root2', 'tree_id': 1})
+    assert response.status_code == 302
+
+    added = NestedSetModel.objects.get(title='root2')
+    assert (added.lft, added.rgt, added.level) == (7, 8, 0)
+
+    # Numbering is only computed for new objects.
+    content = client.get(f'/admin/testapp/nestedsetmodel/{root.pk}/change/').rendered_content
+    assert 'name="lft"' in content
+
+
+def test_nested_set_change_parent(request_client, user_create, monkeypatch):
+    from django.contrib import admin
+    from admirarchy.toolbox import NestedSet, NestedSetBuilder
+
+    hierarchy = NestedSet(parent_field='parent', manage_numbering=True)
+    monkeypatch.setattr(admin.site._registry[NestedSetModel], 'hierarchy', hierarchy)
+
+    root = NestedSetModel.objects.create(title='root', lft=1, rgt=8, level=0)
+    a = NestedSetModel.objects.create(title='a', lft=2, rgt=5, level=1, parent=root)
+    a1 = NestedSetModel.objects.create(title='a1', lft=3, rgt=4, level=2, parent=a)
+    b = NestedSetModel.objects.create(title='b', lft=6, rgt=7, level=1, parent=root)
+
+    user = user_create(superuser=True)
+    client = request_client()
+    assert client.login(username=user.username, password='password')
+
+    def change(obj, parent, title=None):
+        return client.post(f'/admin/testapp/nestedsetmodel/{obj.pk}/change/', {
+            'title': title or obj.title,
+            'lft': obj.lft, 'rgt': obj.rgt, 'level': obj.level, 'tree_id': obj.tree_id,
+            'parent': parent.pk if parent else '',
+        }, follow=True)
+
+    def get_numbering():
+        return {
+            title: values for title, *values in
+            NestedSetModel.objects.values_list('title', 'lft', 'rgt', 'level', 'parent__title')
+        }
+
+    # Parent change moves the subtree.
+    response = change(a, b, title='a_moved')
+    assert response.status_code == 200
+
+    assert get_numbering() == {
+        'root': [1, 8, 0, None],
+        'b': [2, 7, 1, 'root'],
+        'a_moved': [3, 6, 2, 'b'],
+        'a1': [4, 5, 3, 'a_moved'],
+    }
+    assert list(NestedSetBuilder(NestedSetModel, hierarchy).verify()) == []
+
+    # Moving into own subtree is refused, the rest is saved.
+    root.refresh_from_db()
+    response = change(root, a1, title='root_renamed')
+    assert response.status_code == 200
+    assert 'class="error"' in response.content.decode()
+
+    assert get_numbering()['root_renamed'] == [1, 8, 0, None]
+    assert list(NestedSetBuilder(NestedSetModel, hierarchy).verify()) == []
+
+
+def test_read_replica(request_get, user_create):
+    from django.contrib import admin
+    from admirarchy.toolbox import HierarchicalModelAdmin, Instrumentation
+
+    measured = []
+
+    class ReplicaAdmin(HierarchicalModelAdmin):
+
+        hierarchy = AdjacencyList(using='replica', lag_tolerance=60)
+        hierarchy_instrumentation = Instrumentation(callbacks=[
+            lambda model_admin, request, measurements: measured.append(measurements)])
+
+    model_admin = ReplicaAdmin(AdjacencyListModel, admin.site)
+    hierarchy = model_admin.hierarchy
+
+    try:
+        root, a, b, c = make_chain(AdjacencyListModel)
+
+        # Replica lags behind: titles differ, one more child is there.
+        for obj in (root, a, b, c):
+            AdjacencyListModel.objects.using('replica').create(
+                pk=obj.pk, title=f'{obj.title}_replica', parent_id=obj.parent_id)
+        AdjacencyListModel.objects.using('replica').create(title='d_replica', parent_id=b.pk)
+
+        user = user_create(superuser=True)
+
+        def get_changelist():
+            changelist = model_admin.get_changelist_instance(request_get(f'/?pid={a.pk}', user=user))
+            results = [obj for obj in changelist.result_list if not getattr(obj, 'dummy', False)]
+            return changelist.hierarchy_context, results
+
+        # Fixture writes are long replicated.
+        hierarchy._written_at.clear()
+
+        context, results = get_changelist()
+
+        # Rows are from the primary, navigation and stats are from the replica.
+        assert [(obj.title, obj.child_count) for obj in results] == [('b', 2)]
+        assert [obj.title for obj in context.ancestors] == ['root_replica']
+        assert context.parent.title == 'a_replica'
+
+        # Replica queries are measured.
+        model_admin.changelist_view(request_get(f'/?pid={a.pk}', user=user))
+        queries = {name: count for name, (count, _) in measured[0].items()}
+        assert queries['stats'] == 1
+        assert queries['upper_level'] > 0
+
+        # Recent writes make reads stick to the primary.
+        assert hierarchy.get_read_db(AdjacencyListModel) == 'replica'
+        c.save()
+        assert hierarchy.get_read_db(AdjacencyListModel) == 'default'
+
+        context, results = get_changelist()
+        assert [(obj.title, obj.child_count) for obj in results] == [('b', 1)]
+        assert context.parent.title == 'a'
+
+        hierarchy._written_at['testapp.adjacencylistmodel'] -= 60
+        assert hierarchy.get_read_db(AdjacencyListModel) == 'replica'
+
+        # No replica configured: routers decide.
+        assert AdjacencyList().get_read_db(AdjacencyListModel) == 'default'
+
+    finally:
+        model_admin.hierarchy_disconnect()
+
+
+def test_chunked_results(request_client, request_get, user_create, db_queries, monkeypatch):
+    from django.contrib import admin
+    from admirarchy.utils import ChunkedResults
+
+    model_admin = admin.site._registry[AdjacencyListModel]
+    monkeypatch.setattr(model_admin, 'hierarchy_results_chunk_size', 5)
+
+    root = AdjacencyListModel.objects.create(title='root')
+    children = [AdjacencyListModel.objects.create(title=f'child{idx}', parent=root) for idx in range(12)]
+    AdjacencyListModel.objects.create(title='leaf', parent=children[0])
+
+    user = user_create(superuser=True)
+
+    changelist = model_admin.get_changelist_instance(request_get(f'/?pid={root.pk}&all=', user=user))
+    result_list = changelist.result_list
+
+    assert isinstance(result_list, ChunkedResults)
+    assert len(result_list) == 13
+
+    # Stats are fetched for every chunk.
+    db_queries.clear()
+    objs = list(result_list)
+    assert len([sql for sql in db_queries.sql() if 'COUNT(' in sql and 'GROUP BY' in sql]) == 3
+
+    assert objs[0].dummy
+    assert {obj.pk: obj.child_count for obj in objs[1:]} == {
+        child.pk: int(child is children[0]) for child in children}
+    assert all(obj.hierarchy_context is changelist.hierarchy_context for obj in objs)
+
+    # Pages are not chunked.
+    monkeypatch.setattr(model_admin, 'list_per_page', 5)
+    changelist = model_admin.get_changelist_instance(request_get(f'/?pid={root.pk}', user=user))
+    assert isinstance(changelist.result_list, list)
+
+    client = request_client()
+    assert client.login(username=user.username, password='password')
+
+    content = client.get(f'/admin/testapp/adjacencylistmodel/?pid={root.pk}&all=').rendered_content
+    assert all(f'>{child}<' in content for child in children)
+    assert 'href="?pid=%s"' % children[0].pk in content
+
+
+@pytest.mark.parametrize('raw', [False, True])
+@pytest.mark.parametrize('spread', [0, 8])
+@pytest.mark.parametrize('tree_id_field', [None, 'tree_id'])
+def test_nested_set_delete(raw, spread, tree_id_field, db_queries):
+    from admirarchy.toolbox import NestedSet, NestedSetBuilder
+
+    hierarchy = NestedSet(tree_id_field=tree_id_field, parent_field='parent', spread=spread)
+    builder = NestedSetBuilder(NestedSetModel, hierarchy)
+
+    def make_node(title, parent=None):
+        return NestedSetModel.objects.create(title=title, parent=parent, lft=0, rgt=0, level=0)
+
+    root = make_node('root')
+    a = make_node('a', parent=root)
+    a1 = make_node('a1', parent=a)
+    make_node('a2', parent=a)
+    b = make_node('b', parent=root)
+    b1 = make_node('b1', parent=b)
+    make_node('c', parent=root)
+    root2 = make_node('root2')
+    make_node('d', parent=root2)
+
+    builder.rebuild()
+
+    assert hierarchy.can_delete(NestedSetModel, raw=raw)
+    assert NestedSet().can_delete(NestedSetModel)
+    assert not NestedSet().can_delete(NestedSetModel, raw=True)  # Parent field is not known.
+
+    query_set = NestedSetModel.objects.filter(pk__in=[a1.pk, b1.pk, a.pk])
+
+    db_queries.clear()
+    assert [(node.title, size) for node, size in hierarchy.get_subtrees(query_set)] == [('a', 2), ('b1', 0)]
+    assert len(db_queries) == (3 if spread else 2)  # Selected IDs, nodes, counts.
+
+    db_queries.clear()
+    assert hierarchy.delete(query_set, raw=raw) == 4
+
+    if raw:
+        assert len(db_queries) <= 8
+
+    assert list(builder.verify()) == []
+    assert sorted(NestedSetModel.objects.values_list('title', flat=True)) == ['b', 'c', 'd', 'root', 'root2']
+
+    root.refresh_from_db()
+
+    if not spread:
+        # Gaps are closed up.
+        assert (root.lft, root.rgt) == (1, 6)
+
+    assert hierarchy.delete(NestedSetModel.objects.filter(pk=root.pk), raw=raw) == 3
+    assert list(builder.verify()) == []
+    assert sorted(NestedSetModel.objects.values_list('title', flat=True)) == ['d', 'root2']
+
+
+def test_adjacency_list_delete(db_queries, monkeypatch):
+    from django.db.models import QuerySet
+    from admirarchy.signals import hierarchy_changed
+    from admirarchy.toolbox import AncestorsCache, ClosureTable
+    from .testapp.models import ItemModel
+
+    hierarchy = AdjacencyList(child_count_field='children_num', ancestors_cache=AncestorsCache())
+
+    assert hierarchy.can_delete(AdjacencyListModel)
+    assert hierarchy.can_delete(AdjacencyListModel, raw=True)
+    assert not ClosureTable('testapp.ClosureTableModelRelation').can_delete(ClosureTableModel)
+
+    root, a, b, c = make_chain(AdjacencyListModel)
+    d = AdjacencyListModel.objects.create(title='d', parent=root)
+
+    query_set = AdjacencyListModel.objects.filter(pk__in=[a.pk, c.pk])
+    assert [(node.title, size) for node, size in hierarchy.get_subtrees(query_set)] == [('a', 2)]
+
+    changed = []
+
+    def on_change(sender, affected_ids, **kwargs):
+        changed.append(set(affected_ids))
+
+    hierarchy_changed.connect(on_change, sender=AdjacencyListModel)
+
+    assert len(hierarchy.get_path(AdjacencyListModel.objects.all(), c.pk)) == 4
+
+    try:
+        db_queries.clear()
+        deleted = hierarchy.delete(query_set, raw=True)
+
+    finally:
+        hierarchy_changed.disconnect(on_change, sender=AdjacencyListModel)
+
+    assert deleted == 3
+    assert len(db_queries) <= 8
+    assert changed == [{root.pk, a.pk}]
+    assert hierarchy.get_path(AdjacencyListModel.objects.all(), c.pk) == []  # Ancestors cache is cleared.
+    assert sorted(AdjacencyListModel.objects.values_list('title', flat=True)) == ['d', 'root']
+    assert AdjacencyListModel.objects.get(pk=root.pk).children_num == 1
+
+    assert hierarchy.delete(AdjacencyListModel.objects.filter(pk=d.pk), raw=True) == 1
+    assert AdjacencyListModel.objects.get(pk=root.pk).children_num == 0
+
+    # Public deletion is used unless objects are to be collected (e.g. cascades on parent).
+    public = []
+    delete = QuerySet.delete
+
+    def delete_spy(query_set):
+        public.append(query_set.model)
+        return delete(query_set)
+
+    monkeypatch.setattr(QuerySet, 'delete', delete_spy)
+
+    item = ItemModel.objects.create(title='item', quantity=1)
+    assert AdjacencyList.delete_queryset(ItemModel.objects.filter(pk=item.pk)) == 1
+    assert AdjacencyList.delete_queryset(AdjacencyListModel.objects.filter(pk=root.pk)) == 1
+    assert public == [ItemModel]
+
+
+def test_delete_signals(db_queries):
+    from django.db.models import signals
+
+    hierarchy = AdjacencyList(child_count_field='children_num')
+
+    root, a, b, c = make_chain(AdjacencyListModel)
+    b2 = AdjacencyListModel.objects.create(title='b2', parent=a)
+    d = AdjacencyListModel.objects.create(title='d', parent=root)
+
+    assert [sorted(level) for level in hierarchy.get_subtrees_levels(AdjacencyListModel.objects.all(), [a])] == [
+        [c.pk], sorted([b.pk, b2.pk]), [a.pk]]
+
+    deleted_pks = []
+    descendants_left = []
+
+    def on_post_delete(sender, instance, **kwargs):
+        deleted_pks.append(instance.pk)
+        # Descendants are never orphaned: children are deleted before their parents.
+        descendants_left.extend(AdjacencyListModel.objects.filter(parent_id=instance.pk).values_list('pk', flat=True))
+
+    signals.post_delete.connect(on_post_delete, sender=AdjacencyListModel)
+
+    batches = []
+
+    try:
+        deleted = hierarchy.delete(AdjacencyListModel.objects.filter(pk=a.pk), on_delete=batches.append)
+
+    finally:
+        signals.post_delete.disconnect(on_post_delete, sender=AdjacencyListModel)
+
+    assert deleted == 4
+    assert deleted_pks[0] == c.pk
+    assert deleted_pks[-1] == a.pk
+    assert sorted(deleted_pks) == sorted([a.pk, b.pk, b2.pk, c.pk])
+    assert descendants_left == []
+    assert [sorted(obj.pk for obj in batch) for batch in batches] == [[c.pk], sorted([b.pk, b2.pk]), [a.pk]]
+    assert sorted(AdjacencyListModel.objects.values_list('pk', flat=True)) == [root.pk, d.pk]
+    assert AdjacencyListModel.objects.get(pk=root.pk).children_num == 1
+
+
+def test_delete_action(request_client, user_create, monkeypatch):
+    from django.contrib import admin
+    from django.contrib.admin.models import LogEntry, DELETION
+
+    model_admin = admin.site._registry[AdjacencyListModel]
+    root, a, b, c = make_chain(AdjacencyListModel)
+
+    user = user_create(superuser=True)
+    client = request_client()
+    assert client.login(username=user.username, password='password')
+
+    url = '/admin/testapp/adjacencylistmodel/'
+
+    content = client.get(url).rendered_content
+    assert 'value="delete_selected"' in content
+    assert 'hierarchy_delete_selected' not in content
+
+    monkeypatch.setattr(model_admin, 'hierarchy_delete', True)
+
+    content = client.get(url).rendered_content
+    assert 'value="delete_selected"' not in content
+    assert 'value="hierarchy_delete_selected"' in content
+
+    data = {'action': 'hierarchy_delete_selected', '_selected_action': [root.pk]}
+
+    response = client.post(url, data)
+    assert response.status_code == 200
+    assert 'adjacencylistmodel_root <span class="hierarchy-descendants">(потомков: 3)</span>' in (
+        response.rendered_content)
+    assert AdjacencyListModel.objects.count() == 4
+
+    response = client.post(url, {**data, 'post': 'yes'})
+    assert response.status_code == 302
+    assert AdjacencyListModel.objects.count() == 0
+
+    # Every deleted object is logged.
+    assert sorted(LogEntry.objects.filter(action_flag=DELETION).values_list('object_id', flat=True)) == sorted(
+        str(obj.pk) for obj in (root, a, b, c))
+
+    # Raw deletion logs selected objects only.
+    monkeypatch.setattr(model_admin, 'hierarchy_delete_raw', True)
+    LogEntry.objects.all().delete()
+    root, a, b, c = make_chain(AdjacencyListModel)
+
+    response = client.post(
+        f'{url}?pid={root.pk}', {'action': 'hierarchy_delete_selected', '_selected_action': [a.pk], 'post': 'yes'})
+    assert response.status_code == 302
+    assert list(AdjacencyListModel.objects.values_list('pk', flat=True)) == [root.pk]
+    assert list(LogEntry.objects.values_list('object_id', flat=True)) == [str(a.pk)]
+
+
+@pytest.mark.parametrize('model', [AdjacencyListModel, NestedSetModel, MaterializedPathModel, ClosureTableModel])
+def test_rollups(model, request_client, request_get, user_create, db_queries, monkeypatch):
+    from django.contrib import admin
+    from django.db.models import Count, Max, Sum, Q
+    from admirarchy.toolbox import HierarchicalModelAdmin, Rollup, StatsCache
+    from .testapp.models import ItemModel
+
+    registered_admin = admin.site._registry[model]
+    has_items = model in {AdjacencyListModel, NestedSetModel}
+
+    rollups = {
+        'subtree_size': Rollup(Count),
+        'subtree_max_title': Rollup(Max, 'title', title='Max title'),
+    }
+
+    if has_items:
+        rollups.update({
+            'quantity_total': Rollup(Sum, 'quantity', related='items'),
+            'items_count': Rollup(Count, related='items'),
+            'quantity_big': Rollup(Sum('quantity', filter=Q(quantity__gt=3)), related='items'),
+        })
+
+    class RollupAdmin(HierarchicalModelAdmin):
+
+        hierarchy = registered_admin.hierarchy
+        hierarchy_rollups = rollups
+        hierarchy_stats_cache = StatsCache(key_prefix=f'rollups_{model._meta.model_name}')
+        list_display = ['title', *rollups]
+
+    model_admin = RollupAdmin(model, admin.site)
+
+    try:
+        root, a, b, c = make_chain(model)
+
+        if has_items:
+            node_field = 'adjacency_list' if model is AdjacencyListModel else 'nested_set'
+
+            for node, quantity in ((root, 1), (b, 3), (b, 4), (c, 5)):
+                ItemModel.objects.create(title=f'{node.title}_{quantity}', quantity=quantity, **{node_field: node})
+
+        user = user_create(superuser=True)
+
+        def get_rows(pid):
+            changelist = model_admin.get_changelist_instance(request_get(f'/?pid={pid}', user=user))
+            return [obj for obj in changelist.result_list if not getattr(obj, 'dummy', False)], changelist.result_list
+
+        def count_rollup_queries():
+            return len([sql for sql in db_queries.sql() if 'admirarchy_node' in sql])
+
+        db_queries.clear()
+        rows, result_list = get_rows(a.pk)
+        assert [obj.hierarchy_rollups for obj in rows] == [{
+            'subtree_size': 2,
+            'subtree_max_title': 'c',
+            **({'quantity_total': 12, 'items_count': 3, 'quantity_big': 9} if has_items else {}),
+        }]
+        assert all(isinstance(value, (int, str)) for value in rows[0].hierarchy_rollups.values())
+        assert count_rollup_queries() == (2 if has_items else 1)
+
+        # Columns.
+        assert model_admin.subtree_size(rows[0]) == 2
+        assert model_admin.subtree_max_title.short_description == 'Max title'
+        assert model_admin.subtree_size(result_list[0]) == ''  # Upper level link.
+
+        # Values are taken from cache.
+        db_queries.clear()
+        rows, _ = get_rows(a.pk)
+        assert rows[0].hierarchy_rollups['subtree_size'] == 2
+        assert count_rollup_queries() == 0
+
+        # Values cached for former definitions are not used.
+        model_admin.hierarchy_rollups = {'subtree_size': Rollup(Count('pk', filter=Q(title='c')))}
+        rows, _ = get_rows(a.pk)
+        assert rows[0].hierarchy_rollups == {'subtree_size': 1}
+        assert count_rollup_queries() == 1
+        model_admin.hierarchy_rollups = rollups
+
+        # Leaf.
+        rows, _ = get_rows(b.pk)
+        assert rows[0].hierarchy_rollups == {
+            'subtree_size': 1,
+            'subtree_max_title': 'c',
+            **({'quantity_total': 5, 'items_count': 1, 'quantity_big': 5} if has_items else {}),
+        }
+
+        if not has_items:
+            return
+
+        # Related objects changes invalidate cached rollups of old and new nodes with ancestors.
+        item = ItemModel.objects.get(quantity=4)
+        setattr(item, node_field, root)
+        item.save()
+        rows, _ = get_rows(a.pk)
+        assert rows[0].hierarchy_rollups['quantity_total'] == 8
+        assert rows[0].hierarchy_rollups['items_count'] == 2
+        assert rows[0].hierarchy_rollups['quantity_big'] == 5
+
+        # Empty subtree.
+        ItemModel.objects.filter(quantity=5).delete()
+        rows, _ = get_rows(b.pk)
+        assert rows[0].hierarchy_rollups['quantity_total'] is None
+        assert rows[0].hierarchy_rollups['items_count'] == 0
+
+        # Rendering.
+        monkeypatch.setattr(registered_admin, 'hierarchy_rollups', rollups)
+        monkeypatch.setattr(registered_admin, 'quantity_total', rollups['quantity_total'].get_column('quantity_total'),
+                            raising=False)
+        monkeypatch.setattr(registered_admin, 'list_display', ['title', 'quantity_total'])
+
+        client = request_client()
+        assert client.login(username=user.username, password='password')
+
+        content = client.get(f'/admin/testapp/{model._meta.model_name}/').rendered_content
+        assert '<td class="field-quantity_total">8</td>' in content
+
+    finally:
+        model_admin.hierarchy_disconnect()
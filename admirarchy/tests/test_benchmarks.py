@@ -0,0 +1,238 @@
+"""Benchmarks of change list views on large synthetic trees.
+
+Skipped by default. Enable with environment variables:
+
+* ADMIRARCHY_BENCHMARK=1 - run benchmarks;
+* ADMIRARCHY_BENCHMARK_SIZES=10000,100000,1000000 - numbers of nodes in trees (default: 10000);
+* ADMIRARCHY_BENCHMARK_REPEAT=5 - runs of every view, the best latency is taken (default: 3);
+* ADMIRARCHY_BENCHMARK_RESULTS=results.json - file to store results to (default: do not store);
+* ADMIRARCHY_BENCHMARK_BASELINE=baseline.json - results to compare with (default: do not compare);
+* ADMIRARCHY_BENCHMARK_THRESHOLD=0.2 - allowed latency and memory growth ratio (default: 0.2).
+
+Run::
+
+    $ ADMIRARCHY_BENCHMARK=1 ADMIRARCHY_BENCHMARK_RESULTS=baseline.json pytest -k benchmark
+    $ ADMIRARCHY_BENCHMARK=1 ADMIRARCHY_BENCHMARK_BASELINE=baseline.json pytest -k benchmark
+
+"""
+import json
+import os
+import platform
+import tracemalloc
+from collections import Counter
+from random import Random
+from time import perf_counter
+
+import pytest
+from django import VERSION
+from django.contrib import admin
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from admirarchy.utils import NestedSet, NestedSetBuilder
+
+from .testapp.models import AdjacencyListModel, NestedSetModel
+
+
+ENABLED = bool(os.environ.get('ADMIRARCHY_BENCHMARK'))
+SIZES = [int(size) for size in os.environ.get('ADMIRARCHY_BENCHMARK_SIZES', '10000').split(',')]
+REPEAT = int(os.environ.get('ADMIRARCHY_BENCHMARK_REPEAT', '3'))
+RESULTS_PATH = os.environ.get('ADMIRARCHY_BENCHMARK_RESULTS', '')
+BASELINE_PATH = os.environ.get('ADMIRARCHY_BENCHMARK_BASELINE', '')
+THRESHOLD = float(os.environ.get('ADMIRARCHY_BENCHMARK_THRESHOLD', '0.2'))
+
+LATENCY_NOISE_MS = 5  # Latency differences below this are ignored.
+
+
+def make_deep(size):
+    """Single chain: every node is a child of the previous one."""
+    return [None] + list(range(size - 1))
+
+
+def make_wide(size):
+    """Single fan: every node is a child of the root."""
+    return [None] + [0] * (size - 1)
+
+
+def make_skewed(size):
+    """Realistic skew: a few huge folders, many small ones and long tails.
+    Earlier nodes are much more likely to become parents.
+
+    """
+    random = Random(size)
+    return [None] + [int(idx * random.random() ** 3) for idx in range(1, size)]
+
+
+SHAPES = {
+    'deep': make_deep,
+    'wide': make_wide,
+    'skewed': make_skewed,
+}
+
+
+def populate(model, parents, batch_size=5000):
+    """Creates objects for the given parents list (parent index for every node index).
+    Returns primary keys of the deepest node and of the node having most children.
+
+    """
+    fields = {'lft': 0, 'rgt': 0, 'level': 0} if model is NestedSetModel else {}
+
+    for start in range(0, len(parents), batch_size):
+        model.objects.bulk_create([
+            model(pk=idx + 1, title=f'node{idx}', parent_id=None if parent is None else parent + 1, **fields)
+            for idx, parent in enumerate(parents[start:start + batch_size], start)
+        ])
+
+    if model is NestedSetModel:
+        NestedSetBuilder(model, NestedSet()).rebuild(batch_size=batch_size)
+
+    depths = []
+
+    for parent in parents:
+        depths.append(0 if parent is None else depths[parent] + 1)
+
+    deepest = max(range(len(parents)), key=depths.__getitem__)
+    widest = Counter(parent for parent in parents if parent is not None).most_common(1)[0][0]
+
+    return deepest + 1, widest + 1
+
+
+def measure(view, repeat):
+    """Returns latency (best of runs, ms), queries count and peak memory (KiB) of a view call."""
+
+    with CaptureQueriesContext(connection) as queries:
+        view()
+
+    tracemalloc.start()
+
+    try:
+        view()
+        peak = tracemalloc.get_traced_memory()[1]
+
+    finally:
+        tracemalloc.stop()
+
+    latencies = []
+
+    for _ in range(repeat):
+        started = perf_counter()
+        view()
+        latencies.append(perf_counter() - started)
+
+    return {
+        'latency_ms': round(min(latencies) * 1000, 2),
+        'queries': len(queries),
+        'peak_kib': round(peak / 1024, 1),
+    }
+
+
+def get_regressions(key, measured, baseline, threshold):
+    """Returns descriptions of measurements worse than baseline ones."""
+    base = baseline.get(key)
+
+    if not base:
+        return []
+
+    regressions = []
+
+    if measured['queries'] > base['queries']:
+        regressions.append(f"{key}: queries {base['queries']} -> {measured['queries']}")
+
+    latency, latency_base = measured['latency_ms'], base['latency_ms']
+
+    if latency > latency_base * (1 + threshold) and latency - latency_base > LATENCY_NOISE_MS:
+        regressions.append(f'{key}: latency {latency_base}ms -> {latency}ms')
+
+    if measured['peak_kib'] > base['peak_kib'] * (1 + threshold):
+        regressions.append(f"{key}: peak memory {base['peak_kib']}KiB -> {measured['peak_kib']}KiB")
+
+    return regressions
+
+
+def run_views(model, size, shape, request_get, user, repeat):
+    """Populates a tree and measures change list views. Returns results indexed by keys."""
+
+    deepest, widest = populate(model, SHAPES[shape](size))
+    model_admin = admin.site._registry[model]
+
+    views = {
+        'root': '/',
+        'drilldown-deep': f'/?pid={deepest}',
+        'drilldown-wide': f'/?pid={widest}',
+        'popup': f'/?pid={widest}&_popup=1&_to_field=id',
+        'search': '/?q=node1',
+    }
+
+    results = {}
+
+    for view_name, url in views.items():
+
+        def view():
+            return model_admin.changelist_view(request_get(url, user=user)).rendered_content
+
+        results[f'{model._meta.model_name}/{shape}/{size}/{view_name}'] = measure(view, repeat)
+
+    return results
+
+
+@pytest.fixture(scope='module')
+def benchmark_results():
+    results = {}
+
+    yield results
+
+    if RESULTS_PATH and results:
+        with open(RESULTS_PATH, 'w') as f:
+            json.dump({
+                'meta': {
+                    'python': platform.python_version(),
+                    'django': '.'.join(map(str, VERSION[:3])),
+                    'db': connection.vendor,
+                },
+                'results': results,
+            }, f, indent=2, sort_keys=True)
+
+
+@pytest.fixture(scope='module')
+def benchmark_baseline():
+    if not BASELINE_PATH:
+        return {}
+
+    with open(BASELINE_PATH) as f:
+        return json.load(f)['results']
+
+
+@pytest.mark.skipif(not ENABLED, reason='Benchmarks are enabled with ADMIRARCHY_BENCHMARK=1')
+@pytest.mark.parametrize('size', SIZES)
+@pytest.mark.parametrize('shape', list(SHAPES))
+@pytest.mark.parametrize('model', [AdjacencyListModel, NestedSetModel])
+def test_benchmark(model, shape, size, request_get, user_create, benchmark_results, benchmark_baseline):
+    results = run_views(model, size, shape, request_get, user_create(superuser=True), REPEAT)
+    benchmark_results.update(results)
+
+    regressions = []
+
+    for key, measured in results.items():
+        regressions.extend(get_regressions(key, measured, benchmark_baseline, THRESHOLD))
+
+    assert not regressions, '\n'.join(regressions)
+
+
+@pytest.mark.parametrize('shape', list(SHAPES))
+@pytest.mark.parametrize('model', [AdjacencyListModel, NestedSetModel])
+def test_benchmark_harness(model, shape, request_get, user_create):
+    results = run_views(model, 50, shape, request_get, user_create(superuser=True), repeat=1)
+
+    assert len(results) == 5
+
+    for measured in results.values():
+        assert measured['queries'] > 0
+        assert measured['latency_ms'] > 0
+
+    if model is NestedSetModel:
+        assert list(NestedSetBuilder(model, NestedSet(), parent_field='parent').verify()) == []
+
+    key = next(iter(results))
+    worse = dict(results[key], queries=results[key]['queries'] + 1)
+    assert get_regressions(key, worse, results, THRESHOLD) == [
+        f"{key}: queries {results[key]['queries']} -> {worse['queries']}"]
@@ -0,0 +1,158 @@
+from threading import Barrier, Thread
+
+import pytest
+from django.contrib import admin
+from django.db import connections
+
+from admirarchy.utils import Hierarchy
+
+from .test_basic import make_closure_node
+from .testapp.models import AdjacencyListModel, NestedSetModel, MaterializedPathModel, ClosureTableModel
+
+
+def make_adjacency_tree():
+
+    def make_node(title, parent=None):
+        node = AdjacencyListModel(title=title, parent=parent)
+        node.save()
+        return node
+
+    root = make_node('root')
+    branch_a = make_node('a', parent=root)
+    branch_b = make_node('b', parent=root)
+    make_node('a1', parent=branch_a)
+    make_node('b1', parent=branch_b)
+
+    return AdjacencyListModel, branch_a.pk, branch_b.pk
+
+
+def make_nested_tree():
+
+    def make_node(title, left, right, level):
+        node = NestedSetModel(title=title, lft=left, rgt=right, level=level)
+        node.save()
+        return node
+
+    make_node('root', left=1, right=10, level=0)
+    branch_a = make_node('a', left=2, right=5, level=1)
+    make_node('a1', left=3, right=4, level=2)
+    branch_b = make_node('b', left=6, right=9, level=1)
+    make_node('b1', left=7, right=8, level=2)
+
+    return NestedSetModel, branch_a.pk, branch_b.pk
+
+
+def make_path_tree():
+
+    def make_node(title, path):
+        return MaterializedPathModel.objects.create(title=title, path=path, depth=len(path) // 4)
+
+    make_node('root', '0001')
+    branch_a = make_node('a', '00010001')
+    make_node('a1', '000100010001')
+    branch_b = make_node('b', '00010002')
+    make_node('b1', '000100020001')
+
+    return MaterializedPathModel, branch_a.pk, branch_b.pk
+
+
+def make_closure_tree():
+    root = make_closure_node('root')
+    branch_a = make_closure_node('a', parent=root)
+    make_closure_node('a1', parent=branch_a)
+    branch_b = make_closure_node('b', parent=root)
+    make_closure_node('b1', parent=branch_b)
+
+    return ClosureTableModel, branch_a.pk, branch_b.pk
+
+
+tree_makers = pytest.mark.parametrize(
+    'make_tree', [make_adjacency_tree, make_nested_tree, make_path_tree, make_closure_tree])
+
+
+@tree_makers
+def test_interleaved_changelists(make_tree, request_get, user_create):
+    model, pid_a, pid_b = make_tree()
+    user = user_create(superuser=True)
+    model_admin = admin.site._registry[model]
+
+    changelist_a = model_admin.get_changelist_instance(request_get(f'/?pid={pid_a}&_popup=1', user=user))
+    # Second request is processed by the same model admin before the first one is rendered.
+    changelist_b = model_admin.get_changelist_instance(request_get(f'/?pid={pid_b}', user=user))
+
+    assert changelist_a.hierarchy_context is not changelist_b.hierarchy_context
+    assert changelist_a.hierarchy_context.pid == str(pid_a)
+    assert changelist_b.hierarchy_context.pid == str(pid_b)
+
+    def get_titles(changelist):
+        return [str(item) for item in changelist.result_list if not getattr(item, 'dummy', False)]
+
+    titles_a = get_titles(changelist_a)
+    titles_b = get_titles(changelist_b)
+
+    assert titles_a == [f'{model._meta.model_name}_a1']
+    assert titles_b == [f'{model._meta.model_name}_b1']
+
+    # Navigation column for the first request still honors its own popup mode.
+    upper_a = changelist_a.result_list[0]
+    assert '_popup=1' in model_admin.hierarchy_nav(upper_a)
+
+    upper_b = changelist_b.result_list[0]
+    assert '_popup=1' not in model_admin.hierarchy_nav(upper_b)
+
+
+@tree_makers
+def test_threaded_changelists(make_tree, request_get, user_create, monkeypatch):
+    model, pid_a, pid_b = make_tree()
+    user = user_create(superuser=True)
+    model_admin = admin.site._registry[model]
+    model_name = model._meta.model_name
+
+    Hierarchy.init_hierarchy(model_admin)
+    hierarchy_cls = type(model_admin.hierarchy)
+
+    workers_count = 6
+    barrier = Barrier(workers_count, timeout=10)
+    hook_get_results = hierarchy_cls.hook_get_results
+
+    def hook_get_results_synced(self, changelist):
+        # Make sure all the workers have their querysets built
+        # before any of them proceeds to results post processing.
+        barrier.wait()
+        hook_get_results(self, changelist)
+
+    monkeypatch.setattr(hierarchy_cls, 'hook_get_results', hook_get_results_synced)
+
+    errors = []
+    contents = {}
+
+    def work(idx, pid):
+        try:
+            request = request_get(f'/?pid={pid}', user=user)
+            contents[idx] = (pid, model_admin.changelist_view(request).rendered_content)
+
+        except Exception as e:  # pragma: nocover
+            errors.append(e)
+            barrier.abort()
+
+        finally:
+            connections.close_all()
+
+    threads = [
+        Thread(target=work, args=(idx, pid_a if idx % 2 else pid_b))
+        for idx in range(workers_count)
+    ]
+
+    for thread in threads:
+        thread.start()
+
+    for thread in threads:
+        thread.join()
+
+    assert not errors
+    assert len(contents) == workers_count
+
+    for pid, content in contents.values():
+        expected, unexpected = ('a1', 'b1') if pid == pid_a else ('b1', 'a1')
+        assert f'{model_name}_{expected}' in content
+        assert f'{model_name}_{unexpected}' not in content
@@ -1,8 +1,8 @@
 from django.contrib import admin
 
-from admirarchy.toolbox import HierarchicalModelAdmin, NestedSet
+from admirarchy.toolbox import HierarchicalModelAdmin, NestedSet, MaterializedPath, ClosureTable
 
-from .models import AdjacencyListModel, NestedSetModel
+from .models import AdjacencyListModel, NestedSetModel, MaterializedPathModel, ClosureTableModel
 
 
 class AdjacencyListModelAdmin(HierarchicalModelAdmin):
@@ -17,5 +17,19 @@ class NestedSetModelModelAdmin(HierarchicalModelAdmin):
     search_fields = ['title']
 
 
+class MaterializedPathModelAdmin(HierarchicalModelAdmin):
+
+    hierarchy = MaterializedPath()
+    search_fields = ['title']
+
+
+class ClosureTableModelAdmin(HierarchicalModelAdmin):
+
+    hierarchy = ClosureTable('testapp.ClosureTableModelRelation')
+    search_fields = ['title']
+
+
 admin.site.register(AdjacencyListModel, AdjacencyListModelAdmin)
 admin.site.register(NestedSetModel, NestedSetModelModelAdmin)
+admin.site.register(MaterializedPathModel, MaterializedPathModelAdmin)
+admin.site.register(ClosureTableModel, ClosureTableModelAdmin)
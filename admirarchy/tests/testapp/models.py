@@ -8,6 +8,8 @@ class AdjacencyListModel(models.Model):
     parent = models.ForeignKey(
         'self', related_name='%(class)s_parent', on_delete=models.CASCADE, db_index=True, null=True, blank=True)
 
+    children_num = models.PositiveIntegerField(default=0)
+
     def __str__(self):
         return 'adjacencylistmodel_%s' % self.title
 
@@ -19,6 +21,59 @@ class NestedSetModel(models.Model):
     lft = models.IntegerField(db_index=True)
     rgt = models.IntegerField(db_index=True)
     level = models.IntegerField(db_index=True)
+    tree_id = models.PositiveIntegerField(default=1)
+
+    parent = models.ForeignKey(
+        'self', related_name='%(class)s_parent', on_delete=models.CASCADE, null=True, blank=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['tree_id', 'lft'])]
 
     def __str__(self):
         return 'nestedsetmodel_%s' % self.title
+
+
+class MaterializedPathModel(models.Model):
+
+    title = models.CharField(max_length=100)
+
+    path = models.CharField(max_length=255, unique=True)
+    depth = models.PositiveIntegerField()
+
+    def __str__(self):
+        return 'materializedpathmodel_%s' % self.title
+
+
+class ClosureTableModel(models.Model):
+
+    title = models.CharField(max_length=100)
+
+    def __str__(self):
+        return 'closuretablemodel_%s' % self.title
+
+
+class ClosureTableModelRelation(models.Model):
+
+    ancestor = models.ForeignKey(ClosureTableModel, related_name='descendants_rel', on_delete=models.CASCADE)
+    descendant = models.ForeignKey(ClosureTableModel, related_name='ancestors_rel', on_delete=models.CASCADE)
+    depth = models.PositiveIntegerField()
+
+    class Meta:
+        unique_together = ('ancestor', 'descendant')
+
+
+class ItemModel(models.Model):
+
+    title = models.CharField(max_length=100)
+    quantity = models.PositiveIntegerField(default=0)
+
+    adjacency_list = models.ForeignKey(
+        AdjacencyListModel, related_name='items', on_delete=models.DO_NOTHING, db_constraint=False,
+        null=True, blank=True)
+
+    nested_set = models.ForeignKey(
+        NestedSetModel, related_name='items', on_delete=models.DO_NOTHING, db_constraint=False,
+        null=True, blank=True)
+
+    def __str__(self):
+        return 'itemmodel_%s' % self.title
@@ -1 +1,6 @@
-from .utils import HierarchicalModelAdmin, AdjacencyList, NestedSet
+from .cache import AncestorsCache, StatsCache
+from .instrumentation import Instrumentation, StatsdCallback, log_measurements
+from .utils import (
+    HierarchicalModelAdmin, AdjacencyList, NestedSet, MaterializedPath, ClosureTable, ChildCountMaintainer,
+    NestedSetBuilder, Rollup,
+)
@@ -1,27 +1,110 @@
+import csv
+import json
+from hashlib import md5
+from collections import defaultdict
+from contextlib import contextmanager
 from copy import copy
-from typing import Type, Optional, Dict, Tuple
+from time import monotonic
+from typing import Type, Optional, Dict, Tuple, List, Any, Union, Set, Callable, Iterator, Iterable
 
+from django import forms
+from django.apps import apps
 from django.conf import settings
-from django.contrib.admin.options import ModelAdmin
-from django.contrib.admin.views.main import ChangeList
-from django.core.exceptions import FieldDoesNotExist
-from django.db import models
-from django.db.models import Model, QuerySet
-from django.http import HttpRequest
+from django.contrib import messages
+from django.contrib.admin.helpers import ACTION_CHECKBOX_NAME
+from django.contrib.admin.options import ModelAdmin, IncorrectLookupParameters, IS_POPUP_VAR
+from django.contrib.admin.utils import quote
+from django.contrib.admin.views.main import ChangeList, PAGE_VAR, ERROR_FLAG, ORDER_VAR, SEARCH_VAR
+from django.core.paginator import InvalidPage
+from django.core.exceptions import FieldDoesNotExist, ObjectDoesNotExist, ValidationError, PermissionDenied, EmptyResultSet
+from django.db import models, connections, router, transaction
+from django.db.models import signals
+from django.db.models.deletion import Collector
+from django.dispatch import Signal
+from django.db.models import Model, QuerySet, OuterRef, Subquery, Q, Exists, F, Case, When, Aggregate
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import Coalesce, Length, Substr
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import HttpRequest, JsonResponse, Http404, StreamingHttpResponse, QueryDict
+from django.template.response import TemplateResponse
 from django.utils.encoding import force_str
-from django.utils.html import format_html
+from django.utils.html import format_html, format_html_join
+from django.utils.safestring import mark_safe
+from django.utils.http import urlsafe_base64_encode, urlsafe_base64_decode
 from django.utils.translation import gettext_lazy as _
 
+try:
+    from django.urls import reverse
+
+except ImportError:  # Django < 1.10
+    from django.core.urlresolvers import reverse
+
+try:
+    from django.contrib.admin.sites import all_sites
+
+except ImportError:  # Django < 2.1
+    from django.contrib.admin import site as default_site
+    all_sites = [default_site]
+
+try:
+    from django.urls import re_path
+
+except ImportError:  # Django < 2.0
+    from django.conf.urls import url as re_path
+
+from .cache import AncestorsCache, StatsCache
+from .instrumentation import Instrumentation, Recorder
 from .exceptions import AdmirarchyConfigurationError
+from .signals import hierarchy_changed
 
 
 class HierarchicalModelAdmin(ModelAdmin):
     """Customized Model admin handling hierarchies navigation."""
 
     hierarchy: 'Hierarchy' = None
+    hierarchy_stats_cache: Optional[StatsCache] = None
+    hierarchy_count_estimate_threshold: Optional[int] = None
+    hierarchy_level_size_from_stats: Optional[bool] = None
+    hierarchy_keyset_pagination: bool = False
+    hierarchy_expand_inline: bool = False
+    hierarchy_search_paths: bool = True
+    hierarchy_search_in_branch: bool = False
+    hierarchy_export: bool = False
+    hierarchy_instrumentation: Optional[Instrumentation] = None
+    hierarchy_tree_depth: int = 0
+    hierarchy_move: bool = False
+    hierarchy_delete: bool = False
+    hierarchy_delete_raw: bool = False
+    hierarchy_results_chunk_size: Optional[int] = 500
+    hierarchy_rollups: Optional[Dict[str, 'Rollup']] = None
     change_list_template = 'admin/admirarchy/change_list.html'
 
-    _current_changelist = None
+    def __init__(self, model: Type[Model], admin_site):
+        super().__init__(model, admin_site)
+
+        Hierarchy.init_hierarchy(self)
+
+        hierarchy = self.hierarchy
+        hierarchy.watch_changes(model, self.hierarchy_stats_cache)
+
+        for name, rollup in (self.hierarchy_rollups or {}).items():
+            # Available for `list_display` by name.
+            setattr(self, name, rollup.get_column(name))
+
+        hierarchy.watch_rollups(model, self.hierarchy_rollups, self.hierarchy_stats_cache)
+
+        hierarchy.watch_writes(model)
+        hierarchy.connect_child_count_maintainer(model)
+
+    def hierarchy_disconnect(self):
+        """Disconnects signal handlers connected by the hierarchy for the model
+        of this admin (e.g. when the admin is discarded in tests).
+
+        """
+        hierarchy = self.hierarchy
+
+        if hierarchy is not None:
+            hierarchy.disconnect_signals(self.model)
 
     def get_changelist(self, request: HttpRequest, **kwargs) -> Type['HierarchicalChangeList']:
         """Returns an appropriate ChangeList for ModelAdmin.
@@ -36,6 +119,294 @@ class HierarchicalModelAdmin(ModelAdmin):
 
         return HierarchicalChangeList
 
+    def get_urls(self) -> List:
+        """Adds hierarchy children JSON endpoint to model admin URLs."""
+        opts = self.model._meta
+
+        urls = [
+            re_path(
+                r'^hierarchy/children/$',
+                self.admin_site.admin_view(self.hierarchy_children_view),
+                name=f'{opts.app_label}_{opts.model_name}_hierarchy_children'
+            ),
+            re_path(
+                r'^hierarchy/export/$',
+                self.admin_site.admin_view(self.hierarchy_export_view),
+                name=f'{opts.app_label}_{opts.model_name}_hierarchy_export'
+            ),
+        ]
+
+        return urls + super().get_urls()
+
+    def hierarchy_has_view_permission(self, request: HttpRequest) -> bool:
+        """Returns whether hierarchy endpoints (children, export) are allowed for the request.
+
+        :param request:
+
+        """
+        # View permission is available since Django 2.1.
+        has_permission = getattr(self, 'has_view_or_change_permission', self.has_change_permission)
+
+        return has_permission(request)
+
+    def hierarchy_children_view(self, request: HttpRequest) -> JsonResponse:
+        """Returns a page of immediate children of a node (`pid` from query string,
+        root level if omitted) with their children counts in JSON.
+
+        Children are ordered by hierarchy keyset ordering.
+        Next page is addressed with `cursor` from query string.
+
+        :param request:
+
+        """
+        if not self.hierarchy_expand_inline:
+            raise Http404
+
+        if not self.hierarchy_has_view_permission(request):
+            raise PermissionDenied
+
+        Hierarchy.init_hierarchy(self)
+
+        hierarchy = self.hierarchy
+
+        if not hierarchy.supports('filter_children'):
+            raise Http404
+
+        pid = request.GET.get(Hierarchy.PARENT_ID_QS_PARAM) or None
+
+        try:
+            query_set = hierarchy.filter_children(self.get_queryset(request), pid)
+            objs, _, next_cursor = paginate_keyset(
+                query_set,
+                ordering=hierarchy.get_keyset_ordering(),
+                cursor=request.GET.get(Hierarchy.CURSOR_QS_PARAM),
+                per_page=self.list_per_page,
+            )
+
+        except (ObjectDoesNotExist, ValueError, TypeError, ValidationError):
+            raise Http404
+
+        hierarchy.contribute_stats(self, objs)
+
+        opts = self.model._meta
+        url_name = f'{self.admin_site.name}:{opts.app_label}_{opts.model_name}_change'
+
+        results = [{
+            'id': str(obj.pk),
+            'title': str(obj),
+            'url': reverse(url_name, args=(quote(obj.pk),), current_app=self.admin_site.name),
+            'child_count': getattr(obj, Hierarchy.CHILD_COUNT_MODEL_ATTR, 0),
+            'descendant_count': getattr(obj, Hierarchy.DESCENDANT_COUNT_MODEL_ATTR, None),
+        } for obj in objs]
+
+        return JsonResponse({'pid': pid, 'results': results, 'next': next_cursor})
+
+    def hierarchy_export_view(self, request: HttpRequest) -> StreamingHttpResponse:
+        """Streams a node (`pid` from query string, all the trees if omitted)
+        and all its descendants in CSV (default) or JSON Lines (`format=jsonl`).
+
+        Every row contains depth (relative to the node), path
+        (of titles starting from the node) and all concrete fields values.
+
+        :param request:
+
+        """
+        if not self.hierarchy_export or not self.hierarchy_has_view_permission(request):
+            raise PermissionDenied
+
+        Hierarchy.init_hierarchy(self)
+
+        hierarchy = self.hierarchy
+
+        if not hierarchy.can_export():
+            raise Http404
+
+        export_format = request.GET.get('format', 'csv')
+
+        if export_format not in {'csv', 'jsonl'}:
+            raise Http404
+
+        query_set = self.get_queryset(request)
+        pid = request.GET.get(Hierarchy.PARENT_ID_QS_PARAM) or None
+        node = None
+
+        if pid:
+            try:
+                node = query_set.get(pk=pid)
+
+            except (ObjectDoesNotExist, ValueError, ValidationError):
+                raise Http404
+
+        attnames = [field.attname for field in self.model._meta.concrete_fields]
+
+        def iter_rows():
+            for obj, depth, obj_path in hierarchy.iter_subtree(query_set, node):
+                yield [depth, obj_path] + [getattr(obj, attname) for attname in attnames]
+
+        # Prefixed not to clash with model fields.
+        header = ['hierarchy_depth', 'hierarchy_path'] + attnames
+
+        if export_format == 'csv':
+            writer = csv.writer(EchoBuffer())
+            stream = (writer.writerow(row) for row in chain_rows(header, iter_rows()))
+            content_type = 'text/csv'
+
+        else:
+            stream = (
+                json.dumps(dict(zip(header, row)), cls=DjangoJSONEncoder, ensure_ascii=False) + '\n'
+                for row in iter_rows()
+            )
+            content_type = 'application/x-ndjson'
+
+        response = StreamingHttpResponse(stream, content_type=content_type)
+        response['Content-Disposition'] = (
+            f'attachment; filename="{self.model._meta.model_name}-{pid or "all"}.{export_format}"')
+
+        return response
+
+    def get_actions(self, request: HttpRequest) -> Dict:
+        """Returns actions available, adding hierarchy actions if enabled.
+
+        :param request:
+
+        """
+        actions = super().get_actions(request)
+
+        if self.actions is None or IS_POPUP_VAR in request.GET:
+            return actions
+
+        hierarchy = self.hierarchy
+
+        if self.hierarchy_move and hierarchy.can_move() and self.has_change_permission(request):
+            func, name, description = self.get_action('hierarchy_move_selected')
+            actions[name] = (func, name, description)
+
+        if (
+            self.hierarchy_delete and hierarchy.can_delete(self.model, raw=self.hierarchy_delete_raw) and
+            self.has_delete_permission(request)
+        ):
+            # Replaces default action collecting every descendant.
+            actions.pop('delete_selected', None)
+            func, name, description = self.get_action('hierarchy_delete_selected')
+            actions[name] = (func, name, description)
+
+        return actions
+
+    def hierarchy_move_selected(self, request: HttpRequest, queryset: QuerySet) -> Optional[TemplateResponse]:
+        """Action moving selected objects (with their subtrees) under another object.
+        Renders a page to choose the target object first.
+
+        """
+        target_pk = request.POST.get('hierarchy_target', '').strip()
+
+        if request.POST.get('post'):
+            target = None
+
+            if target_pk:
+                target = self.get_object(request, target_pk)
+
+                if target is None:
+                    self.message_user(request, _('Target object is not found.'), messages.ERROR)
+                    return None
+
+            try:
+                moved = self.hierarchy.move(queryset, target)
+
+            except ValidationError as e:
+                self.message_user(request, ' '.join(e.messages), messages.ERROR)
+                return None
+
+            self.message_user(request, _('Objects moved: %s') % moved, messages.SUCCESS)
+
+            return None
+
+        opts = self.model._meta
+
+        context = {
+            **self.admin_site.each_context(request),
+            'title': _('Move objects'),
+            'opts': opts,
+            'queryset': queryset,
+            'action_checkbox_name': ACTION_CHECKBOX_NAME,
+            'media': self.media + forms.Media(js=['admin/js/admin/RelatedObjectLookups.js']),
+            'lookup_url': f"{reverse(f'{self.admin_site.name}:{opts.app_label}_{opts.model_name}_changelist')}"
+                          f'?{IS_POPUP_VAR}=1',
+        }
+
+        return TemplateResponse(request, 'admin/admirarchy/move_selected.html', context)
+
+    hierarchy_move_selected.short_description = _('Move selected %(verbose_name_plural)s')
+
+    def hierarchy_delete_selected(self, request: HttpRequest, queryset: QuerySet) -> Optional[TemplateResponse]:
+        """Action deleting selected objects along with all their descendants
+        level by level in batches. Renders a confirmation page
+        with descendants counts first.
+
+        Every deleted object is logged, unless `hierarchy_delete_raw` is set:
+        then descendants are deleted without being fetched, so only selected objects are logged.
+
+        """
+        if request.POST.get('post'):
+
+            def log_deletions(objs: List[Model]):
+                for obj in objs:
+                    self.log_deletion(request, obj, str(obj))
+
+            if self.hierarchy_delete_raw:
+                log_deletions(queryset)
+                deleted = self.hierarchy.delete(queryset, raw=True)
+
+            else:
+                deleted = self.hierarchy.delete(queryset, on_delete=log_deletions)
+
+            self.message_user(request, _('Objects deleted: %s') % deleted, messages.SUCCESS)
+
+            return None
+
+        subtrees = self.hierarchy.get_subtrees(queryset)
+
+        context = {
+            **self.admin_site.each_context(request),
+            'title': _('Delete objects'),
+            'opts': self.model._meta,
+            'queryset': queryset,
+            'subtrees': subtrees,
+            'total': sum(size + 1 for _, size in subtrees),
+            'action_checkbox_name': ACTION_CHECKBOX_NAME,
+        }
+
+        return TemplateResponse(request, 'admin/admirarchy/delete_selected.html', context)
+
+    hierarchy_delete_selected.short_description = _('Delete selected %(verbose_name_plural)s')
+
+    def changelist_view(self, request: HttpRequest, extra_context: Optional[Dict] = None):
+        """Renders change list. Reports measurements if instrumentation is enabled.
+
+        :param request:
+        :param extra_context:
+
+        """
+        response = super().changelist_view(request, extra_context)
+
+        instrumentation = self.hierarchy_instrumentation
+
+        if instrumentation is not None:
+            changelist = (getattr(response, 'context_data', None) or {}).get('cl')
+
+            if isinstance(changelist, HierarchicalChangeList):
+
+                def report(response):
+                    instrumentation.report(self, request, response, changelist.hierarchy_context.measurements)
+
+                if isinstance(changelist.result_list, ChunkedResults) and not response.is_rendered:
+                    # Chunked results are processed while rendering.
+                    response.add_post_render_callback(report)
+
+                else:
+                    report(response)
+
+        return response
+
     def change_view(self, *args, **kwargs):
         """Renders detailed model edit page."""
         Hierarchy.init_hierarchy(self)
@@ -44,6 +415,67 @@ class HierarchicalModelAdmin(ModelAdmin):
 
         return super(HierarchicalModelAdmin, self).change_view(*args, **kwargs)
 
+    def add_view(self, *args, **kwargs):
+        """Renders model add page."""
+        Hierarchy.init_hierarchy(self)
+
+        self.hierarchy.hook_add_view(self, args, kwargs)
+
+        return super().add_view(*args, **kwargs)
+
+    def get_changeform_initial_data(self, request: HttpRequest) -> Dict:
+        """Prefills parent field (if any) with the level an object is added from.
+
+        :param request:
+
+        """
+        initial = super().get_changeform_initial_data(request)
+
+        parent_field = self.hierarchy.get_parent_field()
+        pid = Hierarchy.get_pid_from_changeform_request(request)
+
+        if parent_field and pid:
+            initial.setdefault(parent_field, pid)
+
+        return initial
+
+    def get_readonly_fields(self, request: HttpRequest, obj: Optional[Model] = None):
+        """Returns fields to be shown read only letting hierarchy add its own.
+
+        :param request:
+        :param obj: Object being changed. None - object is being added.
+
+        """
+        readonly_fields = super().get_readonly_fields(request, obj)
+
+        return self.hierarchy.hook_get_readonly_fields(self, obj, readonly_fields)
+
+    def get_form(self, request: HttpRequest, obj: Optional[Model] = None, change: bool = False, **kwargs):
+        """Returns add/change form class letting hierarchy customize it.
+
+        :param request:
+        :param obj: Object being changed. None - object is being added.
+        :param change:
+        :param kwargs:
+
+        """
+        form = super().get_form(request, obj, change=change, **kwargs)
+
+        return self.hierarchy.hook_get_form(self, request, obj, form)
+
+    def save_model(self, request: HttpRequest, obj: Model, form, change: bool):
+        """Saves an object letting hierarchy position it first.
+
+        :param request:
+        :param obj:
+        :param form:
+        :param change:
+
+        """
+        self.hierarchy.hook_save_model(self, request, obj, change)
+
+        super().save_model(request, obj, form, change)
+
     def action_checkbox(self, obj: Model):
         """Renders checkboxes.
 
@@ -60,6 +492,8 @@ class HierarchicalModelAdmin(ModelAdmin):
 
         result_repr = ''  # For items without children.
         ch_count = getattr(obj, Hierarchy.CHILD_COUNT_MODEL_ATTR, 0)
+        descendants_count = getattr(obj, Hierarchy.DESCENDANT_COUNT_MODEL_ATTR, None)
+        context: HierarchyContext = getattr(obj, Hierarchy.CONTEXT_MODEL_ATTR)
 
         is_parent_link = getattr(obj, Hierarchy.UPPER_LEVEL_MODEL_ATTR, False)
 
@@ -67,35 +501,59 @@ class HierarchicalModelAdmin(ModelAdmin):
             icon = 'icon icon-folder'
             title = _('Objects inside: %s') % ch_count
 
+            if descendants_count is not None and descendants_count != ch_count:
+                title = _('Objects inside: %(children)s, total: %(descendants)s') % {
+                    'children': ch_count,
+                    'descendants': descendants_count,
+                }
+
             if is_parent_link:
                 icon = 'icon icon-folder-up'
                 title = _('Upper level')
 
-            url = './'
+            url = context.get_url(obj.pk)
 
-            if obj.pk:
-                url = f'?{Hierarchy.PARENT_ID_QS_PARAM}={obj.pk}'
+            if is_parent_link or not context.expand_url:
+                result_repr = format_html(
+                    '<a href="{0}" class="{1}" title="{2}"></a>', url, icon, force_str(title))
 
-            changelist = self._current_changelist
+            else:
+                result_repr = format_html(
+                    '<a href="{0}" class="{1}" title="{2}" data-hierarchy-pid="{3}"></a>',
+                    url, icon, force_str(title), obj.pk)
 
-            if changelist.is_popup:
+        return result_repr
 
-                qs_get = copy(changelist._request.GET)
+    hierarchy_nav.short_description = ''
 
-                try:
-                    del qs_get[Hierarchy.PARENT_ID_QS_PARAM]
+    def hierarchy_path(self, obj: Model) -> str:
+        """Renders links to ancestors of an object (used for search results)."""
 
-                except KeyError:
-                    pass
+        ancestors = getattr(obj, Hierarchy.ANCESTORS_MODEL_ATTR, None)
 
-                qs_get = qs_get.urlencode()
-                url = f'{url}&{qs_get}' if '?' in url else f'{url}?{qs_get}'
+        if not ancestors:
+            return ''
 
-            result_repr = format_html('<a href="{0}" class="{1}" title="{2}"></a>', url, icon, force_str(title))
+        context: HierarchyContext = getattr(obj, Hierarchy.CONTEXT_MODEL_ATTR)
 
-        return result_repr
+        return format_html_join(
+            mark_safe(' &rsaquo; '), '<a href="{0}">{1}</a>',
+            ((context.get_url(ancestor.pk), force_str(ancestor)) for ancestor in ancestors)
+        )
 
-    hierarchy_nav.short_description = ''
+    hierarchy_path.short_description = _('Location')
+
+    def hierarchy_tree(self, obj: Model) -> str:
+        """Renders an object indented according to its depth (used in tree display mode)."""
+
+        if getattr(obj, Hierarchy.UPPER_LEVEL_MODEL_ATTR, False):
+            return ''
+
+        depth = getattr(obj, Hierarchy.TREE_DEPTH_MODEL_ATTR, 1)
+
+        return format_html('<span style="padding-left: {0}em">{1}</span>', (depth - 1) * 1.5, force_str(obj))
+
+    hierarchy_tree.short_description = _('Tree')
 
 
 class HierarchicalChangeList(ChangeList):
@@ -110,12 +568,43 @@ class HierarchicalChangeList(ChangeList):
         :param args:
 
         """
-        model_admin._current_changelist = self
         self._hierarchy = model_admin.hierarchy
-        self._request = request
+        self.hierarchy_context = HierarchyContext(self, request)
+
+        self.keyset_ordering: Optional[List[str]] = None
+        """Ordering used for keyset pagination. None - keyset pagination is not used."""
+
+        if model_admin.hierarchy_keyset_pagination and ORDER_VAR not in request.GET:
+            # Ordering requested by user can not be used for seeking.
+            self.keyset_ordering = self._hierarchy.get_keyset_ordering()
+
+        self.keyset_previous_url: Optional[str] = None
+        self.keyset_next_url: Optional[str] = None
+
+        self.tree_depth: Optional[int] = self.get_tree_depth(model_admin, request)
+        """Depth of subtree shown in tree display mode. None - tree display mode is off."""
+
+        self.tree_truncated: bool = False
+
+        if self.tree_depth:
+            # The whole subtree is shown at once.
+            self.keyset_ordering = None
+
         if not isinstance(self._hierarchy, NoHierarchy):
             list_display = [self._hierarchy.NAV_FIELD_MARKER] + list(list_display)
 
+            if self.tree_depth:
+                list_display.insert(1, self._hierarchy.TREE_FIELD_MARKER)
+
+            if model_admin.hierarchy_search_paths and request.GET.get(SEARCH_VAR):
+                # Search results come from different levels.
+                list_display.append(self._hierarchy.PATH_FIELD_MARKER)
+
+        rollups = model_admin.hierarchy_rollups
+
+        if rollups and not self._hierarchy.supports('get_subtrees_sql'):
+            list_display = [name for name in list_display if name not in rollups]
+
         super(HierarchicalChangeList, self).__init__(
             request, model, list_display, list_display_links,
             list_filter, date_hierarchy, search_fields,
@@ -128,275 +617,4801 @@ class HierarchicalChangeList(ChangeList):
         :param request:
 
         """
+        self.params.pop(Hierarchy.CURSOR_QS_PARAM, None)
+        self.params.pop(Hierarchy.TREE_QS_PARAM, None)
+
         hierarchy = self._hierarchy
-        hierarchy.hook_get_queryset(self, request)
+        context = self.hierarchy_context
+
+        with context.measure('get_queryset'):
+            hierarchy.hook_get_queryset(self, request)
 
         qs = super(HierarchicalChangeList, self).get_queryset(request)
-        qs = hierarchy.hook_filter_queryset(self, qs)
+
+        with context.measure('filter_queryset'):
+            qs = hierarchy.hook_filter_queryset(self, qs)
+
+            if context.search_scoped:
+                qs = hierarchy.filter_subtree(qs, context.parent or context.pid)
 
         return qs
 
-    def get_results(self, request: HttpRequest):
-        """Gets query set results.
+    def get_ordering(self, request: HttpRequest, queryset: QuerySet) -> List:
+        """Returns the list of ordering fields for the change list.
 
         :param request:
+        :param queryset:
 
         """
-        super(HierarchicalChangeList, self).get_results(request)
+        if self.keyset_ordering:
+            return list(self.keyset_ordering)
 
-        self._hierarchy.hook_get_results(self)
+        return super().get_ordering(request, queryset)
 
-    def check_field_exists(self, field_name: str):
-        """Implements field exists check for debugging purposes.
+    def get_results(self, request: HttpRequest):
+        """Gets query set results.
 
-        :param field_name:
+        :param request:
 
         """
-        if not settings.DEBUG:
-            return
-
-        try:
-            self.lookup_opts.get_field(field_name)
+        level_size = None
+        context = self.hierarchy_context
+        is_plain = not self.query and not self.has_extra_lookups(request)
 
-        except FieldDoesNotExist as e:
-            raise AdmirarchyConfigurationError(e)
+        if self.tree_depth and is_plain:
+            with context.measure('tree'):
+                self.get_results_tree(request)
 
+        else:
+            if is_plain:
+                with context.measure('level_size'):
+                    level_size = self._hierarchy.get_level_size(self)
 
-########################################################
+            self.get_results_paginated(request, level_size)
 
+        result_list = self.result_list
 
-class Hierarchy:
-    """Base hierarchy class. Hierarchy classes must inherit from it."""
+        if not isinstance(result_list, ChunkedResults):
+            # Fetch the page beforehand not to attribute it to hierarchy.
+            self.result_list = list(result_list)
 
-    PARENT_ID_QS_PARAM = 'pid'  # Parent ID query string parameter.
-    CHILD_COUNT_MODEL_ATTR = 'child_count'  # Attribute given to every model.
-    UPPER_LEVEL_MODEL_ATTR = 'dummy'  # This attribute indicated the model is just a dummy upper level link.
-    NAV_FIELD_MARKER = 'hierarchy_nav'
+        with context.measure('get_results'):
+            self._hierarchy.hook_get_results(self)
 
-    @classmethod
-    def init_hierarchy(cls, model_admin: HierarchicalModelAdmin):
-        """Initializes model admin with hierarchy data."""
+        def contribute_context(objs: List[Model]):
+            for item in objs:
+                setattr(item, Hierarchy.CONTEXT_MODEL_ATTR, context)
 
-        hierarchy = getattr(model_admin, 'hierarchy')
+        result_list = self.result_list
 
-        if hierarchy:
-            if not isinstance(hierarchy, Hierarchy):
-                hierarchy = AdjacencyList()  # For `True` and etc. TODO heuristics maybe.
+        if isinstance(result_list, ChunkedResults):
+            contribute_context(result_list.head)
+            result_list.processors.append(contribute_context)
 
         else:
-            hierarchy = NoHierarchy()
-
-        model_admin.hierarchy = hierarchy
+            contribute_context(result_list)
 
-    @classmethod
-    def get_pid_from_request(cls, changelist: 'HierarchicalChangeList', request: HttpRequest) -> Optional[str]:
-        """Gets parent ID from query string.
+    def has_extra_lookups(self, request: HttpRequest) -> bool:
+        """Returns True if request contains lookups (e.g. filters)
+        other than hierarchy navigation.
 
-        :param changelist:
         :param request:
 
         """
-        qs_param = cls.PARENT_ID_QS_PARAM
+        params = self.get_filters_params(dict(request.GET.items()))
 
-        val = request.GET.get(qs_param, False)
-        pid = val or None
+        for param in (
+            PAGE_VAR, ERROR_FLAG,
+            Hierarchy.PARENT_ID_QS_PARAM, Hierarchy.CURSOR_QS_PARAM, Hierarchy.TREE_QS_PARAM
+        ):
+            params.pop(param, None)
 
-        changelist.params.pop(qs_param, None)
+        return bool(params) or bool(getattr(self, 'has_active_filters', False))
 
-        return pid
+    @staticmethod
+    def get_tree_depth(model_admin: HierarchicalModelAdmin, request: HttpRequest) -> Optional[int]:
+        """Returns subtree depth requested for tree display mode
+        (capped by `hierarchy_tree_depth`) or None if the mode is off.
 
-    def hook_change_view(self, model_admin: HierarchicalModelAdmin, view_args: Tuple, view_kwargs: Dict):
-        """Triggered by `ModelAdmin.change_view()`."""
+        :param model_admin:
+        :param request:
 
-    def hook_get_results(self, changelist: 'HierarchicalChangeList'):
-        """Triggered by `ChangeList.get_results()`."""
+        """
+        max_depth = model_admin.hierarchy_tree_depth
 
-    def hook_get_queryset(self, changelist: 'HierarchicalChangeList', request: HttpRequest):
-        """Triggered by `ChangeList.get_queryset()`."""
+        if not max_depth or request.GET.get(SEARCH_VAR) or not model_admin.hierarchy.supports('fetch_tree'):
+            return None
 
-    def hook_filter_queryset(self, changelist: 'HierarchicalChangeList', query_set: QuerySet) -> QuerySet:
-        """Triggered by `ChangeList.get_queryset()`."""
-        return query_set
+        try:
+            depth = int(request.GET.get(Hierarchy.TREE_QS_PARAM, ''))
 
+        except ValueError:
+            return None
 
-class NoHierarchy(Hierarchy):
-    """Dummy (disabled) hierarchy class."""
+        if depth < 1:
+            return None
 
+        return min(depth, max_depth)
 
-class AdjacencyList(Hierarchy):
+    def get_results_tree(self, request: HttpRequest):
+        """Gets the current node subtree down to `tree_depth` for tree display mode.
 
-    def __init__(self, parent_id_field: str = 'parent'):
+        Mimics `ChangeList.get_results()`. Objects are in tree order
+        and have their depth relative to the current node set.
+        No more than `list_max_show_all` objects are shown.
 
-        self.pid = None
-        self.pid_field = parent_id_field
-        self.pid_field_real = f'{parent_id_field}_id'
+        :param request:
 
-    def hook_change_view(self, model_admin: HierarchicalModelAdmin, view_args: Tuple, view_kwargs: Dict):
-        """Triggered by `ModelAdmin.change_view()`.
+        """
+        model_admin = self.model_admin
+        context = self.hierarchy_context
 
-        Replaces parent item dropdown list with a lookup dialog.
+        limit = self.list_max_show_all
 
-        """
-        # TODO start from an appropriate tree level when in parent lookup popup
-        model_admin.raw_id_fields += (self.pid_field,)
+        # One more object tells the tree is truncated.
+        tree = self._hierarchy.fetch_tree(
+            self.root_queryset, context.parent or context.pid, self.tree_depth, limit=limit + 1)
 
-    def hook_get_queryset(self, changelist: 'HierarchicalChangeList', request: HttpRequest):
-        """Triggered by `ChangeList.get_queryset()`."""
-        pid_field = self.pid_field
+        self.tree_truncated = len(tree) > limit
 
-        changelist.check_field_exists(pid_field)
+        result_list = []
 
-        pid = self.get_pid_from_request(changelist, request)
-        self.pid = pid
+        for obj, depth in tree[:limit]:
+            setattr(obj, Hierarchy.TREE_DEPTH_MODEL_ATTR, depth)
+            result_list.append(obj)
 
-        if changelist.query:
-            # Do not restrict search to current sub.
+        full_result_count = None
+
+        if model_admin.show_full_result_count:
+            full_result_count = self.get_full_result_count()
+
+        self.result_count = len(result_list)
+        self.show_full_result_count = model_admin.show_full_result_count
+        self.show_admin_actions = not self.show_full_result_count or bool(full_result_count)
+        self.full_result_count = full_result_count
+        self.result_list = result_list
+        self.can_show_all = True
+        self.multi_page = False
+        self.paginator = model_admin.get_paginator(request, result_list, self.list_per_page)
+
+    def get_results_paginated(self, request: HttpRequest, result_count: Optional[int] = None):
+        """Gets query set results for the current page.
+
+        Mimics `ChangeList.get_results()` but allows to skip COUNT queries
+        for levels of a known size and for the total number of objects.
+        Uses keyset pagination instead of OFFSET if enabled.
+
+        Results larger than `hierarchy_results_chunk_size` (e.g. "Show all")
+        are fetched lazily in chunks. See `ChunkedResults`.
+
+        :param request:
+        :param result_count: Number of items on the level. None - count with a query.
+
+        """
+        model_admin = self.model_admin
+
+        if result_count is None:
+            # Counted without annotations objects of the page are fetched with.
+            result_count = model_admin.get_paginator(request, self.queryset, self.list_per_page).count
+
+        results_queryset = self._hierarchy.hook_get_results_queryset(self, self.queryset)
+
+        paginator = model_admin.get_paginator(request, results_queryset, self.list_per_page)
+        paginator.count = result_count  # Prevent counting.
+
+        full_result_count = None
+
+        if model_admin.show_full_result_count:
+            full_result_count = self.get_full_result_count()
+
+        can_show_all = result_count <= self.list_max_show_all
+        multi_page = result_count > self.list_per_page
+
+        # Get the list of objects to display on this page.
+        if (self.show_all and can_show_all) or not multi_page:
+            result_list = results_queryset._clone()
+            chunk_size = model_admin.hierarchy_results_chunk_size
+
+            # Editable lists need objects for a formset beforehand.
+            if chunk_size and result_count > chunk_size and not self.list_editable:
+                result_list = ChunkedResults(result_list, result_count, chunk_size)
+
+        elif self.keyset_ordering:
+            result_list = self.get_keyset_page(request, results_queryset)
+
+        else:
+            try:
+                result_list = paginator.page(self.page_num).object_list
+
+            except InvalidPage:
+                raise IncorrectLookupParameters
+
+        self.result_count = result_count
+        self.show_full_result_count = model_admin.show_full_result_count
+        self.show_admin_actions = not self.show_full_result_count or bool(full_result_count)
+        self.full_result_count = full_result_count
+        self.result_list = result_list
+        self.can_show_all = can_show_all
+        self.multi_page = multi_page
+        self.paginator = paginator
+
+    def get_keyset_page(self, request: HttpRequest, query_set: Optional[QuerySet] = None) -> List[Model]:
+        """Returns objects for the current page seeking them by a cursor
+        from query string instead of using OFFSET.
+
+        Sets previous and next pages URLs.
+
+        :param request:
+        :param query_set: Query set to fetch objects from. None - change list query set.
+
+        """
+        cursor = request.GET.get(Hierarchy.CURSOR_QS_PARAM)
+
+        try:
+            result_list, previous_cursor, next_cursor = paginate_keyset(
+                self.queryset if query_set is None else query_set,
+                ordering=self.keyset_ordering,
+                cursor=cursor,
+                per_page=self.list_per_page,
+            )
+
+        except (ValueError, TypeError, ValidationError):
+            raise IncorrectLookupParameters
+
+        context = self.hierarchy_context
+
+        if previous_cursor or (cursor and not result_list):
+            # Nothing left beyond the cursor (e.g. objects were deleted) - go to the first page.
+            self.keyset_previous_url = context.get_page_url(previous_cursor)
+
+        if next_cursor:
+            self.keyset_next_url = context.get_page_url(next_cursor)
+
+        return result_list
+
+    def get_full_result_count(self) -> int:
+        """Returns the total number of objects, with no admin filters applied.
+
+        Uses DB planner estimate instead of counting if allowed
+        by `HierarchicalModelAdmin.hierarchy_count_estimate_threshold`.
+
+        """
+        root_queryset = self._hierarchy.get_read_queryset(self.root_queryset)
+        threshold = self.model_admin.hierarchy_count_estimate_threshold
+
+        if threshold is not None:
+            estimate = estimate_count(root_queryset)
+
+            if estimate is not None and estimate >= threshold:
+                return estimate
+
+        return root_queryset.count()
+
+    def check_field_exists(self, field_name: str):
+        """Implements field exists check for debugging purposes.
+
+        :param field_name:
+
+        """
+        if not settings.DEBUG:
+            return
+
+        try:
+            self.lookup_opts.get_field(field_name)
+
+        except FieldDoesNotExist as e:
+            raise AdmirarchyConfigurationError(e)
+
+
+def get_hierarchical_admins() -> Dict[Type[Model], HierarchicalModelAdmin]:
+    """Returns hierarchical model admins (with initialized hierarchies)
+    registered with all admin sites indexed by models.
+    For a model registered with several sites the first admin found is used.
+
+    """
+    admins = {}
+
+    for site in all_sites:
+        get_model_admin = getattr(site, 'get_model_admin', None)  # Django 5.0+
+
+        for model in apps.get_models():
+
+            if model in admins or not site.is_registered(model):
+                continue
+
+            model_admin = get_model_admin(model) if get_model_admin else site._registry[model]
+
+            if isinstance(model_admin, HierarchicalModelAdmin):
+                Hierarchy.init_hierarchy(model_admin)
+                admins[model] = model_admin
+
+    return admins
+
+
+def estimate_count(query_set: QuerySet) -> Optional[int]:
+    """Returns DB planner estimate for a number of rows in a model table
+    if supported by DB (PostgreSQL), otherwise None.
+
+    :param query_set:
+
+    """
+    connection = connections[query_set.db]
+
+    if connection.vendor != 'postgresql':
+        return None
+
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT reltuples FROM pg_class WHERE oid = %s::regclass', [query_set.model._meta.db_table])
+        row = cursor.fetchone()
+
+    if not row or row[0] < 0:  # Never analyzed.
+        return None
+
+    return int(row[0])
+
+
+def encode_cursor(values: List[str], backwards: bool = False) -> str:
+    """Returns keyset pagination cursor for query string.
+
+    :param values: Values of ordering fields of an object to seek from.
+    :param backwards: Seek objects preceding the object.
+
+    """
+    return urlsafe_base64_encode(json.dumps([int(backwards)] + values).encode())
+
+
+def decode_cursor(cursor: str, values_count: int) -> Tuple[bool, List[str]]:
+    """Returns (backwards, values) tuple decoded from a keyset pagination cursor.
+    Raises ValueError for malformed cursors.
+
+    :param cursor:
+    :param values_count: Expected number of values.
+
+    """
+    decoded = json.loads(urlsafe_base64_decode(cursor))
+
+    if not isinstance(decoded, list) or len(decoded) != values_count + 1:
+        raise ValueError(f'Malformed cursor: {cursor}')
+
+    backwards, *values = decoded
+
+    return bool(backwards), values
+
+
+def get_seek_filter(ordering: List[str], values: List[str], backwards: bool = False) -> Q:
+    """Returns a filter for objects following (or preceding) the given
+    values of ordering fields, e.g. for ['a', '-b']:
+
+        a > x OR (a = x AND b < y)
+
+    :param ordering: Ordering fields names. Prefixed with `-` for descending order.
+    :param values:
+    :param backwards:
+
+    """
+    seek = Q()
+    preceding = {}
+
+    for field, value in zip(ordering, values):
+        descending = field.startswith('-')
+        field = field.lstrip('-')
+        lookup = 'lt' if descending != backwards else 'gt'
+
+        seek |= Q(**preceding, **{f'{field}__{lookup}': value})
+        preceding[field] = value
+
+    return seek
+
+
+def paginate_keyset(
+        query_set: QuerySet,
+        *,
+        ordering: List[str],
+        cursor: Optional[str],
+        per_page: int
+) -> Tuple[List[Model], Optional[str], Optional[str]]:
+    """Returns (objects, previous page cursor, next page cursor) for a page
+    of objects seeked by the given cursor. Cursors are None if there is no such page.
+
+    Raises ValueError (or TypeError, ValidationError) for malformed cursors.
+
+    :param query_set:
+    :param ordering: Ordering fields names. Prefixed with `-` for descending order.
+    :param cursor: Cursor from the previous call. None - first page.
+    :param per_page: Number of objects on a page.
+
+    """
+    query_set = query_set.order_by(*ordering)
+    backwards = False
+
+    if cursor:
+        backwards, values = decode_cursor(cursor, len(ordering))
+        query_set = query_set.filter(get_seek_filter(ordering, values, backwards))
+
+    if backwards:
+        query_set = query_set.reverse()
+
+    objs = list(query_set[:per_page + 1])
+
+    has_more = len(objs) > per_page
+    objs = objs[:per_page]
+
+    if backwards:
+        objs.reverse()
+        has_previous, has_next = has_more, True
+
+    else:
+        has_previous, has_next = bool(cursor), has_more
+
+    def get_values(obj: Model) -> List[str]:
+        return [str(getattr(obj, field.lstrip('-'))) for field in ordering]
+
+    previous_cursor = None
+    next_cursor = None
+
+    if objs:
+
+        if has_previous:
+            previous_cursor = encode_cursor(get_values(objs[0]), True)
+
+        if has_next:
+            next_cursor = encode_cursor(get_values(objs[-1]))
+
+    return objs, previous_cursor, next_cursor
+
+
+class EchoBuffer:
+    """File-like object returning what is written to it.
+    Allows `csv.writer` to produce lines for streaming.
+
+    """
+    def write(self, value: str) -> str:
+        return value
+
+
+def chain_rows(header: List, rows: Iterator[List]) -> Iterator[List]:
+    """Yields header and then all the rows.
+
+    :param header:
+    :param rows:
+
+    """
+    yield header
+    yield from rows
+
+
+class ChunkedResults:
+    """Lazily evaluated change list results.
+
+    Objects are fetched and post-processed chunk by chunk
+    (stats are attached with one query per chunk). Every iteration queries DB anew.
+
+    Rows rendered from objects are still collected by Django admin
+    before the page is output, so this is not streaming.
+
+    """
+    def __init__(self, query_set: QuerySet, count: int, chunk_size: int):
+        """
+        :param query_set: Query set to fetch objects from.
+        :param count: Number of objects in query set.
+        :param chunk_size: Number of objects to fetch and process at once.
+
+        """
+        self.query_set = query_set
+        self.count = count
+        self.chunk_size = chunk_size
+        self.head: List[Model] = []  # Items to yield before the objects (e.g. upper level link).
+        self.processors: List[Callable[[List[Model]], None]] = []  # Called for every chunk in turn.
+
+    def __len__(self) -> int:
+        return len(self.head) + self.count
+
+    def __iter__(self) -> Iterator[Model]:
+        yield from self.head
+
+        chunk_size = self.chunk_size
+        chunk = []
+
+        for obj in self.query_set.iterator(chunk_size=chunk_size):
+            chunk.append(obj)
+
+            if len(chunk) == chunk_size:
+                yield from self.process(chunk)
+                chunk = []
+
+        if chunk:
+            yield from self.process(chunk)
+
+    def process(self, chunk: List[Model]) -> List[Model]:
+        """Passes a chunk of objects to processors.
+
+        :param chunk:
+
+        """
+        for processor in self.processors:
+            processor(chunk)
+
+        return chunk
+
+
+def get_tree_sql(
+        table: str,
+        node_column: str,
+        parent_column: str,
+        seed: Tuple[str, Tuple],
+        depth: int,
+        *,
+        condition: str = '',
+        limit: Optional[int] = None
+) -> Tuple[str, Tuple]:
+    """Returns SQL and params for a depth-limited recursive CTE query selecting
+    (node ID, depth) pairs in tree order: depth-first, siblings ordered by ID.
+    Top level nodes have depth 1.
+
+    Rows are ordered by IDs of a node ancestors taken level by level
+    (each deeper level prefixed with a marker of its presence),
+    so that limit is applied by DB.
+
+    :param table: Quoted name of a table with parent-child links (aliased `e`).
+    :param node_column: Quoted name of a child ID column.
+    :param parent_column: Quoted name of a parent ID column.
+    :param seed: SQL selecting top level nodes IDs and its params.
+    :param depth: Maximum depth.
+    :param condition: Additional SQL condition for links rows (e.g. `AND e.depth = 1`).
+    :param limit: Maximum number of rows. None - no limit.
+
+    """
+    seed_sql, seed_params = seed
+
+    columns = ['k1']
+    seed_values = ['s.node_id']
+    step_values = ['d.k1']
+
+    for level in range(2, depth + 1):
+        columns.extend((f'p{level}', f'k{level}'))
+        seed_values.extend(('0', 's.node_id'))
+        step_values.extend((
+            f'CASE WHEN d.depth = {level - 1} THEN 1 ELSE d.p{level} END',
+            f'CASE WHEN d.depth < {level} THEN e.{node_column} ELSE d.k{level} END',
+        ))
+
+    sql = (
+        f'WITH RECURSIVE admirarchy_seed(node_id) AS ({seed_sql}), '
+        f'admirarchy_tree(node_id, depth, {", ".join(columns)}) AS ('
+        f'SELECT s.node_id, 1, {", ".join(seed_values)} FROM admirarchy_seed s '
+        # Depth limit also stops walking cycles.
+        f'UNION ALL '
+        f'SELECT e.{node_column}, d.depth + 1, {", ".join(step_values)} FROM {table} e '
+        f'INNER JOIN admirarchy_tree d ON e.{parent_column} = d.node_id WHERE d.depth < %s{condition}'
+        f') SELECT node_id, depth FROM admirarchy_tree ORDER BY {", ".join(columns)}'
+    )
+    params = tuple(seed_params) + (depth,)
+
+    if limit is not None:
+        sql += ' LIMIT %s'
+        params += (limit,)
+
+    return sql, params
+
+
+def fetch_tree_rows(query_set: QuerySet, sql: str, params: Tuple, root_pk: Any) -> List[Tuple[Model, int]]:
+    """Fetches objects for (node ID, depth) rows in tree order (see `get_tree_sql()`).
+    Returns (object, depth) pairs. Subtrees of nodes missing from the query set
+    (and of the root if walked again due to a cycle) are skipped.
+
+    :param query_set:
+    :param sql:
+    :param params:
+    :param root_pk: Root ID. None - root level.
+
+    """
+    with connections[query_set.db].cursor() as cursor:
+        cursor.execute(sql, params)
+        rows = cursor.fetchall()
+
+    to_python = query_set.model._meta.pk.to_python
+    rows = [(to_python(pk), depth) for pk, depth in rows]
+
+    objs = query_set.in_bulk([pk for pk, _ in rows])
+
+    tree = []
+    skip_depth = None
+
+    for pk, depth in rows:
+
+        if skip_depth is not None:
+            if depth > skip_depth:
+                continue
+            skip_depth = None
+
+        obj = objs.get(pk)
+
+        if obj is None or pk == root_pk:
+            skip_depth = depth
+            continue
+
+        tree.append((obj, depth))
+
+    return tree
+
+
+def get_count_subquery(query_set: QuerySet) -> Coalesce:
+    """Returns an expression counting rows of the given (correlated) query set.
+
+    :param query_set:
+
+    """
+    counted = query_set.order_by().annotate(cnt=models.Func('pk', function='COUNT')).values('cnt')
+    return Coalesce(Subquery(counted, output_field=models.IntegerField()), 0)
+
+
+class Rollup:
+    """Subtree aggregate column for change list. See `HierarchicalModelAdmin.hierarchy_rollups`.
+
+    Aggregates a field over all objects of a subtree (subtree root included)
+    or over objects of a related model referring to them.
+
+    """
+    def __init__(
+            self,
+            aggregate: Union[Type[Aggregate], Aggregate],
+            field: str = 'pk',
+            *,
+            related: Optional[str] = None,
+            title: Optional[str] = None,
+            default: Any = None
+    ):
+        """
+        :param aggregate: Aggregate class, e.g. `Sum`, `Count`, `Max`,
+            or aggregate expression, e.g. `Count('pk', distinct=True)`, `StdDev('price', sample=True)`,
+            `Sum('stock', filter=Q(active=True))` (`field` is not used then).
+
+        :param field: Name of a field to aggregate (of a related model if `related` is set).
+            Lookups spanning relations are allowed.
+
+        :param related: Name of a reverse relation (e.g. `related_name` of a foreign key
+            pointing to hierarchy model) to aggregate objects of. None - aggregate hierarchy model objects.
+
+        :param title: Column title. None - derived from column name.
+
+        :param default: Value for subtrees having nothing to aggregate. None - 0 for `Count`, empty for others.
+
+        """
+        if isinstance(aggregate, type):
+            aggregate = aggregate(field)
+
+        self.aggregate = aggregate
+        self.related = related
+        self.title = title
+
+        if default is None and isinstance(aggregate, models.Count):
+            default = 0
+
+        self.default = default
+
+        # Cached values are bound to definition, so that changed rollups are not served stale values.
+        definition = f'{type(aggregate).__module__}.{aggregate!r}:{related}'
+        self.signature = md5(definition.encode()).hexdigest()[:12]
+
+    def get_column(self, name: str) -> Callable[[Model], Any]:
+        """Returns a change list column callable showing rollup value.
+
+        :param name: Column name.
+
+        """
+        default = self.default
+
+        def column(obj: Model) -> Any:
+
+            if getattr(obj, Hierarchy.UPPER_LEVEL_MODEL_ATTR, False):
+                return ''
+
+            return getattr(obj, Hierarchy.ROLLUPS_MODEL_ATTR, {}).get(name, default)
+
+        column.short_description = self.title or name.replace('_', ' ')
+
+        return column
+
+
+class HierarchyContext:
+    """Holds hierarchy navigation state for a single request.
+
+    Hierarchy objects are shared by all requests served by a model admin,
+    so everything request specific (e.g. parent ID and parent object)
+    is kept here instead, attached to a changelist.
+
+    """
+    def __init__(self, changelist: HierarchicalChangeList, request: HttpRequest):
+        self.changelist = changelist
+        self.request = request
+
+        self.pid: Optional[str] = None
+        """Parent ID from query string."""
+
+        self.parent: Optional[Model] = None
+        """Parent object (if resolved by hierarchy)."""
+
+        self.ancestors: Optional[List[Model]] = None
+        """Ancestors of parent object starting from the root (if resolved by hierarchy)."""
+
+        self.recorder: Optional[Recorder] = None
+        """Measurements recorder (if instrumentation is enabled)."""
+
+    @property
+    def measurements(self) -> Dict[str, Tuple[int, float]]:
+        """Queries count and seconds spent indexed by measure name."""
+        recorder = self.recorder
+        return {} if recorder is None else recorder.measurements
+
+    @contextmanager
+    def measure(self, name: str):
+        """Records queries count and time spent within the block
+        if instrumentation is enabled.
+
+        :param name:
+
+        """
+        recorder = self.recorder
+
+        if recorder is None:
+            changelist = self.changelist
+
+            if changelist.model_admin.hierarchy_instrumentation is None:
+                yield
+                return
+
+            recorder = self.recorder = Recorder()
+
+        with recorder.measure(name):
+            yield
+
+    def get_url(self, pid: Any = None) -> str:
+        """Returns a URL to navigate to the given level.
+
+        :param pid: Parent ID. None - root level.
+
+        """
+        qs_get = QueryDict(mutable=True)
+
+        if pid:
+            qs_get[Hierarchy.PARENT_ID_QS_PARAM] = pid
+
+        if self.changelist.is_popup:
+
+            qs_popup = copy(self.request.GET)
+
+            # Navigation to another level starts from its first page.
+            for param in (Hierarchy.PARENT_ID_QS_PARAM, Hierarchy.CURSOR_QS_PARAM, Hierarchy.TREE_QS_PARAM, PAGE_VAR):
+                qs_popup.pop(param, None)
+
+            qs_get.update(qs_popup)
+
+        if not qs_get:
+            return './'
+
+        return f'?{qs_get.urlencode()}'
+
+    def get_page_url(self, cursor: Optional[str] = None) -> str:
+        """Returns a URL to navigate to a page of the current level
+        using keyset pagination.
+
+        :param cursor: Keyset pagination cursor. None - first page.
+
+        """
+        qs_get = copy(self.request.GET)
+
+        for param in (Hierarchy.CURSOR_QS_PARAM, PAGE_VAR):
+            qs_get.pop(param, None)
+
+        if cursor:
+            qs_get[Hierarchy.CURSOR_QS_PARAM] = cursor
+
+        return f'?{qs_get.urlencode()}'
+
+    @property
+    def export_links(self) -> List[Tuple[str, str]]:
+        """Returns (url, title) pairs to export current level subtree
+        in every supported format. Empty if export is not enabled.
+
+        """
+        changelist = self.changelist
+        model_admin = changelist.model_admin
+
+        if not model_admin.hierarchy_export or not changelist._hierarchy.can_export():
+            return []
+
+        opts = changelist.opts
+        admin_site = model_admin.admin_site
+
+        url = reverse(
+            f'{admin_site.name}:{opts.app_label}_{opts.model_name}_hierarchy_export',
+            current_app=admin_site.name)
+
+        links = []
+
+        for export_format, title in (('csv', _('Export CSV')), ('jsonl', _('Export JSON Lines'))):
+            qs_get = QueryDict(mutable=True)
+
+            if self.pid:
+                qs_get[Hierarchy.PARENT_ID_QS_PARAM] = self.pid
+
+            qs_get['format'] = export_format
+            links.append((f'{url}?{qs_get.urlencode()}', force_str(title)))
+
+        return links
+
+    @property
+    def tree_links(self) -> List[Tuple[str, str]]:
+        """Returns (url, title) pair to switch tree display mode on or off
+        for the current level. Empty if the mode is not enabled.
+
+        """
+        changelist = self.changelist
+        max_depth = changelist.model_admin.hierarchy_tree_depth
+
+        if not max_depth or changelist.query or not changelist._hierarchy.supports('fetch_tree'):
+            return []
+
+        qs_get = copy(self.request.GET)
+
+        for param in (Hierarchy.TREE_QS_PARAM, Hierarchy.CURSOR_QS_PARAM, PAGE_VAR):
+            qs_get.pop(param, None)
+
+        if changelist.tree_depth:
+            title = _('Show as list')
+
+        else:
+            title = _('Show as tree')
+            qs_get[Hierarchy.TREE_QS_PARAM] = max_depth
+
+        return [(f'?{qs_get.urlencode()}', force_str(title))]
+
+    @property
+    def search_scoped(self) -> bool:
+        """Whether search is limited to the current node subtree."""
+        changelist = self.changelist
+
+        return bool(
+            self.pid and changelist.query and changelist.model_admin.hierarchy_search_in_branch and
+            changelist._hierarchy.supports('filter_subtree'))
+
+    @property
+    def expand_url(self) -> str:
+        """Returns hierarchy children JSON endpoint URL to expand folders inline,
+        or an empty string if inline expansion is not enabled.
+
+        """
+        changelist = self.changelist
+        model_admin = changelist.model_admin
+
+        if (
+            not model_admin.hierarchy_expand_inline or changelist.is_popup or
+            not changelist._hierarchy.supports('filter_children')
+        ):
+            return ''
+
+        opts = changelist.opts
+        admin_site = model_admin.admin_site
+
+        return reverse(
+            f'{admin_site.name}:{opts.app_label}_{opts.model_name}_hierarchy_children',
+            current_app=admin_site.name)
+
+    @property
+    def breadcrumbs(self) -> List[Tuple[str, str]]:
+        """Returns (url, title) pairs to navigate to the root and every
+        ancestor of parent object. The last one is for the parent itself.
+
+        """
+        parent = self.parent
+
+        if not self.pid or parent is None:
+            return []
+
+        crumbs = [(self.get_url(), force_str(_('Root level')))]
+        crumbs.extend((self.get_url(ancestor.pk), force_str(ancestor)) for ancestor in self.ancestors or [])
+        crumbs.append(('', force_str(parent)))
+
+        return crumbs
+
+
+########################################################
+
+
+class Hierarchy:
+    """Base hierarchy class. Hierarchy classes must inherit from it."""
+
+    PARENT_ID_QS_PARAM = 'pid'  # Parent ID query string parameter.
+    CURSOR_QS_PARAM = 'cursor'  # Keyset pagination cursor query string parameter.
+    TREE_QS_PARAM = 'tree'  # Tree display mode depth query string parameter.
+    CHILD_COUNT_MODEL_ATTR = 'child_count'  # Attribute given to every model.
+    CHILD_COUNT_ANNOTATION = 'admirarchy_child_count'  # Children count annotated to results (not to clash with fields).
+    DESCENDANT_COUNT_MODEL_ATTR = 'descendant_count'  # Attribute given to every model if hierarchy supports it.
+    UPPER_LEVEL_MODEL_ATTR = 'dummy'  # This attribute indicated the model is just a dummy upper level link.
+    CONTEXT_MODEL_ATTR = 'hierarchy_context'  # Per-request hierarchy context given to every model.
+    ANCESTORS_MODEL_ATTR = 'hierarchy_ancestors'  # Ancestors given to every model in search results.
+    TREE_DEPTH_MODEL_ATTR = 'hierarchy_depth'  # Depth given to every model in tree display mode.
+    ROLLUPS_MODEL_ATTR = 'hierarchy_rollups'  # Rollups values given to every model if configured.
+    NAV_FIELD_MARKER = 'hierarchy_nav'
+    PATH_FIELD_MARKER = 'hierarchy_path'
+    TREE_FIELD_MARKER = 'hierarchy_tree'
+    PATH_SEPARATOR = ' / '  # Used to join objects titles in exported paths.
+
+    movable = False  # Whether nodes can be moved in bulk (see `move()`).
+    deletable = False  # Whether subtrees can be deleted in bulk (see `delete()`).
+    delete_batch_size = 500  # Maximum number of objects deleted with one statement (see `delete_subtrees()`).
+
+    # Defaults for subclasses not calling `__init__()` of this class.
+    ancestors_cache: Optional[AncestorsCache] = None
+    child_count_field: Optional[str] = None
+    child_count_maintain: bool = False
+    using: Optional[str] = None
+    lag_tolerance: Optional[float] = None
+    _written_at: Optional[Dict[str, float]] = None
+    _receivers: Optional[Dict[str, List[Tuple[Signal, Type[Model], str]]]] = None
+
+    def __init__(
+            self,
+            *,
+            ancestors_cache: Optional[AncestorsCache] = None,
+            child_count_field: Optional[str] = None,
+            child_count_maintain: bool = False,
+            using: Optional[str] = None,
+            lag_tolerance: Optional[float] = None
+    ):
+        """
+        :param ancestors_cache: Cache for ancestor paths of nodes (used in breadcrumbs).
+
+        :param child_count_field: Name of an integer field containing denormalized
+            immediate children count. If set, children count is read from fetched objects
+            instead of querying.
+
+        :param child_count_maintain: Keep `child_count_field` values up to date
+            on objects creation, deletion and moves. See `ChildCountMaintainer`.
+
+        :param using: Database alias (e.g. a read replica) to send navigation
+            and stats queries to. None - as decided by database routers.
+
+        :param lag_tolerance: Number of seconds after a change of model objects
+            made by this process during which navigation and stats queries
+            are sent to the primary database instead of `using`.
+            None - always use `using`.
+
+        """
+        self.ancestors_cache = ancestors_cache
+        self.child_count_field = child_count_field
+        self.child_count_maintain = child_count_maintain
+        self.using = using
+        self.lag_tolerance = lag_tolerance
+        self._written_at: Dict[str, float] = {}
+
+    def supports(self, *methods: str) -> bool:
+        """Returns True if the hierarchy implements all the given methods
+        left unimplemented in this base class (e.g. `fetch_tree`).
+
+        Features relying on methods not implemented are not offered.
+
+        :param methods: Method names.
+
+        """
+        cls = type(self)
+        return all(getattr(cls, method) is not getattr(Hierarchy, method) for method in methods)
+
+    @classmethod
+    def init_hierarchy(cls, model_admin: HierarchicalModelAdmin):
+        """Initializes model admin with hierarchy data."""
+
+        hierarchy = getattr(model_admin, 'hierarchy')
+
+        if hierarchy:
+            if not isinstance(hierarchy, Hierarchy):
+                hierarchy = AdjacencyList()  # For `True` and etc. TODO heuristics maybe.
+
+        else:
+            hierarchy = NoHierarchy()
+
+        model_admin.hierarchy = hierarchy
+
+    @classmethod
+    def get_pid_from_request(cls, changelist: 'HierarchicalChangeList', request: HttpRequest) -> Optional[str]:
+        """Gets parent ID from query string.
+
+        :param changelist:
+        :param request:
+
+        """
+        qs_param = cls.PARENT_ID_QS_PARAM
+
+        val = request.GET.get(qs_param, False)
+        pid = val or None
+
+        changelist.params.pop(qs_param, None)
+
+        return pid
+
+    @classmethod
+    def get_pid_from_changeform_request(cls, request: HttpRequest) -> Optional[str]:
+        """Gets parent ID from add/change form query string,
+        either passed directly or kept in preserved change list filters.
+
+        :param request:
+
+        """
+        qs_param = cls.PARENT_ID_QS_PARAM
+
+        pid = request.GET.get(qs_param)
+
+        if pid is None:
+            pid = QueryDict(request.GET.get('_changelist_filters', '')).get(qs_param)
+
+        return pid or None
+
+    def get_parent_field(self) -> Optional[str]:
+        """Returns the name of a foreign key field pointing to a parent (if any)."""
+        return None
+
+    def get_path(self, query_set: QuerySet, node: Any) -> List[Model]:
+        """Returns objects from the root down to the given node (inclusive).
+
+        Uses ancestors cache if configured (see `get_paths()`).
+
+        :param query_set: Base query set to get objects from.
+        :param node: Node object or ID.
+
+        """
+        pk = node.pk if isinstance(node, Model) else node
+        cache = self.ancestors_cache
+        cache_key = (query_set.model._meta.label_lower, str(pk))
+
+        if cache is not None:
+            detached = cache.get(cache_key)
+
+            if detached is not None:
+                return self.attach_path(detached)
+
+        path = self.fetch_path(query_set, node)
+
+        if cache is not None and path:
+            cache.set(cache_key, self.detach_path(path))
+
+        return path
+
+    def get_paths(self, query_set: QuerySet, objs: List[Model]) -> Dict[Any, List[Model]]:
+        """Returns objects from the root down to every given object (inclusive)
+        indexed by objects IDs.
+
+        Uses ancestors cache if configured. Paths of all ancestors
+        are cached as well, so that they are shared by their descendants.
+        Paths are cached as fields values (see `detach_path()`): every call
+        gets its own objects, since those are given request specific attributes.
+
+        :param query_set: Base query set to get objects from.
+        :param objs:
+
+        """
+        cache = self.ancestors_cache
+        label = query_set.model._meta.label_lower
+
+        paths = {}
+        missing = objs
+
+        if cache is not None:
+            missing = []
+
+            for obj in objs:
+                detached = cache.get((label, str(obj.pk)))
+
+                if detached is None:
+                    missing.append(obj)
+
+                else:
+                    paths[obj.pk] = self.attach_path(detached)
+
+        if missing:
+            fetched = self.fetch_paths(query_set, missing)
+            paths.update(fetched)
+
+            if cache is not None:
+                for path in fetched.values():
+                    detached = self.detach_path(path)
+
+                    for idx, node in enumerate(path, 1):
+                        cache.set((label, str(node.pk)), detached[:idx])
+
+        return paths
+
+    @staticmethod
+    def detach_path(path: List[Model]) -> Tuple[Tuple[Type[Model], str, Tuple[str, ...], Tuple], ...]:
+        """Returns (model, database alias, loaded fields names, fields values) for every object
+        of the given path, so that it can be cached without keeping objects themselves.
+        See `attach_path()`.
+
+        :param path:
+
+        """
+        detached = []
+
+        for node in path:
+            loaded = node.__dict__
+            attnames = tuple(field.attname for field in node._meta.concrete_fields if field.attname in loaded)
+            detached.append((type(node), node._state.db, attnames, tuple(loaded[attname] for attname in attnames)))
+
+        return tuple(detached)
+
+    @staticmethod
+    def attach_path(detached: Tuple[Tuple[Type[Model], str, Tuple[str, ...], Tuple], ...]) -> List[Model]:
+        """Returns new objects for a path detached with `detach_path()`.
+
+        :param detached:
+
+        """
+        return [model.from_db(db, list(attnames), list(values)) for model, db, attnames, values in detached]
+
+    def fetch_paths(self, query_set: QuerySet, objs: List[Model]) -> Dict[Any, List[Model]]:
+        """Fetches objects from the root down to every given object (inclusive)
+        indexed by objects IDs. Hierarchies should do it using one query.
+
+        :param query_set: Base query set to get objects from.
+        :param objs:
+
+        """
+        return {obj.pk: self.fetch_path(query_set, obj) for obj in objs}
+
+    def get_subtrees_sql(self, query_set: QuerySet, pks: List[Any]) -> Tuple[str, Tuple]:
+        """Returns SQL and params for a query selecting (origin_id, node_id) pairs
+        for all nodes of subtrees of the given nodes (the nodes themselves included).
+
+        :param query_set:
+        :param pks: Subtree roots IDs.
+
+        """
+        raise NotImplementedError  # pragma: nocover
+
+    def get_rollups(
+            self,
+            query_set: QuerySet,
+            objs: List[Model],
+            rollups: Dict[str, Rollup]
+    ) -> Dict[Any, Dict[str, Any]]:
+        """Returns rollups values (indexed by rollup names) for subtrees
+        of the given objects indexed by objects IDs.
+
+        Subtree nodes (see `get_subtrees_sql()`) are joined with values to aggregate
+        in one grouped query per rollups source (hierarchy model or a related model).
+
+        :param query_set: Base query set to get subtrees from.
+        :param objs:
+        :param rollups: Rollups indexed by names.
+
+        """
+        model = query_set.model
+        using = query_set.db
+        connection = connections[using]
+        qn = connection.ops.quote_name
+
+        pk_field = model._meta.pk
+        subtrees_sql, subtrees_params = self.get_subtrees_sql(query_set, [obj.pk for obj in objs])
+
+        sources = defaultdict(dict)
+
+        for name, rollup in rollups.items():
+            sources[rollup.related][name] = rollup
+
+        values = defaultdict(dict)
+
+        for related, source_rollups in sources.items():
+
+            if related is None:
+                source_model, node_field = model, 'pk'
+
+            else:
+                relation = model._meta.get_field(related)
+                source_model, node_field = relation.related_model, relation.field.name
+
+            # Declared aggregates are compiled as is (distinct, filter and the like included)
+            # against source model query, which also gives the joins they need.
+            query = source_model._default_manager.using(using).order_by().query.clone()
+            node = F(node_field).resolve_expression(query)
+            expressions = [rollup.aggregate.resolve_expression(query) for rollup in source_rollups.values()]
+
+            compiler = query.get_compiler(using)
+            node_sql, node_params = compiler.compile(node)
+
+            select, select_params = [], []
+
+            for expression in expressions:
+                expression_sql, expression_params = compiler.compile(expression)
+                select.append(expression_sql)
+                select_params.extend(expression_params)
+
+            from_clause, from_params = compiler.get_from_clause()
+
+            where_sql, where_params = '', []
+
+            if query.where:  # Default manager may filter objects out.
+                try:
+                    where_sql, where_params = compiler.compile(query.where)
+
+                except EmptyResultSet:
+                    continue
+
+            sql = (
+                f'SELECT s.origin_id AS {qn("admirarchy_node")}, {", ".join(select)} '
+                f'FROM {" ".join(from_clause)} '
+                f'INNER JOIN ({subtrees_sql}) s ON s.node_id = {node_sql}'
+                f'{f" WHERE {where_sql}" if where_sql else ""} '
+                f'GROUP BY s.origin_id'
+            )
+            params = (
+                tuple(select_params) + tuple(from_params) + tuple(subtrees_params) +
+                tuple(node_params) + tuple(where_params)
+            )
+
+            # Resolved aggregates give output fields to convert raw values with (as ORM does).
+            converters = [
+                connection.ops.get_db_converters(expression) + expression.get_db_converters(connection)
+                for expression in expressions
+            ]
+
+            with connection.cursor() as cursor:
+                cursor.execute(sql, params)
+
+                for origin_id, *row in cursor.fetchall():
+
+                    for idx, (expression, expression_converters) in enumerate(zip(expressions, converters)):
+                        for converter in expression_converters:
+                            row[idx] = converter(row[idx], expression, connection)
+
+                    values[pk_field.to_python(origin_id)].update(zip(source_rollups, row))
+
+        return {
+            obj.pk: {name: values[obj.pk].get(name, rollup.default) for name, rollup in rollups.items()}
+            for obj in objs
+        }
+
+    def contribute_rollups(self, model_admin: HierarchicalModelAdmin, objs: List[Model]):
+        """Attaches rollups values to the given objects.
+        Uses stats cache if configured for model admin.
+
+        :param model_admin:
+        :param objs:
+
+        """
+        rollups = model_admin.hierarchy_rollups
+
+        if not rollups or not objs:
+            return
+
+        model = model_admin.model
+        cache: Optional[StatsCache] = model_admin.hierarchy_stats_cache
+
+        # Cached values are keyed by rollups definitions, since those could have been reconfigured since.
+        keys = {name: f'{name}:{rollup.signature}' for name, rollup in rollups.items()}
+
+        values = {}
+
+        if cache is not None:
+            values = {
+                pk: {name: cached[key] for name, key in keys.items()}
+                for pk, cached in cache.get_rollups_many(model, [obj.pk for obj in objs]).items()
+                if set(keys.values()).issubset(cached)
+            }
+
+        missing = [obj for obj in objs if obj.pk not in values]
+
+        if missing:
+            values_fetched = self.get_rollups(self.get_read_queryset(model.objects.all()), missing, rollups)
+            values.update(values_fetched)
+
+            if cache is not None:
+                cache.set_rollups_many(model, {
+                    pk: {keys[name]: value for name, value in fetched.items()}
+                    for pk, fetched in values_fetched.items()
+                })
+
+        for obj in objs:
+            setattr(obj, self.ROLLUPS_MODEL_ATTR, values[obj.pk])
+
+    def contribute_paths(self, model_admin: HierarchicalModelAdmin, objs: List[Model]):
+        """Attaches ancestors to the given objects.
+
+        :param model_admin:
+        :param objs:
+
+        """
+        paths = self.get_paths(self.get_read_queryset(model_admin.model.objects.all()), objs)
+
+        for obj in objs:
+            setattr(obj, self.ANCESTORS_MODEL_ATTR, paths.get(obj.pk, [])[:-1])
+
+    def fetch_path(self, query_set: QuerySet, node: Any) -> List[Model]:
+        """Fetches objects from the root down to the given node (inclusive).
+        Hierarchies implementing breadcrumbs should do it using one query.
+
+        :param query_set: Base query set to get objects from.
+        :param node: Node object or ID.
+
+        """
+        return []
+
+    def get_descendant_count(self, obj: Model) -> Optional[int]:
+        """Returns a number of all descendants of the given object
+        if it can be computed without querying, otherwise None.
+
+        :param obj:
+
+        """
+        return None
+
+    def get_child_count_subquery(self, query_set: QuerySet) -> Coalesce:
+        """Returns an expression counting immediate children of an outer query row.
+
+        :param query_set:
+
+        """
+        raise NotImplementedError  # pragma: nocover
+
+    def get_parent_id(self, model: Type[Model], instance: Model) -> Optional[Any]:
+        """Returns parent ID of the given node as currently stored in DB.
+
+        :param model:
+        :param instance:
+
+        """
+        if instance.pk is None:
+            return None
+
+        try:
+            path = self.fetch_path(model._default_manager.all(), instance.pk)
+
+        except ObjectDoesNotExist:
+            return None
+
+        return path[-2].pk if len(path) > 1 else None
+
+    def get_saved_parent_id(self, model: Type[Model], instance: Model) -> Optional[Any]:
+        """Returns parent ID of the given node just saved.
+        Hierarchies storing parent ID in the node itself read it without querying.
+
+        :param model:
+        :param instance:
+
+        """
+        return self.get_parent_id(model, instance)
+
+    def get_position_fields(self) -> Optional[List[str]]:
+        """Returns names of model fields defining node position in a hierarchy.
+        None - position is not (only) stored in model fields.
+
+        """
+        return None
+
+    def get_read_db(self, model: Type[Model]) -> str:
+        """Returns database alias to send navigation and stats queries to.
+
+        That is `using` unless model objects were changed by this process
+        less than `lag_tolerance` seconds ago, when the primary database is used.
+
+        :param model:
+
+        """
+        using = self.using
+
+        if using is None:
+            return router.db_for_read(model)
+
+        lag_tolerance = self.lag_tolerance
+
+        if lag_tolerance is not None:
+            written_at = (self._written_at or {}).get(model._meta.label_lower)
+
+            if written_at is not None and monotonic() - written_at < lag_tolerance:
+                return router.db_for_write(model)
+
+        return using
+
+    def get_read_queryset(self, query_set: QuerySet) -> QuerySet:
+        """Returns the given query set bound to the database
+        for navigation and stats queries.
+
+        :param query_set:
+
+        """
+        return query_set.using(self.get_read_db(query_set.model))
+
+    def watch_writes(self, model: Type[Model]):
+        """Connects signal handlers registering the time of model objects changes
+        if `lag_tolerance` is set. See `get_read_db()`.
+
+        :param model:
+
+        """
+        if self.using is None or self.lag_tolerance is None:
+            return
+
+        label = model._meta.label_lower
+
+        if self._written_at is None:
+            self._written_at = {}
+
+        written_at = self._written_at
+
+        def on_write(sender, **kwargs):
+            written_at[label] = monotonic()
+            # Replication only starts on commit.
+            transaction.on_commit(lambda: written_at.__setitem__(label, monotonic()), using=router.db_for_write(model))
+
+        uid = f'admirarchy_{id(self)}_{label}_write'
+
+        connect = self.connect_signal
+        connect(model, signals.post_save, on_write, sender=model, dispatch_uid=f'{uid}_post_save')
+        connect(model, signals.post_delete, on_write, sender=model, dispatch_uid=f'{uid}_post_delete')
+        connect(model, hierarchy_changed, on_write, sender=model, dispatch_uid=f'{uid}_bulk_change')
+
+    def connect_signal(
+            self,
+            model: Type[Model],
+            signal: Signal,
+            receiver: Callable,
+            *,
+            sender: Type[Model],
+            dispatch_uid: str
+    ):
+        """Connects a signal handler (strongly referenced) on behalf of the given model,
+        so that it can be disconnected later with `disconnect_signals()`.
+
+        :param model: Hierarchical model the handler is connected for.
+        :param signal:
+        :param receiver:
+        :param sender: Model sending the signal (may differ from `model`, e.g. closure model).
+        :param dispatch_uid:
+
+        """
+        signal.connect(receiver, sender=sender, weak=False, dispatch_uid=dispatch_uid)
+
+        if self._receivers is None:
+            self._receivers = {}
+
+        self._receivers.setdefault(model._meta.label_lower, []).append((signal, sender, dispatch_uid))
+
+    def disconnect_signals(self, model: Type[Model]):
+        """Disconnects all the signal handlers connected by this hierarchy for the given model
+        (see `watch_changes()`, `watch_rollups()`, `watch_writes()`, `connect_child_count_maintainer()`).
+
+        :param model:
+
+        """
+        for signal, sender, dispatch_uid in (self._receivers or {}).pop(model._meta.label_lower, []):
+            signal.disconnect(sender=sender, dispatch_uid=dispatch_uid)
+
+    def get_children_stats(self, query_set: QuerySet, objs: List[Model]) -> Dict[Any, Tuple[int, Optional[int]]]:
+        """Returns (immediate children, all descendants) counts for the given objects
+        indexed by objects IDs. Descendants count is None if not supported by a hierarchy.
+
+        :param query_set: Base query set to count children in.
+        :param objs:
+
+        """
+        return {}
+
+    def contribute_stats(self, model_admin: HierarchicalModelAdmin, objs: List[Model]):
+        """Attaches children stats to the given objects.
+
+        Objects already having children count (e.g. annotated) are skipped.
+        Uses stats cache if configured for model admin.
+
+        :param model_admin:
+        :param objs:
+
+        """
+        annotation = self.CHILD_COUNT_ANNOTATION
+
+        for obj in objs:
+            if hasattr(obj, annotation):
+                setattr(obj, self.CHILD_COUNT_MODEL_ATTR, getattr(obj, annotation))
+
+        objs = [obj for obj in objs if not hasattr(obj, self.CHILD_COUNT_MODEL_ATTR)]
+
+        if not objs:
+            return
+
+        child_count_field = self.child_count_field
+
+        if child_count_field:
+            # Denormalized counts are already fetched.
+            for obj in objs:
+                setattr(obj, self.CHILD_COUNT_MODEL_ATTR, getattr(obj, child_count_field))
+                descendants_count = self.get_descendant_count(obj)
+
+                if descendants_count is not None:
+                    setattr(obj, self.DESCENDANT_COUNT_MODEL_ATTR, descendants_count)
+
+            return
+
+        model = model_admin.model
+        cache: Optional[StatsCache] = model_admin.hierarchy_stats_cache
+
+        stats = {}
+
+        if cache is not None:
+            stats = cache.get_many(model, [obj.pk for obj in objs])
+
+        missing = [obj for obj in objs if obj.pk not in stats]
+
+        if missing:
+            stats_fetched = self.get_children_stats(self.get_read_queryset(model.objects.all()), missing)
+            stats.update(stats_fetched)
+
+            if cache is not None:
+                cache.set_many(model, stats_fetched)
+
+        for obj in objs:
+            obj_stats = stats.get(obj.pk)
+
+            if obj_stats is None:
+                continue  # Stats are not supported by the hierarchy.
+
+            children_count, descendants_count = obj_stats
+            setattr(obj, self.CHILD_COUNT_MODEL_ATTR, children_count)
+
+            if descendants_count is not None:
+                setattr(obj, self.DESCENDANT_COUNT_MODEL_ATTR, descendants_count)
+
+    def get_affected_ids(self, model: Type[Model], instance: Model) -> Set[Any]:
+        """Returns IDs of nodes whose children stats depend on the given node position,
+        i.e. the node itself and all its ancestors, as currently stored in DB.
+
+        :param model:
+        :param instance:
+
+        """
+        if instance.pk is None:
+            return set()
+
+        try:
+            path = self.fetch_path(model._default_manager.all(), instance.pk)
+
+        except ObjectDoesNotExist:
+            return set()
+
+        return {node.pk for node in path}
+
+    def watch_changes(self, model: Type[Model], stats_cache: Optional[StatsCache] = None):
+        """Connects signal handlers invalidating caches on model objects save and delete.
+
+        Stats are invalidated precisely: for the old and the new parent of a node
+        and all their ancestors. Ancestors cache is cleared entirely,
+        since a change may affect paths of a whole subtree.
+
+        :param model:
+        :param stats_cache:
+
+        """
+        ancestors_cache = self.ancestors_cache
+
+        if stats_cache is None and ancestors_cache is None:
+            return
+
+        affected_attr = '_admirarchy_affected_ids'
+
+        def invalidate(affected_ids: Set[Any]):
+
+            if ancestors_cache is not None:
+                ancestors_cache.clear()
+
+            if stats_cache is not None:
+                stats_cache.delete_many(model, affected_ids)
+
+        def on_change(affected_ids: Set[Any]):
+            invalidate(affected_ids)
+            # Once again after commit, since stats could be cached by concurrent readers meanwhile.
+            transaction.on_commit(lambda: invalidate(affected_ids), using=router.db_for_write(model))
+
+        def on_pre_change(sender, instance, **kwargs):
+            setattr(instance, affected_attr, self.get_affected_ids(sender, instance))
+
+        def on_post_save(sender, instance, **kwargs):
+            on_change(getattr(instance, affected_attr, set()) | self.get_affected_ids(sender, instance))
+
+        def on_post_delete(sender, instance, **kwargs):
+            on_change(getattr(instance, affected_attr, set()))
+
+        uid = f'admirarchy_{id(self)}_{model._meta.label_lower}'
+
+        def on_bulk_change(sender, affected_ids, **kwargs):
+            on_change(set(affected_ids))
+
+        connect = self.connect_signal
+        connect(model, signals.pre_save, on_pre_change, sender=model, dispatch_uid=f'{uid}_pre_save')
+        connect(model, signals.post_save, on_post_save, sender=model, dispatch_uid=f'{uid}_post_save')
+        connect(model, signals.pre_delete, on_pre_change, sender=model, dispatch_uid=f'{uid}_pre_delete')
+        connect(model, signals.post_delete, on_post_delete, sender=model, dispatch_uid=f'{uid}_post_delete')
+        connect(model, hierarchy_changed, on_bulk_change, sender=model, dispatch_uid=f'{uid}_bulk_change')
+
+    def watch_rollups(
+            self,
+            model: Type[Model],
+            rollups: Optional[Dict[str, Rollup]],
+            stats_cache: Optional[StatsCache] = None
+    ):
+        """Connects signal handlers invalidating cached rollups on save and delete
+        of related model objects aggregated by rollups (see `Rollup.related`).
+
+        Rollups are invalidated for the node an object refers to
+        (both the old and the new one on save) and all its ancestors.
+        Changes of hierarchy model objects are handled by `watch_changes()`.
+
+        :param model:
+        :param rollups: Rollups indexed by names.
+        :param stats_cache:
+
+        """
+        if stats_cache is None or not rollups:
+            return
+
+        node_attr_names = {}
+
+        for rollup in rollups.values():
+            if rollup.related:
+                relation = model._meta.get_field(rollup.related)
+                node_attr_names[relation.related_model] = relation.field.attname
+
+        affected_attr = '_admirarchy_rollups_affected_ids'
+
+        def get_affected_ids(node_id: Any) -> Set[Any]:
+            if node_id is None:
+                return set()
+            return self.get_affected_ids(model, model(pk=node_id))
+
+        def on_change(affected_ids: Set[Any]):
+            stats_cache.delete_many(model, affected_ids)
+            # Once again after commit, since rollups could be cached by concurrent readers meanwhile.
+            transaction.on_commit(
+                lambda: stats_cache.delete_many(model, affected_ids), using=router.db_for_write(model))
+
+        for source_model, node_attr in node_attr_names.items():
+
+            def on_pre_save(sender, instance, node_attr=node_attr, **kwargs):
+                node_id = None
+
+                if instance.pk is not None and not instance._state.adding:
+                    # Object could have been moved from another node.
+                    node_id = sender._default_manager.filter(
+                        pk=instance.pk).values_list(node_attr, flat=True).first()
+
+                setattr(instance, affected_attr, get_affected_ids(node_id))
+
+            def on_post_save(sender, instance, node_attr=node_attr, **kwargs):
+                on_change(
+                    getattr(instance, affected_attr, set()) | get_affected_ids(getattr(instance, node_attr)))
+
+            def on_post_delete(sender, instance, node_attr=node_attr, **kwargs):
+                on_change(get_affected_ids(getattr(instance, node_attr)))
+
+            uid = f'admirarchy_{id(self)}_{model._meta.label_lower}_rollups_{source_model._meta.label_lower}'
+
+            connect = self.connect_signal
+            connect(model, signals.pre_save, on_pre_save, sender=source_model, dispatch_uid=f'{uid}_pre_save')
+            connect(model, signals.post_save, on_post_save, sender=source_model, dispatch_uid=f'{uid}_post_save')
+            connect(model, signals.post_delete, on_post_delete, sender=source_model, dispatch_uid=f'{uid}_post_delete')
+
+    def connect_child_count_maintainer(self, model: Type[Model]):
+        """Connects signal handlers keeping denormalized children count
+        up to date if configured so.
+
+        :param model:
+
+        """
+        if self.child_count_field and self.child_count_maintain:
+            ChildCountMaintainer(model, self).connect()
+
+    def resolve_parent(self, changelist: 'HierarchicalChangeList'):
+        """Resolves parent path (and parent itself if not yet resolved)
+        for the current request hierarchy context.
+
+        :param changelist:
+
+        """
+        context = changelist.hierarchy_context
+
+        if context.ancestors is not None:
+            return
+
+        model = changelist.model
+        query_set = self.get_read_queryset(model.objects.all())
+
+        if not self.supports('fetch_path'):
+            # Ancestors are unknown: upper level link leads to the root.
+            if context.parent is None:
+                context.parent = query_set.get(pk=context.pid)
+
+            context.ancestors = []
+            return
+
+        path = self.get_path(query_set, context.parent or context.pid)
+
+        if not path:
+            raise model.DoesNotExist(f'{model._meta.object_name} matching query does not exist.')
+
+        if context.parent is None:
+            context.parent = path[-1]
+
+        context.ancestors = path[:-1]
+
+    def get_level_size(self, changelist: 'HierarchicalChangeList') -> Optional[int]:
+        """Returns a number of items on the current level if it is known
+        without counting them (from stats cache or denormalized children count),
+        otherwise None.
+
+        Since the number does not respect restrictions applied by `ModelAdmin.get_queryset()`,
+        it is only used if the method is not overridden, unless
+        `HierarchicalModelAdmin.hierarchy_level_size_from_stats` says otherwise.
+
+        :param changelist:
+
+        """
+        context = changelist.hierarchy_context
+        pid = context.pid
+
+        if not pid:
+            return None
+
+        model_admin = changelist.model_admin
+        from_stats = model_admin.hierarchy_level_size_from_stats
+
+        if from_stats is None:
+            from_stats = type(model_admin).get_queryset is ModelAdmin.get_queryset
+
+        if not from_stats:
+            return None
+
+        cache: Optional[StatsCache] = model_admin.hierarchy_stats_cache
+
+        if cache is not None:
+            stats = cache.get_many(changelist.model, [pid])
+
+            if stats:
+                return stats[pid][0]
+
+        child_count_field = self.child_count_field
+
+        if child_count_field:
+            self.resolve_parent(changelist)
+            return getattr(context.parent, child_count_field)
+
+        return None
+
+    def filter_children(self, query_set: QuerySet, node: Any) -> QuerySet:
+        """Returns query set narrowed to immediate children of the given node.
+
+        :param query_set:
+        :param node: Node object or ID. None - root level.
+
+        """
+        raise NotImplementedError  # pragma: nocover
+
+    def filter_subtree(self, query_set: QuerySet, node: Any) -> QuerySet:
+        """Returns query set narrowed to all descendants of the given node.
+
+        :param query_set:
+        :param node: Node object or ID.
+
+        """
+        raise NotImplementedError  # pragma: nocover
+
+    def iter_children(self, query_set: QuerySet, pks: List[Any], batch_size: int) -> Iterator[Tuple[Any, Model]]:
+        """Yields (parent ID, object) pairs for immediate children of the given nodes.
+
+        :param query_set:
+        :param pks: Nodes IDs.
+        :param batch_size: Number of objects to fetch from DB at once.
+
+        """
+        raise NotImplementedError  # pragma: nocover
+
+    def can_export(self) -> bool:
+        """Returns True if subtrees can be iterated over for export (see `iter_subtree()`)."""
+        return self.supports('iter_subtree') or self.supports('filter_children', 'iter_children')
+
+    def iter_subtree(
+            self,
+            query_set: QuerySet,
+            node: Optional[Model],
+            batch_size: int = 1000
+    ) -> Iterator[Tuple[Model, int, str]]:
+        """Yields (object, depth, path) for the given node and all its descendants.
+        Depth is relative to the node, path is made of objects titles starting from the node.
+
+        Descendants are fetched level by level in batches, so that
+        memory use does not depend on subtree depth or size (only on level width).
+
+        :param query_set: Base query set to get objects from.
+        :param node: Node object. None - all the trees.
+        :param batch_size: Number of objects to fetch from DB at once.
+
+        """
+        sep = self.PATH_SEPARATOR
+
+        if node is None:
+            top = self.filter_children(query_set, None).order_by('pk').iterator(chunk_size=batch_size)
+
+        else:
+            top = [node]
+
+        level = []  # (ID, path) pairs of objects on the current level.
+
+        for obj in top:
+            obj_path = str(obj)
+            yield obj, 0, obj_path
+            level.append((obj.pk, obj_path))
+
+        node_pk = getattr(node, 'pk', None)
+        depth = 0
+
+        while level:
+            depth += 1
+            next_level = []
+
+            for idx in range(0, len(level), batch_size):
+                paths = dict(level[idx:idx + batch_size])
+
+                for parent_pk, obj in self.iter_children(query_set, list(paths), batch_size):
+
+                    if obj.pk == node_pk:  # Guard against cycles.
+                        continue
+
+                    obj_path = f'{paths[parent_pk]}{sep}{obj}'
+                    yield obj, depth, obj_path
+                    next_level.append((obj.pk, obj_path))
+
+            level = next_level
+
+    def fetch_tree(
+            self,
+            query_set: QuerySet,
+            node: Any,
+            depth: int,
+            limit: Optional[int] = None
+    ) -> List[Tuple[Model, int]]:
+        """Fetches descendants of the given node down to the given depth
+        with one query. Returns (object, depth) pairs in tree order,
+        depth is relative to the node (immediate children have 1).
+
+        :param query_set: Base query set to get objects from.
+        :param node: Node object or ID. None - root level.
+        :param depth: Maximum depth of descendants.
+        :param limit: Maximum number of objects (first in tree order). None - no limit.
+
+        """
+        raise NotImplementedError  # pragma: nocover
+
+    def can_move(self) -> bool:
+        """Returns True if nodes can be moved in bulk (see `move()`)."""
+        return self.movable and self.supports('get_move_roots', 'move_nodes')
+
+    def move(self, query_set: QuerySet, target: Optional[Model]) -> int:
+        """Moves nodes of the given query set (with their subtrees) to become
+        the last children of the target node in one transaction.
+        Returns a number of moved subtrees.
+
+        Nodes selected together with their ancestors are moved along with them.
+        Children stats caches and denormalized children counts are updated.
+
+        :param query_set: Nodes to move.
+        :param target: New parent. None - root level.
+
+        :raises ValidationError: If the target is one of the nodes or their descendant.
+
+        """
+        model = query_set.model
+        using = router.db_for_write(model)
+        base_qs = model._default_manager.using(using)
+
+        with transaction.atomic(using=using):
+            nodes = self.get_move_roots(base_qs, list(query_set.values_list('pk', flat=True)), target)
+
+            if not nodes:
+                return 0
+
+            affected_ids = set()
+            parent_ids = set()
+
+            for path in self.fetch_paths(base_qs, nodes).values():
+                affected_ids.update(node.pk for node in path[:-1])
+
+                if len(path) > 1:
+                    parent_ids.add(path[-2].pk)
+
+            self.move_nodes(base_qs, nodes, target)
+
+            if target is not None:
+                affected_ids.update(node.pk for node in self.fetch_path(base_qs, target.pk))
+                parent_ids.add(target.pk)
+
+            if self.child_count_field:
+                ChildCountMaintainer(model, self).recount(parent_ids, using=using)
+
+            hierarchy_changed.send(sender=model, affected_ids=affected_ids)
+
+        return len(nodes)
+
+    def get_move_roots(self, query_set: QuerySet, pks: List[Any], target: Optional[Model]) -> List[Model]:
+        """Returns nodes to be moved skipping those having an ancestor among them.
+
+        :param query_set:
+        :param pks: IDs of selected nodes.
+        :param target: New parent. None - root level.
+
+        :raises ValidationError: If the target is one of the nodes or their descendant.
+
+        """
+        raise NotImplementedError  # pragma: nocover
+
+    def move_nodes(self, query_set: QuerySet, nodes: List[Model], target: Optional[Model]):
+        """Moves the given nodes (with their subtrees) under the target node.
+
+        :param query_set:
+        :param nodes: Nodes to move. None of them is an ancestor of another.
+        :param target: New parent. None - root level.
+
+        """
+        raise NotImplementedError  # pragma: nocover
+
+    @staticmethod
+    def get_move_cycle_error() -> ValidationError:
+        return ValidationError(_('Objects can not be moved into their own subtrees.'), code='cycle')
+
+    def can_delete(self, model: Type[Model], raw: bool = False) -> bool:
+        """Returns True if subtrees of the given model can be deleted in bulk (see `delete()`).
+
+        Raw deletion additionally requires that no other objects refer to model objects
+        in a way requiring their collection on deletion (e.g. cascades, many-to-many relations).
+
+        :param model:
+        :param raw: Whether deletion is raw (see `delete_subtrees_raw()`).
+
+        """
+        if not self.deletable or not self.supports('get_move_roots', 'get_subtrees_sql', 'get_subtrees_levels'):
+            return False
+
+        if not raw:
+            return True
+
+        opts = model._meta
+
+        if not self.supports('delete_subtrees_raw') or opts.parents or opts.many_to_many:
+            return False
+
+        parent_field = self.get_parent_field()
+
+        for relation in opts.related_objects:
+
+            if relation.related_model is model and relation.field.name == parent_field:
+                continue  # Descendants are deleted anyway.
+
+            if relation.many_to_many or relation.on_delete is not models.DO_NOTHING:
+                return False
+
+        return True
+
+    def get_subtrees(self, query_set: QuerySet) -> List[Tuple[Model, int]]:
+        """Returns (node, descendants count) pairs for nodes of the given query set
+        skipping those having an ancestor among them.
+
+        :param query_set:
+
+        """
+        model = query_set.model
+        base_qs = model._default_manager.using(router.db_for_read(model))
+
+        roots = self.get_move_roots(base_qs, list(query_set.values_list('pk', flat=True)), None)
+        sizes = self.get_subtree_sizes(base_qs, roots) if roots else {}
+
+        return [(root, sizes[root.pk]) for root in roots]
+
+    def delete(
+            self,
+            query_set: QuerySet,
+            *,
+            raw: bool = False,
+            on_delete: Optional[Callable[[List[Model]], Any]] = None
+    ) -> int:
+        """Deletes nodes of the given query set along with all their descendants
+        in one transaction. Returns a number of deleted objects.
+
+        Objects are deleted with public `QuerySet.delete()` level by level, the deepest first
+        (see `delete_subtrees()`), so deletion signals are sent and cascades are followed.
+        Denormalized children counts of parents are recounted, ancestors cache
+        is cleared and `hierarchy_changed` signal is sent to invalidate children stats cache.
+        See `can_delete()`.
+
+        :param query_set: Nodes to delete.
+
+        :param raw: Delete with a few set-based statements without collecting objects
+            (see `delete_subtrees_raw()`). Deletion signals are not sent and
+            `on_delete` is not called for deleted objects.
+
+        :param on_delete: Callable receiving every batch of objects before it is deleted
+            (e.g. to log deletions).
+
+        """
+        model = query_set.model
+        using = router.db_for_write(model)
+        base_qs = model._default_manager.using(using)
+
+        with transaction.atomic(using=using):
+            nodes = self.get_move_roots(base_qs, list(query_set.values_list('pk', flat=True)), None)
+
+            if not nodes:
+                return 0
+
+            affected_ids = set()
+            parent_ids = set()
+
+            for path in self.fetch_paths(base_qs, nodes).values():
+                affected_ids.update(node.pk for node in path)
+
+                if len(path) > 1:
+                    parent_ids.add(path[-2].pk)
+
+            if raw:
+                deleted = self.delete_subtrees_raw(base_qs, nodes)
+
+            else:
+                deleted = self.delete_subtrees(base_qs, nodes, on_delete)
+
+            if self.child_count_field:
+                ChildCountMaintainer(model, self).recount(parent_ids, using=using)
+
+            ancestors_cache = self.ancestors_cache
+
+            if ancestors_cache is not None:
+                # Deleted nodes may be in paths of any descendants cached.
+                ancestors_cache.clear()
+                transaction.on_commit(ancestors_cache.clear, using=using)
+
+            hierarchy_changed.send(sender=model, affected_ids=affected_ids)
+
+        return deleted
+
+    @staticmethod
+    def delete_queryset(query_set: QuerySet) -> int:
+        """Deletes objects of the given query set with one statement (used for raw deletion).
+        Returns a number of deleted objects.
+
+        Public `QuerySet.delete()` is used if Django can delete objects without collecting them
+        (no deletion signals receivers, no cascades, including parent foreign key).
+        Otherwise objects are deleted bypassing collection: no deletion signals are sent.
+
+        :param query_set:
+
+        """
+        if Collector(using=query_set.db).can_fast_delete(query_set):
+            return query_set.delete()[0]
+
+        return query_set._raw_delete(query_set.db)
+
+    def get_subtree_sizes(self, query_set: QuerySet, nodes: List[Model]) -> Dict[Any, int]:
+        """Returns descendants counts of the given nodes indexed by nodes IDs
+        using one grouped query over subtrees (see `get_subtrees_sql()`).
+
+        :param query_set:
+        :param nodes: None of them is an ancestor of another.
+
+        """
+        sql, params = self.get_subtrees_sql(query_set, [node.pk for node in nodes])
+
+        with connections[query_set.db].cursor() as cursor:
+            cursor.execute(f'SELECT origin_id, COUNT(*) - 1 FROM ({sql}) s GROUP BY origin_id', params)
+            to_python = query_set.model._meta.pk.to_python
+            sizes = {to_python(pk): size for pk, size in cursor.fetchall()}
+
+        return {node.pk: sizes.get(node.pk, 0) for node in nodes}
+
+    def get_subtrees_levels(self, query_set: QuerySet, nodes: List[Model]) -> List[List[Any]]:
+        """Returns IDs of all nodes of subtrees of the given nodes (the nodes themselves included)
+        grouped by levels, the deepest level first.
+
+        :param query_set:
+        :param nodes: None of them is an ancestor of another.
+
+        """
+        raise NotImplementedError  # pragma: nocover
+
+    def delete_subtrees(
+            self,
+            query_set: QuerySet,
+            nodes: List[Model],
+            on_delete: Optional[Callable[[List[Model]], Any]] = None
+    ) -> int:
+        """Deletes the given nodes along with their descendants with public `QuerySet.delete()`
+        level by level, the deepest first, in batches of `delete_batch_size`.
+        Returns a number of deleted objects.
+
+        Children are always deleted before their parents, so no statement removes both
+        and IDs are passed as values (not as a subquery on the same table).
+
+        :param query_set:
+        :param nodes: None of them is an ancestor of another.
+        :param on_delete: Callable receiving every batch of objects before it is deleted.
+
+        """
+        label = query_set.model._meta.label
+        batch_size = self.delete_batch_size
+        deleted = 0
+
+        for level in self.get_subtrees_levels(query_set, nodes):
+
+            for idx in range(0, len(level), batch_size):
+                batch_qs = query_set.filter(pk__in=level[idx:idx + batch_size])
+
+                if on_delete is not None:
+                    on_delete(list(batch_qs))
+
+                deleted += batch_qs.delete()[1].get(label, 0)
+
+        return deleted
+
+    def delete_subtrees_raw(self, query_set: QuerySet, nodes: List[Model]) -> int:
+        """Deletes the given nodes along with their descendants with a few set-based statements
+        without collecting objects (see `delete_queryset()`): deletion signals are not sent.
+        Returns a number of deleted objects.
+
+        :param query_set:
+        :param nodes: None of them is an ancestor of another.
+
+        """
+        raise NotImplementedError  # pragma: nocover
+
+    def get_keyset_ordering(self) -> List[str]:
+        """Returns fields to order objects by for keyset pagination.
+        Values of these fields combined must be unique and better be indexed.
+
+        """
+        return ['-pk']
+
+    def get_upper_level_link(self, changelist: 'HierarchicalChangeList') -> Model:
+        """Returns a dummy object to render a link to the upper level.
+
+        :param changelist:
+
+        """
+        self.resolve_parent(changelist)
+
+        ancestors = changelist.hierarchy_context.ancestors
+
+        link = changelist.model(pk=ancestors[-1].pk if ancestors else None)
+        setattr(link, self.UPPER_LEVEL_MODEL_ATTR, True)
+
+        return link
+
+    def hook_change_view(self, model_admin: HierarchicalModelAdmin, view_args: Tuple, view_kwargs: Dict):
+        """Triggered by `ModelAdmin.change_view()`."""
+
+    def hook_add_view(self, model_admin: HierarchicalModelAdmin, view_args: Tuple, view_kwargs: Dict):
+        """Triggered by `ModelAdmin.add_view()`."""
+
+    def hook_get_readonly_fields(
+            self,
+            model_admin: HierarchicalModelAdmin,
+            obj: Optional[Model],
+            readonly_fields: Union[List[str], Tuple[str, ...]]
+    ) -> Union[List[str], Tuple[str, ...]]:
+        """Triggered by `ModelAdmin.get_readonly_fields()`."""
+        return readonly_fields
+
+    def hook_get_form(
+            self,
+            model_admin: HierarchicalModelAdmin,
+            request: HttpRequest,
+            obj: Optional[Model],
+            form: Type[forms.ModelForm]
+    ) -> Type[forms.ModelForm]:
+        """Triggered by `ModelAdmin.get_form()`."""
+        return form
+
+    def hook_save_model(self, model_admin: HierarchicalModelAdmin, request: HttpRequest, obj: Model, change: bool):
+        """Triggered by `ModelAdmin.save_model()` before an object is saved."""
+
+    def hook_get_results(self, changelist: 'HierarchicalChangeList'):
+        """Triggered by `ChangeList.get_results()`.
+
+        Attaches children stats to results and prepends upper level link.
+        Chunked results are processed lazily, chunk by chunk.
+
+        """
+        result_list = changelist.result_list
+        context = changelist.hierarchy_context
+
+        head = []
+
+        if context.pid:
+            with context.measure('upper_level'):
+                head.append(self.get_upper_level_link(changelist))
+
+        if isinstance(result_list, ChunkedResults):
+            result_list.head[:0] = head
+            result_list.processors.append(lambda objs: self.process_results(changelist, objs))
+            return
+
+        result_list = list(result_list)
+        self.process_results(changelist, result_list)
+
+        changelist.result_list = head + result_list
+
+    def process_results(self, changelist: 'HierarchicalChangeList', objs: List[Model]):
+        """Attaches children stats (and paths for search results) to the given objects.
+
+        :param changelist:
+        :param objs:
+
+        """
+        model_admin = changelist.model_admin
+        context = changelist.hierarchy_context
+
+        with context.measure('stats'):
+            self.contribute_stats(model_admin, objs)
+
+        if changelist.query and model_admin.hierarchy_search_paths:
+            with context.measure('paths'):
+                self.contribute_paths(model_admin, objs)
+
+        if model_admin.hierarchy_rollups and self.supports('get_subtrees_sql'):
+            with context.measure('rollups'):
+                self.contribute_rollups(model_admin, objs)
+
+    def hook_get_queryset(self, changelist: 'HierarchicalChangeList', request: HttpRequest):
+        """Triggered by `ChangeList.get_queryset()`."""
+
+    def hook_filter_queryset(self, changelist: 'HierarchicalChangeList', query_set: QuerySet) -> QuerySet:
+        """Triggered by `ChangeList.get_queryset()`."""
+        return query_set
+
+    def hook_get_results_queryset(self, changelist: 'HierarchicalChangeList', query_set: QuerySet) -> QuerySet:
+        """Triggered by `ChangeList.get_results()` to get a query set objects of a page
+        are fetched from (it is not used for counting)."""
+        return query_set
+
+
+class NoHierarchy(Hierarchy):
+    """Dummy (disabled) hierarchy class."""
+
+    def hook_get_results(self, changelist: 'HierarchicalChangeList'):
+        """Triggered by `ChangeList.get_results()`."""
+
+
+class AdjacencyList(Hierarchy):
+
+    movable = True
+    deletable = True
+
+    def __init__(self, parent_id_field: str = 'parent', count_in_query: bool = False, **kwargs):
+        """
+        :param parent_id_field: Name of a field containing parent item identifier.
+
+        :param count_in_query: Annotate query fetching changelist page objects with children count
+            (using a correlated subquery) instead of issuing a separate stats query
+            for every page. Counting objects is not affected.
+
+        :param kwargs: Common hierarchy options. See `Hierarchy.__init__()`.
+
+        """
+        super().__init__(**kwargs)
+        self.pid_field = parent_id_field
+        self.pid_field_real = f'{parent_id_field}_id'
+        self.count_in_query = count_in_query
+
+    def hook_change_view(self, model_admin: HierarchicalModelAdmin, view_args: Tuple, view_kwargs: Dict):
+        """Triggered by `ModelAdmin.change_view()`.
+
+        Replaces parent item dropdown list with a lookup dialog.
+
+        """
+        # TODO start from an appropriate tree level when in parent lookup popup
+        pid_field = self.pid_field
+
+        if pid_field not in model_admin.raw_id_fields:
+            model_admin.raw_id_fields = tuple(model_admin.raw_id_fields) + (pid_field,)
+
+    def hook_add_view(self, model_admin: HierarchicalModelAdmin, view_args: Tuple, view_kwargs: Dict):
+        """Triggered by `ModelAdmin.add_view()`.
+
+        Replaces parent item dropdown list with a lookup dialog.
+
+        """
+        self.hook_change_view(model_admin, view_args, view_kwargs)
+
+    def get_parent_field(self) -> Optional[str]:
+        """Returns the name of a foreign key field pointing to a parent."""
+        return self.pid_field
+
+    def hook_get_queryset(self, changelist: 'HierarchicalChangeList', request: HttpRequest):
+        """Triggered by `ChangeList.get_queryset()`."""
+        pid_field = self.pid_field
+
+        changelist.check_field_exists(pid_field)
+
+        pid = self.get_pid_from_request(changelist, request)
+        changelist.hierarchy_context.pid = pid
+
+        if changelist.query:
+            # Do not restrict search to current sub.
+            return
+
+        changelist.params[pid_field] = pid
+
+    def hook_filter_queryset(self, changelist: 'HierarchicalChangeList', query_set: QuerySet) -> QuerySet:
+        """Triggered by `ChangeList.get_queryset()`."""
+
+        if changelist.hierarchy_context.pid is None:
+            changelist.params.pop(self.pid_field, None)
+
+        return query_set
+
+    def hook_get_results_queryset(self, changelist: 'HierarchicalChangeList', query_set: QuerySet) -> QuerySet:
+        """Triggered by `ChangeList.get_results()` to get a query set objects of a page
+        are fetched from (it is not used for counting).
+
+        Annotates children count if `count_in_query` is on.
+
+        """
+        if self.count_in_query:
+            query_set = query_set.annotate(**{self.CHILD_COUNT_ANNOTATION: self.get_child_count_subquery(query_set)})
+
+        return query_set
+
+    def filter_children(self, query_set: QuerySet, node: Any) -> QuerySet:
+        """Returns query set narrowed to immediate children of the given node.
+
+        :param query_set:
+        :param node: Node object or ID. None - root level.
+
+        """
+        pk = node.pk if isinstance(node, Model) else node
+        return query_set.filter(**{self.pid_field: pk})
+
+    def filter_subtree(self, query_set: QuerySet, node: Any) -> QuerySet:
+        """Returns query set narrowed to all descendants of the given node
+        using a recursive CTE.
+
+        :param query_set:
+        :param node: Node object or ID.
+
+        """
+        pk = node.pk if isinstance(node, Model) else node
+        pk = query_set.model._meta.pk.to_python(pk)
+
+        return query_set.filter(pk__in=RawSQL(*self.get_descendants_sql(query_set, pk)))
+
+    def iter_children(self, query_set: QuerySet, pks: List[Any], batch_size: int) -> Iterator[Tuple[Any, Model]]:
+        """Yields (parent ID, object) pairs for immediate children of the given nodes
+        using one IN query.
+
+        :param query_set:
+        :param pks: Nodes IDs.
+        :param batch_size: Number of objects to fetch from DB at once.
+
+        """
+        pid_field_real = self.pid_field_real
+
+        children = query_set.filter(
+            **{f'{self.pid_field}__in': pks}).order_by(pid_field_real, 'pk').iterator(chunk_size=batch_size)
+
+        for obj in children:
+            yield getattr(obj, pid_field_real), obj
+
+    def get_child_count_subquery(self, query_set: QuerySet) -> Coalesce:
+        """Returns an expression counting immediate children of an outer query row.
+
+        :param query_set:
+
+        """
+        return get_count_subquery(query_set.model._default_manager.filter(**{self.pid_field: OuterRef('pk')}))
+
+    def get_parent_id(self, model: Type[Model], instance: Model) -> Optional[Any]:
+        """Returns parent ID of the given node as currently stored in DB.
+
+        :param model:
+        :param instance:
+
+        """
+        if instance.pk is None:
+            return None
+
+        return model._default_manager.filter(pk=instance.pk).values_list(self.pid_field_real, flat=True).first()
+
+    def get_saved_parent_id(self, model: Type[Model], instance: Model) -> Optional[Any]:
+        return getattr(instance, self.pid_field_real)
+
+    def get_position_fields(self) -> Optional[List[str]]:
+        return [self.pid_field]
+
+    def get_children_stats(self, query_set: QuerySet, objs: List[Model]) -> Dict[Any, Tuple[int, Optional[int]]]:
+        """Returns (immediate children, None) counts for the given objects
+        indexed by objects IDs using one grouped query.
+
+        :param query_set: Base query set to count children in.
+        :param objs:
+
+        """
+        pid_field = self.pid_field
+
+        stats_qs = query_set.filter(
+            **{f'{pid_field}__in': objs}).values_list(pid_field).annotate(cnt=models.Count(pid_field))
+
+        stats = {item[0]: item[1] for item in stats_qs}
+
+        return {obj.pk: (stats.get(obj.pk, 0), None) for obj in objs}
+
+    def get_ancestors_sql(self, query_set: QuerySet, pks: List[Any]) -> Tuple[str, Tuple]:
+        """Returns SQL and params for a recursive CTE query selecting IDs
+        of the given nodes and all their ancestors.
+
+        :param query_set:
+        :param pks:
+
+        """
+        opts = query_set.model._meta
+        qn = connections[query_set.db].ops.quote_name
+
+        table = qn(opts.db_table)
+        pk_column = qn(opts.pk.column)
+        pid_column = qn(opts.get_field(self.pid_field).column)
+
+        sql = (
+            f'WITH RECURSIVE admirarchy_ancestors(node_id, parent_id) AS ('
+            f'SELECT {pk_column}, {pid_column} FROM {table} WHERE {pk_column} IN ({", ".join(["%s"] * len(pks))}) '
+            # Common ancestors are visited once.
+            f'UNION '
+            f'SELECT t.{pk_column}, t.{pid_column} FROM {table} t '
+            f'INNER JOIN admirarchy_ancestors a ON t.{pk_column} = a.parent_id'
+            f') SELECT node_id FROM admirarchy_ancestors'
+        )
+
+        return sql, tuple(pks)
+
+    def get_descendants_sql(self, query_set: QuerySet, pk: Any) -> Tuple[str, Tuple]:
+        """Returns SQL and params for a recursive CTE query selecting IDs
+        of all descendants of the given node.
+
+        :param query_set:
+        :param pk:
+
+        """
+        opts = query_set.model._meta
+        qn = connections[query_set.db].ops.quote_name
+
+        table = qn(opts.db_table)
+        pk_column = qn(opts.pk.column)
+        pid_column = qn(opts.get_field(self.pid_field).column)
+
+        sql = (
+            f'WITH RECURSIVE admirarchy_descendants(node_id) AS ('
+            f'SELECT {pk_column} FROM {table} WHERE {pid_column} = %s '
+            f'UNION '
+            f'SELECT t.{pk_column} FROM {table} t '
+            f'INNER JOIN admirarchy_descendants d ON t.{pid_column} = d.node_id'
+            f') SELECT node_id FROM admirarchy_descendants'
+        )
+
+        return sql, (pk,)
+
+    def get_move_roots(self, query_set: QuerySet, pks: List[Any], target: Optional[Model]) -> List[Model]:
+        """Returns nodes to be moved skipping those having an ancestor among them.
+
+        Ancestors of the nodes and the target are walked with one recursive CTE query
+        both to detect cycles and to find nested nodes.
+
+        :param query_set:
+        :param pks: IDs of selected nodes.
+        :param target: New parent. None - root level.
+
+        :raises ValidationError: If the target is one of the nodes or their descendant.
+
+        """
+        if not pks:
+            return []
+
+        target_pk = getattr(target, 'pk', None)
+
+        if target_pk in pks:
+            raise self.get_move_cycle_error()
+
+        opts = query_set.model._meta
+        qn = connections[query_set.db].ops.quote_name
+
+        table = qn(opts.db_table)
+        pk_column = qn(opts.pk.column)
+        pid_column = qn(opts.get_field(self.pid_field).column)
+
+        origins = pks if target_pk is None else pks + [target_pk]
+        origins_placeholders = ', '.join(['%s'] * len(origins))
+
+        sql = (
+            f'WITH RECURSIVE admirarchy_move(origin_id, node_id, parent_id) AS ('
+            f'SELECT {pk_column}, {pk_column}, {pid_column} FROM {table} WHERE {pk_column} IN ({origins_placeholders}) '
+            f'UNION '
+            f'SELECT m.origin_id, t.{pk_column}, t.{pid_column} FROM {table} t '
+            f'INNER JOIN admirarchy_move m ON t.{pk_column} = m.parent_id'
+            f') SELECT origin_id FROM admirarchy_move '
+            f'WHERE origin_id <> node_id AND node_id IN ({", ".join(["%s"] * len(pks))})'
+        )
+
+        with connections[query_set.db].cursor() as cursor:
+            cursor.execute(sql, origins + pks)
+            nested = {row[0] for row in cursor.fetchall()}
+
+        if target_pk in nested:
+            raise self.get_move_cycle_error()
+
+        return list(query_set.filter(pk__in=[pk for pk in pks if pk not in nested]).order_by('pk'))
+
+    def move_nodes(self, query_set: QuerySet, nodes: List[Model], target: Optional[Model]):
+        """Moves the given nodes (with their subtrees) under the target node
+        with one update.
+
+        :param query_set:
+        :param nodes: Nodes to move. None of them is an ancestor of another.
+        :param target: New parent. None - root level.
+
+        """
+        query_set.filter(pk__in=[node.pk for node in nodes]).update(**{self.pid_field: target})
+
+    def get_subtrees_sql(self, query_set: QuerySet, pks: List[Any]) -> Tuple[str, Tuple]:
+        """Returns SQL and params for a recursive CTE query selecting
+        (origin_id, node_id) pairs for all nodes of subtrees
+        of the given nodes (the nodes themselves included).
+
+        :param query_set:
+        :param pks: Subtree roots IDs.
+
+        """
+        opts = query_set.model._meta
+        qn = connections[query_set.db].ops.quote_name
+
+        table = qn(opts.db_table)
+        pk_column = qn(opts.pk.column)
+        pid_column = qn(opts.get_field(self.pid_field).column)
+
+        sql = (
+            f'WITH RECURSIVE admirarchy_subtrees(origin_id, node_id) AS ('
+            f'SELECT {pk_column}, {pk_column} FROM {table} WHERE {pk_column} IN ({", ".join(["%s"] * len(pks))}) '
+            f'UNION '
+            f'SELECT s.origin_id, t.{pk_column} FROM {table} t '
+            f'INNER JOIN admirarchy_subtrees s ON t.{pid_column} = s.node_id'
+            f') SELECT origin_id, node_id FROM admirarchy_subtrees'
+        )
+
+        return sql, tuple(pks)
+
+    def get_subtrees_levels(self, query_set: QuerySet, nodes: List[Model]) -> List[List[Any]]:
+        """Returns IDs of all nodes of subtrees of the given nodes (the nodes themselves included)
+        grouped by levels, the deepest level first. Issues one IN query per level
+        (per batch of `delete_batch_size` parents).
+
+        :param query_set:
+        :param nodes: None of them is an ancestor of another.
+
+        """
+        batch_size = self.delete_batch_size
+        seen = {node.pk for node in nodes}
+        level = list(seen)
+        levels = []
+
+        while level:
+            levels.append(level)
+            next_level = []
+
+            for idx in range(0, len(level), batch_size):
+                children = query_set.filter(
+                    **{f'{self.pid_field}__in': level[idx:idx + batch_size]}).values_list('pk', flat=True)
+
+                for pk in children:
+
+                    if pk not in seen:  # Guard against cycles.
+                        seen.add(pk)
+                        next_level.append(pk)
+
+            level = next_level
+
+        return levels[::-1]
+
+    def delete_subtrees_raw(self, query_set: QuerySet, nodes: List[Model]) -> int:
+        """Deletes the given nodes along with their descendants with one statement
+        selecting descendants by a recursive CTE.
+
+        :param query_set:
+        :param nodes: None of them is an ancestor of another.
+
+        """
+        sql, params = self.get_subtrees_sql(query_set, [node.pk for node in nodes])
+
+        return self.delete_queryset(query_set.filter(pk__in=RawSQL(f'SELECT node_id FROM ({sql}) s', params)))
+
+    def get_tree_sql(
+            self,
+            query_set: QuerySet,
+            pk: Any,
+            depth: int,
+            limit: Optional[int] = None
+    ) -> Tuple[str, Tuple]:
+        """Returns SQL and params for a depth-limited recursive CTE query
+        selecting (ID, depth) of descendants of the given node in tree order.
+
+        :param query_set:
+        :param pk: Node ID. None - root level.
+        :param depth: Maximum depth of descendants.
+        :param limit: Maximum number of rows. None - no limit.
+
+        """
+        opts = query_set.model._meta
+        qn = connections[query_set.db].ops.quote_name
+
+        table = qn(opts.db_table)
+        pk_column = qn(opts.pk.column)
+        pid_column = qn(opts.get_field(self.pid_field).column)
+
+        if pk is None:
+            seed = f'SELECT {pk_column} FROM {table} WHERE {pid_column} IS NULL', ()
+
+        else:
+            seed = f'SELECT {pk_column} FROM {table} WHERE {pid_column} = %s', (pk,)
+
+        return get_tree_sql(table, pk_column, pid_column, seed, depth, limit=limit)
+
+    def fetch_tree(
+            self,
+            query_set: QuerySet,
+            node: Any,
+            depth: int,
+            limit: Optional[int] = None
+    ) -> List[Tuple[Model, int]]:
+        """Fetches descendants of the given node down to the given depth
+        using one depth-limited recursive CTE query (limit is applied by DB)
+        and a query for objects.
+
+        :param query_set: Base query set to get objects from.
+        :param node: Node object or ID. None - root level.
+        :param depth: Maximum depth of descendants.
+        :param limit: Maximum number of objects (first in tree order). None - no limit.
+
+        """
+        pk = node.pk if isinstance(node, Model) else node
+
+        if pk is not None:
+            pk = query_set.model._meta.pk.to_python(pk)
+
+        return fetch_tree_rows(query_set, *self.get_tree_sql(query_set, pk, depth, limit), pk)
+
+    def fetch_path(self, query_set: QuerySet, node: Any) -> List[Model]:
+        """Fetches objects from the root down to the given node (inclusive)
+        using one recursive CTE query.
+
+        :param query_set: Base query set to get objects from.
+        :param node: Node object or ID.
+
+        """
+        pk = node.pk if isinstance(node, Model) else node
+        pk = query_set.model._meta.pk.to_python(pk)
+
+        objects = {
+            obj.pk: obj for obj in
+            query_set.filter(pk__in=RawSQL(*self.get_ancestors_sql(query_set, [pk])))
+        }
+
+        return self.walk_path(objects, objects.get(pk))
+
+    def fetch_paths(self, query_set: QuerySet, objs: List[Model]) -> Dict[Any, List[Model]]:
+        """Fetches objects from the root down to every given object (inclusive)
+        indexed by objects IDs using one recursive CTE query.
+
+        :param query_set: Base query set to get objects from.
+        :param objs:
+
+        """
+        pid_field_real = self.pid_field_real
+        parent_ids = {getattr(obj, pid_field_real) for obj in objs} - {None}
+
+        objects = {}
+
+        if parent_ids:
+            objects = {
+                obj.pk: obj for obj in
+                query_set.filter(pk__in=RawSQL(*self.get_ancestors_sql(query_set, list(parent_ids))))
+            }
+
+        objects.update((obj.pk, obj) for obj in objs)
+
+        return {obj.pk: self.walk_path(objects, obj) for obj in objs}
+
+    def walk_path(self, objects: Dict[Any, Model], obj: Optional[Model]) -> List[Model]:
+        """Returns objects from the root down to the given object (inclusive)
+        following parent IDs.
+
+        :param objects: Ancestors indexed by IDs.
+        :param obj:
+
+        """
+        path = []
+        pid_field_real = self.pid_field_real
+
+        while obj is not None and len(path) < len(objects):  # Guard against cycles.
+            path.append(obj)
+            obj = objects.get(getattr(obj, pid_field_real))
+
+        path.reverse()
+
+        return path
+
+
+class NestedSet(Hierarchy):
+
+    movable = True
+    deletable = True
+
+    def __init__(
+            self,
+            left_field: str = 'lft',
+            right_field: str = 'rgt',
+            level_field: str = 'level',
+            root_level: int = 0,
+            tree_id_field: Optional[str] = None,
+            parent_field: Optional[str] = None,
+            manage_numbering: bool = False,
+            spread: int = 0,
+            **kwargs
+    ):
+        """
+        :param left_field: Name of a field containing left set limit.
+        :param right_field: Name of a field containing right set limit.
+        :param level_field: Name of a field containing nesting level.
+        :param root_level: Nesting level of root items.
+
+        :param tree_id_field: Name of a field containing tree identifier
+            for tables holding many trees each numbered independently (like in `django-mptt`).
+
+        :param parent_field: Name of a foreign key field pointing to a parent (if any)
+            to keep in sync on moves and to pick a parent for new objects from.
+
+        :param manage_numbering: Number objects added from admin and move objects
+            with a changed parent field (see `hook_save_model()`). Leave it off if numbering
+            is kept by other means (e.g. `django-mptt`, `django-treebeard` or model `save()`).
+
+        :param spread: Range width reserved for new objects added from admin (see `manage_numbering`).
+            0 - contiguous numbering: every insert shifts numbers of the following nodes.
+            Otherwise numbering has gaps, so that most inserts only write the new row;
+            when a gap runs out the nearest ancestor subtree having enough room is re-spread.
+            Descendants counts are not derived from ranges in this mode.
+
+        :param kwargs: Common hierarchy options. See `Hierarchy.__init__()`.
+
+        """
+        super().__init__(**kwargs)
+        self.left_field = left_field
+        self.right_field = right_field
+        self.level_field = level_field
+        self.root_level = root_level
+        self.tree_id_field = tree_id_field
+        self.parent_field = parent_field
+        self.manage_numbering = manage_numbering
+        self.spread = spread
+
+    def get_range_clause(self, obj: Model) -> Tuple[int, int]:
+        return getattr(obj, self.left_field), getattr(obj, self.right_field)
+
+    def get_tree_filter(self, obj: Model) -> Dict:
+        """Returns a filter scoping lookups to the tree of the given object.
+
+        :param obj:
+
+        """
+        tree_id_field = self.tree_id_field
+
+        if not tree_id_field:
+            return {}
+
+        return {tree_id_field: getattr(obj, tree_id_field)}
+
+    def get_immediate_children_filter(self, obj: Model) -> Dict:
+        flt = {
+            **self.get_tree_filter(obj),
+            f'{self.left_field}__range': self.get_range_clause(obj),
+            self.level_field: getattr(obj, self.level_field) + 1
+        }
+        return flt
+
+    def get_keyset_ordering(self) -> List[str]:
+        """Returns fields to order objects by for keyset pagination.
+        Objects are ordered as they are in a tree.
+
+        """
+        if self.tree_id_field:
+            return [self.tree_id_field, self.left_field]
+
+        return [self.left_field]
+
+    def get_position_fields(self) -> Optional[List[str]]:
+        fields = [self.left_field, self.right_field, self.level_field, self.tree_id_field, self.parent_field]
+        return [field for field in fields if field]
+
+    def filter_children(self, query_set: QuerySet, node: Any) -> QuerySet:
+        """Returns query set narrowed to immediate children of the given node.
+
+        :param query_set:
+        :param node: Node object or ID. None - root level.
+
+        """
+        if node is None:
+            # Root level may contain many roots (one for every tree).
+            return query_set.filter(**{self.level_field: self.root_level})
+
+        if not isinstance(node, Model):
+            node = query_set.model._default_manager.db_manager(query_set.db).get(pk=node)
+
+        return query_set.filter(**self.get_immediate_children_filter(node))
+
+    def filter_subtree(self, query_set: QuerySet, node: Any) -> QuerySet:
+        """Returns query set narrowed to all descendants of the given node
+        using range predicates.
+
+        :param query_set:
+        :param node: Node object or ID.
+
+        """
+        if not isinstance(node, Model):
+            node = query_set.model._default_manager.db_manager(query_set.db).get(pk=node)
+
+        left_value, right_value = self.get_range_clause(node)
+
+        return query_set.filter(**{
+            **self.get_tree_filter(node),
+            f'{self.left_field}__gt': left_value,
+            f'{self.right_field}__lt': right_value,
+        })
+
+    def iter_subtree(
+            self,
+            query_set: QuerySet,
+            node: Optional[Model],
+            batch_size: int = 1000
+    ) -> Iterator[Tuple[Model, int, str]]:
+        """Yields (object, depth, path) for the given node and all its descendants.
+        Depth is relative to the node, path is made of objects titles starting from the node.
+
+        Uses one range scan in tree order, only ancestors of the current object are kept in memory.
+
+        :param query_set: Base query set to get objects from.
+        :param node: Node object. None - all the trees.
+        :param batch_size: Number of objects to fetch from DB at once.
+
+        """
+        left = self.left_field
+        right = self.right_field
+        sep = self.PATH_SEPARATOR
+
+        if node is not None:
+            left_value, right_value = self.get_range_clause(node)
+            query_set = query_set.filter(**{
+                **self.get_tree_filter(node),
+                f'{left}__gte': left_value,
+                f'{right}__lte': right_value,
+            })
+
+        stack = []  # (right, path) pairs of the current object ancestors.
+        tree = None
+
+        for obj in query_set.order_by(*self.get_keyset_ordering()).iterator(chunk_size=batch_size):
+            obj_tree = self.get_tree_filter(obj)
+
+            if obj_tree != tree:
+                stack.clear()
+                tree = obj_tree
+
+            obj_left = getattr(obj, left)
+
+            while stack and stack[-1][0] < obj_left:
+                stack.pop()
+
+            obj_path = f'{stack[-1][1]}{sep}{obj}' if stack else str(obj)
+
+            yield obj, len(stack), obj_path
+
+            stack.append((getattr(obj, right), obj_path))
+
+    def fetch_tree(
+            self,
+            query_set: QuerySet,
+            node: Any,
+            depth: int,
+            limit: Optional[int] = None
+    ) -> List[Tuple[Model, int]]:
+        """Fetches descendants of the given node down to the given depth
+        using one range query capped by level.
+
+        :param query_set: Base query set to get objects from.
+        :param node: Node object or ID. None - root level.
+        :param depth: Maximum depth of descendants.
+        :param limit: Maximum number of objects (first in tree order). None - no limit.
+
+        """
+        level_field = self.level_field
+
+        if node is None:
+            base_level = self.root_level - 1
+            query_set = query_set.filter(**{f'{level_field}__lte': base_level + depth})
+
+        else:
+            if not isinstance(node, Model):
+                node = query_set.model._default_manager.db_manager(query_set.db).get(pk=node)
+
+            base_level = getattr(node, level_field)
+            query_set = self.filter_subtree(query_set, node).filter(**{f'{level_field}__lte': base_level + depth})
+
+        query_set = query_set.order_by(*self.get_keyset_ordering())
+
+        if limit is not None:
+            query_set = query_set[:limit]
+
+        return [(obj, getattr(obj, level_field) - base_level) for obj in query_set]
+
+    def get_parent_field(self) -> Optional[str]:
+        """Returns the name of a foreign key field pointing to a parent (if any)."""
+        return self.parent_field
+
+    def hook_get_readonly_fields(
+            self,
+            model_admin: HierarchicalModelAdmin,
+            obj: Optional[Model],
+            readonly_fields: Union[List[str], Tuple[str, ...]]
+    ) -> Union[List[str], Tuple[str, ...]]:
+        """Triggered by `ModelAdmin.get_readonly_fields()`.
+
+        Numbering of new objects is computed automatically if `manage_numbering` is on.
+
+        """
+        if obj is not None or not self.manage_numbering:
+            return readonly_fields
+
+        missing = tuple(
+            field for field in (self.left_field, self.right_field, self.level_field, self.tree_id_field)
+            if field and field not in readonly_fields
+        )
+
+        return tuple(readonly_fields) + missing
+
+    def hook_get_form(
+            self,
+            model_admin: HierarchicalModelAdmin,
+            request: HttpRequest,
+            obj: Optional[Model],
+            form: Type[forms.ModelForm]
+    ) -> Type[forms.ModelForm]:
+        """Triggered by `ModelAdmin.get_form()`.
+
+        Validates that the level a new object is added from exists
+        if `manage_numbering` is on and there is no parent field
+        (parent field is validated by the form itself).
+
+        """
+        if obj is not None or not self.manage_numbering or self.parent_field:
+            return form
+
+        pid = self.get_pid_from_changeform_request(request)
+
+        if pid is None:
+            return form
+
+        query_set = model_admin.model._default_manager.all()
+
+        class NestedSetForm(form):
+
+            def clean(self):
+                cleaned_data = super().clean()
+
+                try:
+                    exists = query_set.filter(pk=pid).exists()
+
+                except (ValueError, TypeError, ValidationError):
+                    exists = False
+
+                if not exists:
+                    raise ValidationError(_('Parent object does not exist.'), code='parent')
+
+                return cleaned_data
+
+        return NestedSetForm
+
+    def hook_save_model(self, model_admin: HierarchicalModelAdmin, request: HttpRequest, obj: Model, change: bool):
+        """Triggered by `ModelAdmin.save_model()` before an object is saved.
+
+        If `manage_numbering` is on, numbers a new object as the last child of a parent taken
+        from parent field (if any) or from the level it is added from
+        (validated by the form, see `hook_get_form()`).
+
+        A changed parent field of an existing object moves it
+        with its subtree (see `move()`).
+
+        """
+        if not self.manage_numbering:
+            return
+
+        model = model_admin.model
+        parent_field = self.parent_field
+        query_set = model._default_manager.db_manager(router.db_for_write(model)).all()
+
+        if change:
+            if parent_field:
+                self.move_changed(request, query_set, obj)
+            return
+
+        if parent_field:
+            pid = getattr(obj, model._meta.get_field(parent_field).attname)
+
+        else:
+            pid = self.get_pid_from_changeform_request(request)
+
+        self.insert(query_set, obj, pid)
+
+    def move_changed(self, request: HttpRequest, query_set: QuerySet, obj: Model):
+        """Moves an existing object (not yet saved) with its subtree if its parent field
+        was changed, and updates its numbering to be saved.
+
+        If the new parent is within the object subtree, the parent is left intact
+        and an error message is shown.
+
+        :param request:
+        :param query_set:
+        :param obj:
+
+        """
+        parent_attname = query_set.model._meta.get_field(self.parent_field).attname
+        pid = getattr(obj, parent_attname)
+        pid_old = query_set.filter(pk=obj.pk).values_list(parent_attname, flat=True).first()
+
+        if pid == pid_old:
+            return
+
+        try:
+            self.move(query_set.filter(pk=obj.pk), None if pid is None else query_set.get(pk=pid))
+
+        except ValidationError as e:
+            setattr(obj, parent_attname, pid_old)
+            messages.error(request, ' '.join(e.messages))
+            return
+
+        fields = [self.left_field, self.right_field, self.level_field, self.tree_id_field]
+        fields = [field for field in fields if field]
+
+        for field, value in query_set.filter(pk=obj.pk).values(*fields).get().items():
+            setattr(obj, field, value)
+
+    def insert(self, query_set: QuerySet, obj: Model, parent: Any):
+        """Sets numbering of a new (not yet saved) object, so that it becomes
+        the last child of the given parent, making room for it if necessary.
+        Should be called within a transaction.
+
+        :param query_set:
+        :param obj:
+        :param parent: Parent object or ID. None - root level.
+
+        """
+        left, right, level = self.left_field, self.right_field, self.level_field
+        tree_id_field = self.tree_id_field
+        width = max(self.spread, 1)
+
+        if parent is None:
+
+            if tree_id_field:
+                setattr(obj, tree_id_field, self.get_locked_max(query_set, tree_id_field) + 1)
+                left_value = 1
+
+            else:
+                left_value = self.get_locked_max(query_set, right) + 1
+
+            setattr(obj, left, left_value)
+            setattr(obj, right, left_value + width)
+            setattr(obj, level, self.root_level)
+
+            return
+
+        pk = parent.pk if isinstance(parent, Model) else parent
+
+        # Lock parent to serialize inserts into the same folder.
+        parent = query_set.select_for_update().get(pk=pk)
+        tree_qs = query_set.filter(**self.get_tree_filter(parent))
+
+        if tree_id_field:
+            setattr(obj, tree_id_field, getattr(parent, tree_id_field))
+
+        setattr(obj, level, getattr(parent, level) + 1)
+
+        if not self.spread:
+            position = getattr(parent, right)
+            self.shift_ranges(tree_qs, [((position, None), 2)])
+
+            setattr(obj, left, position)
+            setattr(obj, right, position + 1)
+
+            return
+
+        lower = self.get_last_child_right(tree_qs, parent)
+        room = getattr(parent, right) - lower - 1
+
+        if room < 2:
+            parent = self.spread_subtree(tree_qs, parent)
+            lower = self.get_last_child_right(tree_qs, parent)
+            room = getattr(parent, right) - lower - 1
+
+        setattr(obj, left, lower + 1)
+        setattr(obj, right, lower + 1 + max(1, min(width, room // 2)))
+
+    @staticmethod
+    def get_locked_max(query_set: QuerySet, field: str) -> int:
+        """Returns the maximum value of the given field (0 if no rows)
+        locking a row holding it, so that concurrent root inserts are serialized.
+        Should be called within a transaction.
+
+        :param query_set:
+        :param field:
+
+        """
+        locked_qs = query_set.select_for_update().order_by(f'-{field}').values_list(field, flat=True)
+        value = None
+
+        while True:
+            # A lock waited for may be released by a transaction having inserted
+            # a greater value, so the value is read again until it is stable.
+            locked = locked_qs.first()
+
+            if locked == value:
+                return value or 0
+
+            value = locked
+
+    def get_last_child_right(self, query_set: QuerySet, parent: Model) -> int:
+        """Returns the right value of the last immediate child of the given node,
+        or the node left value if it has no children.
+
+        :param query_set:
+        :param parent:
+
+        """
+        right = self.right_field
+
+        last = query_set.filter(**self.get_immediate_children_filter(parent)).aggregate(models.Max(right))
+
+        return last[f'{right}__max'] or getattr(parent, self.left_field)
+
+    def spread_subtree(self, query_set: QuerySet, node: Model) -> Model:
+        """Renumbers descendants of the nearest ancestor (or the node itself) having enough room,
+        so that numbers are evenly spread leaving gaps of `spread` size. Widens the root if none has.
+        Returns the node with fresh numbering.
+
+        :param query_set: Query set narrowed to the tree of the node.
+        :param node:
+
+        """
+        left, right = self.left_field, self.right_field
+
+        ancestors = self.fetch_path(query_set, node)
+
+        counts = query_set.aggregate(**{
+            f'cnt_{idx}': models.Count('pk', filter=Q(**{
+                f'{left}__gt': getattr(ancestor, left),
+                f'{left}__lt': getattr(ancestor, right),
+            }))
+            for idx, ancestor in enumerate(ancestors)
+        })
+
+        def get_step(idx: int) -> int:
+            # Room for one more node is reserved.
+            ancestor = ancestors[idx]
+            return (getattr(ancestor, right) - getattr(ancestor, left)) // (2 * counts[f'cnt_{idx}'] + 3)
+
+        min_step = max(self.spread, 3)
+
+        for idx in reversed(range(len(ancestors))):
+            if get_step(idx) >= min_step:
+                break
+
+        else:
+            # Not enough room even in the root: widen it at least twice.
+            idx = 0
+            root = ancestors[0]
+            root_left, root_right = self.get_range_clause(root)
+            grow = max(root_right - root_left, min_step * (2 * counts['cnt_0'] + 3) - (root_right - root_left))
+
+            self.shift_ranges(query_set, [((root_right, None), grow)])
+            setattr(root, right, root_right + grow)
+
+        ancestor = ancestors[idx]
+        step = get_step(idx)
+        ancestor_left = getattr(ancestor, left)
+
+        descendants = list(query_set.filter(**{
+            f'{left}__gt': ancestor_left,
+            f'{left}__lt': getattr(ancestor, right),
+        }).only('pk', left, right))
+
+        values = sorted(value for obj in descendants for value in self.get_range_clause(obj))
+        numbers = {value: ancestor_left + step * (position + 1) for position, value in enumerate(values)}
+
+        for obj in descendants:
+            setattr(obj, left, numbers[getattr(obj, left)])
+            setattr(obj, right, numbers[getattr(obj, right)])
+
+        query_set.model._default_manager.db_manager(query_set.db).bulk_update(
+            descendants, [left, right], batch_size=1000)
+
+        if node.pk == ancestor.pk:
+            return ancestor
+
+        return next(obj for obj in descendants if obj.pk == node.pk)
+
+    def get_move_roots(self, query_set: QuerySet, pks: List[Any], target: Optional[Model]) -> List[Model]:
+        """Returns nodes to be moved skipping those having an ancestor among them.
+
+        Nodes are fetched with one query, cycles and nesting are detected by ranges.
+
+        :param query_set:
+        :param pks: IDs of selected nodes.
+        :param target: New parent. None - root level.
+
+        :raises ValidationError: If the target is one of the nodes or their descendant.
+
+        """
+        roots = []
+        right = None
+        tree = None
+
+        for node in query_set.filter(pk__in=pks).order_by(*self.get_keyset_ordering()):
+            node_tree = self.get_tree_filter(node)
+            node_left, node_right = self.get_range_clause(node)
+
+            if node_tree == tree and node_left < right:
+                continue  # Nested into previous one.
+
+            if (
+                target is not None
+                and self.get_tree_filter(target) == node_tree
+                and node_left <= getattr(target, self.left_field) <= node_right
+            ):
+                raise self.get_move_cycle_error()
+
+            roots.append(node)
+            tree, right = node_tree, node_right
+
+        return roots
+
+    def move_nodes(self, query_set: QuerySet, nodes: List[Model], target: Optional[Model]):
+        """Moves the given nodes (with their subtrees) under the target node.
+
+        Shifts of all subtrees and nodes in between are computed up front, so that every tree
+        involved is renumbered with one set-based update (one per source tree when moved
+        from other trees or to the root level with `tree_id_field`).
+
+        :param query_set:
+        :param nodes: Nodes to move. None of them is an ancestor of another.
+        :param target: New parent. None - root level.
+
+        """
+        left, right, level = self.left_field, self.right_field, self.level_field
+        tree_id_field = self.tree_id_field
+        parent_field = self.parent_field
+
+        if parent_field:
+            query_set.filter(pk__in=[node.pk for node in nodes]).update(**{parent_field: target})
+
+        trees = defaultdict(list)
+
+        for node in nodes:
+
+            if target is None and tree_id_field and getattr(node, level) == self.root_level:
+                continue  # Already a separate tree.
+
+            trees[getattr(node, tree_id_field) if tree_id_field else None].append(node)
+
+        if target is None:
+            target_level = self.root_level - 1
+
+            if tree_id_field:
+                # Every subtree becomes a separate tree.
+                next_tree = (query_set.aggregate(models.Max(tree_id_field))[f'{tree_id_field}__max'] or 0) + 1
+
+                for tree_id, tree_nodes in trees.items():
+                    shifts, level_shifts, tree_shifts = [], [], []
+
+                    for node in sorted(tree_nodes, key=self.get_range_clause):
+                        bounds = self.get_range_clause(node)
+                        shifts.append((bounds, 1 - bounds[0]))
+                        level_shifts.append((bounds, target_level + 1 - getattr(node, level)))
+                        tree_shifts.append((bounds, next_tree))
+                        next_tree += 1
+
+                    self.shift_ranges(
+                        query_set.filter(**{tree_id_field: tree_id}),
+                        shifts + self.get_gap_shifts([bounds for bounds, _ in shifts]),
+                        level_shifts=level_shifts,
+                        tree_shifts=tree_shifts,
+                    )
+
+                return
+
+            target_tree = None
+            position = (query_set.aggregate(models.Max(right))[f'{right}__max'] or 0) + 1
+
+        else:
+            target_level = getattr(target, level)
+            target_tree = getattr(target, tree_id_field) if tree_id_field else None
+            position = getattr(target, right)
+
+        def get_width(node: Model) -> int:
+            node_left, node_right = self.get_range_clause(node)
+            return node_right - node_left + 1
+
+        # Subtrees from the target tree go first (keeping their order), then those from other trees.
+        local = sorted(trees.pop(target_tree, []), key=self.get_range_clause)
+        ranges = [self.get_range_clause(node) for node in local]
+
+        others = [node for tree_nodes in trees.values() for node in tree_nodes]
+
+        if not local and not others:
+            return
+
+        width = sum(get_width(node) for node in local + others)
+
+        # Position of the target right value once moved subtrees are taken out of the target tree.
+        offset = position - sum(get_width(node) for node in local if getattr(node, right) < position)
+
+        def get_move_shifts(tree_nodes: List[Model]):
+            nonlocal offset
+
+            shifts, level_shifts = [], []
+
+            for node in tree_nodes:
+                bounds = self.get_range_clause(node)
+                shifts.append((bounds, offset - bounds[0]))
+                level_shifts.append((bounds, target_level + 1 - getattr(node, level)))
+                offset += get_width(node)
+
+            return shifts, level_shifts
+
+        shifts, level_shifts = get_move_shifts(local)
+
+        self.shift_ranges(
+            query_set.filter(**{tree_id_field: target_tree}) if tree_id_field else query_set,
+            shifts + self.get_gap_shifts(ranges, insert=(position, width)),
+            level_shifts=level_shifts,
+        )
+
+        for tree_id, tree_nodes in trees.items():
+            shifts, level_shifts = get_move_shifts(sorted(tree_nodes, key=self.get_range_clause))
+
+            self.shift_ranges(
+                query_set.filter(**{tree_id_field: tree_id}),
+                shifts + self.get_gap_shifts([bounds for bounds, _ in shifts]),
+                level_shifts=level_shifts,
+                tree_shifts=[(bounds, target_tree) for bounds, _ in shifts],
+            )
+
+    @staticmethod
+    def get_gap_shifts(
+            ranges: List[Tuple[int, int]],
+            insert: Optional[Tuple[int, int]] = None
+    ) -> List[Tuple[Tuple[int, Optional[int]], int]]:
+        """Returns shifts (see `shift_ranges()`) for values outside the given ranges
+        closing the gaps left by ranges taken out of a tree (and opening a new one if requested).
+
+        :param ranges: (left, right) ranges taken out sorted by left values.
+        :param insert: (position, width) of a gap to open. Values from position on are shifted.
+
+        """
+        position, insert_width = insert or (None, 0)
+
+        shifts = []
+
+        def add_shift(lower: Optional[int], upper: Optional[int], delta: int):
+            if delta and (upper is None or lower <= upper):
+                shifts.append(((lower, upper), delta))
+
+        removed, lower = 0, None
+
+        for range_left, range_right in [*ranges, (None, None)]:
+            upper = None if range_left is None else range_left - 1
+
+            if (
+                position is not None
+                and (lower is None or lower < position)
+                and (upper is None or position <= upper)
+            ):
+                # Split the span holding the insert position.
+                add_shift(lower, position - 1, -removed)
+                lower = position
+
+            inserted = position is not None and lower is not None and lower >= position
+            add_shift(lower, upper, (insert_width if inserted else 0) - removed)
+
+            if range_right is not None:
+                removed += range_right - range_left + 1
+                lower = range_right + 1
+
+        return shifts
+
+    def shift_ranges(
+            self,
+            query_set: QuerySet,
+            shifts: List[Tuple[Tuple[int, Optional[int]], int]],
+            level_shifts: Optional[List[Tuple[Tuple[int, int], int]]] = None,
+            tree_shifts: Optional[List[Tuple[Tuple[int, int], Any]]] = None
+    ):
+        """Shifts left and right values falling into the given ranges
+        with one UPDATE ... CASE statement.
+
+        :param query_set:
+        :param shifts: ((from, to), delta) items. None for `to` - no upper limit.
+        :param level_shifts: ((from, to), delta) items to shift levels of nodes with left value in range.
+        :param tree_shifts: ((from, to), tree ID) items to move nodes with left value in range to another tree.
+
+        """
+        left, right, level = self.left_field, self.right_field, self.level_field
+
+        def get_lookup(field: str, bounds: Tuple[int, Optional[int]]) -> Dict:
+            lower, upper = bounds
+
+            if upper is None:
+                return {f'{field}__gte': lower}
+
+            return {f'{field}__range': bounds}
+
+        def get_case(field: str, items: List[Tuple[Tuple[int, Optional[int]], int]]) -> Case:
+            return Case(
+                *[When(**get_lookup(field, bounds), then=F(field) + delta) for bounds, delta in items],
+                default=F(field)
+            )
+
+        span = Q()
+
+        for bounds, delta in shifts:
+            span |= Q(**get_lookup(left, bounds)) | Q(**get_lookup(right, bounds))
+
+        values = {}
+
+        # Go first since some backends (MySQL) see already updated values in subsequent expressions.
+        level_shifts = [(bounds, delta) for bounds, delta in level_shifts or [] if delta]
+
+        if level_shifts:
+            values[level] = Case(
+                *[When(**get_lookup(left, bounds), then=F(level) + delta) for bounds, delta in level_shifts],
+                default=F(level)
+            )
+
+        if tree_shifts:
+            tree_id_field = self.tree_id_field
+            output_field = query_set.model._meta.get_field(tree_id_field)
+            values[tree_id_field] = Case(
+                *[
+                    When(**get_lookup(left, bounds), then=models.Value(tree_id, output_field=output_field))
+                    for bounds, tree_id in tree_shifts
+                ],
+                default=F(tree_id_field)
+            )
+
+        values[left] = get_case(left, shifts)
+        values[right] = get_case(right, shifts)
+
+        query_set.filter(span).update(**values)
+
+    def get_subtrees_sql(self, query_set: QuerySet, pks: List[Any]) -> Tuple[str, Tuple]:
+        """Returns SQL and params for a query selecting (origin_id, node_id) pairs
+        for all nodes of subtrees of the given nodes (the nodes themselves included)
+        joining nodes on ranges containment.
+
+        :param query_set:
+        :param pks: Subtree roots IDs.
+
+        """
+        opts = query_set.model._meta
+        qn = connections[query_set.db].ops.quote_name
+
+        table = qn(opts.db_table)
+        pk_column = qn(opts.pk.column)
+        left_column = qn(opts.get_field(self.left_field).column)
+        right_column = qn(opts.get_field(self.right_field).column)
+
+        tree_clause = ''
+        tree_id_field = self.tree_id_field
+
+        if tree_id_field:
+            tree_column = qn(opts.get_field(tree_id_field).column)
+            tree_clause = f'n.{tree_column} = p.{tree_column} AND '
+
+        sql = (
+            f'SELECT p.{pk_column} AS origin_id, n.{pk_column} AS node_id FROM {table} p '
+            f'INNER JOIN {table} n ON {tree_clause}n.{left_column} BETWEEN p.{left_column} AND p.{right_column} '
+            f'WHERE p.{pk_column} IN ({", ".join(["%s"] * len(pks))})'
+        )
+
+        return sql, tuple(pks)
+
+    def get_subtree_filter(self, node: Model) -> Q:
+        """Returns a filter for the given node and all its descendants.
+
+        :param node:
+
+        """
+        left_value, right_value = self.get_range_clause(node)
+
+        return Q(**{
+            **self.get_tree_filter(node),
+            f'{self.left_field}__gte': left_value,
+            f'{self.right_field}__lte': right_value,
+        })
+
+    def get_subtree_sizes(self, query_set: QuerySet, nodes: List[Model]) -> Dict[Any, int]:
+        """Returns descendants counts of the given nodes indexed by nodes IDs.
+
+        Counts are computed from ranges, unless numbering is spread,
+        in which case one grouped query is issued.
+
+        :param query_set:
+        :param nodes: None of them is an ancestor of another.
+
+        """
+        if not self.spread:
+            return {node.pk: self.get_descendant_count(node) for node in nodes}
+
+        return super().get_subtree_sizes(query_set, nodes)
+
+    def get_subtrees_levels(self, query_set: QuerySet, nodes: List[Model]) -> List[List[Any]]:
+        """Returns IDs of all nodes of subtrees of the given nodes (the nodes themselves included)
+        grouped by levels, the deepest level first, using one query by ranges.
+
+        :param query_set:
+        :param nodes: None of them is an ancestor of another.
+
+        """
+        span = Q()
+
+        for node in nodes:
+            span |= self.get_subtree_filter(node)
+
+        levels = defaultdict(list)
+
+        for pk, level in query_set.filter(span).values_list('pk', self.level_field).iterator():
+            levels[level].append(pk)
+
+        return [levels[level] for level in sorted(levels, reverse=True)]
+
+    def delete_subtrees(
+            self,
+            query_set: QuerySet,
+            nodes: List[Model],
+            on_delete: Optional[Callable[[List[Model]], Any]] = None
+    ) -> int:
+        """Deletes the given nodes along with their descendants level by level
+        (see `Hierarchy.delete_subtrees()`) and closes up the gaps left
+        with one update per tree (unless numbering is spread).
+
+        :param query_set:
+        :param nodes: None of them is an ancestor of another.
+        :param on_delete: Callable receiving every batch of objects before it is deleted.
+
+        """
+        deleted = super().delete_subtrees(query_set, nodes, on_delete)
+        self.close_gaps(query_set, nodes)
+
+        return deleted
+
+    def delete_subtrees_raw(self, query_set: QuerySet, nodes: List[Model]) -> int:
+        """Deletes the given nodes along with their descendants with one statement
+        and closes up the gaps left with one update per tree (unless numbering is spread).
+
+        :param query_set:
+        :param nodes: None of them is an ancestor of another.
+
+        """
+        span = Q()
+
+        for node in nodes:
+            span |= self.get_subtree_filter(node)
+
+        deleted = self.delete_queryset(query_set.filter(span))
+        self.close_gaps(query_set, nodes)
+
+        return deleted
+
+    def close_gaps(self, query_set: QuerySet, nodes: List[Model]):
+        """Closes up the gaps left by deleted subtrees of the given nodes
+        with one update per tree (unless numbering is spread).
+
+        :param query_set:
+        :param nodes: Subtrees roots as they were before deletion.
+
+        """
+        if self.spread:
+            return
+
+        trees = defaultdict(list)
+
+        for node in nodes:
+            trees[tuple(self.get_tree_filter(node).items())].append(self.get_range_clause(node))
+
+        for tree_filter, ranges in trees.items():
+            shifts = []
+            width = 0
+
+            for left_value, right_value in sorted(ranges):
+                width += right_value - left_value + 1
+                shifts.append(((right_value + 1, None), -width))
+
+            # The first matching shift applies, so the rightmost go first.
+            self.shift_ranges(query_set.filter(**dict(tree_filter)), shifts[::-1])
+
+    def get_descendant_count(self, obj: Model) -> Optional[int]:
+        """Returns a number of all descendants of the given object.
+        None if numbering is spread (has gaps).
+
+        :param obj:
+
+        """
+        if self.spread:
+            return None
+
+        left, right = self.get_range_clause(obj)
+        return (right - left - 1) // 2
+
+    def get_child_count_subquery(self, query_set: QuerySet) -> Coalesce:
+        """Returns an expression counting immediate children of an outer query row.
+
+        :param query_set:
+
+        """
+        left = self.left_field
+        level = self.level_field
+        tree_id_field = self.tree_id_field
+
+        children_filter = {
+            f'{left}__gt': OuterRef(left),
+            f'{left}__lt': OuterRef(self.right_field),
+            level: OuterRef(level) + 1,
+        }
+
+        if tree_id_field:
+            children_filter[tree_id_field] = OuterRef(tree_id_field)
+
+        return get_count_subquery(query_set.model._default_manager.filter(**children_filter))
+
+    def get_children_stats(self, query_set: QuerySet, objs: List[Model]) -> Dict[Any, Tuple[int, Optional[int]]]:
+        """Returns (immediate children, all descendants) counts for the given objects
+        indexed by objects IDs.
+
+        Descendants count comes from borders for free, immediate children
+        are counted for all the objects at once using one grouped query.
+
+        :param query_set: Base query set to count children in.
+        :param objs:
+
+        """
+        if self.spread:
+            return {pk: (children_count, None) for pk, children_count in self.count_children(query_set, objs).items()}
+
+        stats = {}
+        targets = []
+
+        for obj in objs:
+            descendants_count = self.get_descendant_count(obj)
+
+            if descendants_count > 1:
+                targets.append(obj)
+                stats[obj.pk] = descendants_count
+
+            else:
+                stats[obj.pk] = (descendants_count, descendants_count)
+
+        if targets:
+            for pk, children_count in self.count_children(query_set, targets).items():
+                stats[pk] = (children_count, stats[pk])
+
+        return stats
+
+    def count_children(self, query_set: QuerySet, objs: List[Model]) -> Dict[Any, int]:
+        """Returns immediate children counts for the given objects
+        indexed by objects IDs using one grouped query joining children
+        on ranges containment (one bound parameter per object).
+
+        :param query_set: Base query set to count children in.
+        :param objs:
+
+        """
+        opts = query_set.model._meta
+        connection = connections[query_set.db]
+        qn = connection.ops.quote_name
+
+        table = qn(opts.db_table)
+        pk_column = qn(opts.pk.column)
+        left_column = qn(opts.get_field(self.left_field).column)
+        right_column = qn(opts.get_field(self.right_field).column)
+        level_column = qn(opts.get_field(self.level_field).column)
+
+        tree_clause = ''
+        tree_id_field = self.tree_id_field
+
+        if tree_id_field:
+            tree_column = qn(opts.get_field(tree_id_field).column)
+            tree_clause = f'n.{tree_column} = p.{tree_column} AND '
+
+        sql = (
+            f'SELECT p.{pk_column}, COUNT(n.{pk_column}) FROM {table} p '
+            f'INNER JOIN {table} n ON {tree_clause}'
+            f'n.{left_column} > p.{left_column} AND n.{left_column} < p.{right_column} '
+            f'AND n.{level_column} = p.{level_column} + 1 '
+            f'WHERE p.{pk_column} IN ({", ".join(["%s"] * len(objs))})'
+        )
+        params = tuple(obj.pk for obj in objs)
+
+        if query_set.query.where:
+            # Respect base query set restrictions.
+            base_sql, base_params = query_set.order_by().values('pk').query.sql_with_params()
+            sql += f' AND n.{pk_column} IN ({base_sql})'
+            params += tuple(base_params)
+
+        with connection.cursor() as cursor:
+            cursor.execute(f'{sql} GROUP BY p.{pk_column}', params)
+            counts = {opts.pk.to_python(pk): count for pk, count in cursor.fetchall()}
+
+        return {obj.pk: counts.get(obj.pk, 0) for obj in objs}
+
+    def fetch_path(self, query_set: QuerySet, node: Any) -> List[Model]:
+        """Fetches objects from the root down to the given node (inclusive)
+        using one range query.
+
+        :param query_set: Base query set to get objects from.
+        :param node: Node object or ID.
+
+        """
+        left = self.left_field
+        right = self.right_field
+        tree_id_field = self.tree_id_field
+
+        if isinstance(node, Model):
+            left_value, right_value = self.get_range_clause(node)
+            path_filter = self.get_tree_filter(node)
+
+        else:
+            node_qs = query_set.filter(pk=node)
+            left_value = Subquery(node_qs.values(left)[:1])
+            right_value = Subquery(node_qs.values(right)[:1])
+            path_filter = {tree_id_field: Subquery(node_qs.values(tree_id_field)[:1])} if tree_id_field else {}
+
+        return list(query_set.filter(**{
+            **path_filter,
+            f'{left}__lte': left_value,
+            f'{right}__gte': right_value,
+        }).order_by(left))
+
+    def fetch_paths(self, query_set: QuerySet, objs: List[Model]) -> Dict[Any, List[Model]]:
+        """Fetches objects from the root down to every given object (inclusive)
+        indexed by objects IDs using one range query.
+
+        :param query_set: Base query set to get objects from.
+        :param objs:
+
+        """
+        left = self.left_field
+        right = self.right_field
+
+        ranges = Q()
+        nested = []
+
+        for obj in objs:
+            if getattr(obj, self.level_field) == self.root_level:
+                continue
+
+            left_value, right_value = self.get_range_clause(obj)
+            ranges |= Q(**self.get_tree_filter(obj), **{f'{left}__lt': left_value, f'{right}__gt': right_value})
+            nested.append(obj)
+
+        ancestors = list(query_set.filter(ranges).order_by(left)) if nested else []
+
+        def contains(ancestor: Model, obj: Model) -> bool:
+            return (
+                self.get_tree_filter(ancestor) == self.get_tree_filter(obj) and
+                getattr(ancestor, left) < getattr(obj, left) and
+                getattr(ancestor, right) > getattr(obj, right)
+            )
+
+        return {
+            obj.pk: [ancestor for ancestor in ancestors if contains(ancestor, obj)] + [obj]
+            for obj in objs
+        }
+
+    def hook_get_queryset(self, changelist: 'HierarchicalChangeList', request: HttpRequest):
+        """Triggered by `ChangeList.get_queryset()`."""
+
+        changelist.check_field_exists(self.left_field)
+        changelist.check_field_exists(self.right_field)
+
+        context = changelist.hierarchy_context
+
+        pid = self.get_pid_from_request(changelist, request)
+        context.pid = pid
+
+        # Get parent item first.
+        if pid:
+            context.parent = self.get_read_queryset(changelist.root_queryset).get(pk=pid)
+
+        if changelist.query:
+            # Do not restrict search to current sub.
             return
 
-        changelist.params[pid_field] = pid
+        if pid:
+            changelist.params.update(self.get_immediate_children_filter(context.parent))
+
+        else:
+            # Root level may contain many roots (one for every tree).
+            changelist.params[self.level_field] = self.root_level
+
+
+class MaterializedPath(Hierarchy):
+
+    def __init__(
+            self,
+            path_field: str = 'path',
+            depth_field: str = 'depth',
+            step_length: int = 4,
+            root_depth: int = 1,
+            **kwargs
+    ):
+        """
+        :param path_field: Name of a field containing materialized path.
+        :param depth_field: Name of a field containing node depth.
+        :param step_length: Length of a path step (a node key in path).
+        :param root_depth: Depth of root items.
+        :param kwargs: Common hierarchy options. See `Hierarchy.__init__()`.
+
+        """
+        super().__init__(**kwargs)
+        self.path_field = path_field
+        self.depth_field = depth_field
+        self.step_length = step_length
+        self.root_depth = root_depth
+
+    def get_immediate_children_filter(self, obj: Model) -> Dict:
+        flt = {
+            f'{self.path_field}__startswith': getattr(obj, self.path_field),
+            self.depth_field: getattr(obj, self.depth_field) + 1
+        }
+        return flt
+
+    def get_keyset_ordering(self) -> List[str]:
+        """Returns fields to order objects by for keyset pagination.
+        Objects are ordered as they are in a tree.
+
+        """
+        return [self.path_field]
+
+    def get_position_fields(self) -> Optional[List[str]]:
+        return [self.path_field, self.depth_field]
+
+    def filter_children(self, query_set: QuerySet, node: Any) -> QuerySet:
+        """Returns query set narrowed to immediate children of the given node.
+
+        :param query_set:
+        :param node: Node object or ID. None - root level.
+
+        """
+        if node is None:
+            return query_set.filter(**{self.depth_field: self.root_depth})
+
+        if not isinstance(node, Model):
+            node = query_set.model._default_manager.db_manager(query_set.db).get(pk=node)
+
+        return query_set.filter(**self.get_immediate_children_filter(node))
+
+    def filter_subtree(self, query_set: QuerySet, node: Any) -> QuerySet:
+        """Returns query set narrowed to all descendants of the given node
+        using path prefix lookup.
+
+        :param query_set:
+        :param node: Node object or ID.
+
+        """
+        if not isinstance(node, Model):
+            node = query_set.model._default_manager.db_manager(query_set.db).get(pk=node)
+
+        return query_set.filter(**{
+            f'{self.path_field}__startswith': getattr(node, self.path_field),
+            f'{self.depth_field}__gt': getattr(node, self.depth_field),
+        })
+
+    def get_subtrees_sql(self, query_set: QuerySet, pks: List[Any]) -> Tuple[str, Tuple]:
+        """Returns SQL and params for a query selecting (origin_id, node_id) pairs
+        for all nodes of subtrees of the given nodes (the nodes themselves included)
+        joining nodes on path prefix.
+
+        :param query_set:
+        :param pks: Subtree roots IDs.
+
+        """
+        opts = query_set.model._meta
+        qn = connections[query_set.db].ops.quote_name
+
+        table = qn(opts.db_table)
+        pk_column = qn(opts.pk.column)
+        path_column = qn(opts.get_field(self.path_field).column)
+
+        sql = (
+            f'SELECT p.{pk_column} AS origin_id, n.{pk_column} AS node_id FROM {table} p '
+            f'INNER JOIN {table} n ON SUBSTR(n.{path_column}, 1, LENGTH(p.{path_column})) = p.{path_column} '
+            f'WHERE p.{pk_column} IN ({", ".join(["%s"] * len(pks))})'
+        )
+
+        return sql, tuple(pks)
+
+    def iter_subtree(
+            self,
+            query_set: QuerySet,
+            node: Optional[Model],
+            batch_size: int = 1000
+    ) -> Iterator[Tuple[Model, int, str]]:
+        """Yields (object, depth, path) for the given node and all its descendants.
+        Depth is relative to the node, path is made of objects titles starting from the node.
+
+        Uses one path prefix scan in tree order, only ancestors of the current object are kept in memory.
+
+        :param query_set: Base query set to get objects from.
+        :param node: Node object. None - all the trees.
+        :param batch_size: Number of objects to fetch from DB at once.
+
+        """
+        path_field = self.path_field
+        sep = self.PATH_SEPARATOR
+
+        if node is not None:
+            query_set = query_set.filter(**{f'{path_field}__startswith': getattr(node, path_field)})
+
+        stack = []  # (materialized path, path) pairs of the current object ancestors.
+
+        for obj in query_set.order_by(path_field).iterator(chunk_size=batch_size):
+            obj_materialized = getattr(obj, path_field)
+
+            while stack and not obj_materialized.startswith(stack[-1][0]):
+                stack.pop()
+
+            obj_path = f'{stack[-1][1]}{sep}{obj}' if stack else str(obj)
+
+            yield obj, len(stack), obj_path
+
+            stack.append((obj_materialized, obj_path))
+
+    def fetch_tree(
+            self,
+            query_set: QuerySet,
+            node: Any,
+            depth: int,
+            limit: Optional[int] = None
+    ) -> List[Tuple[Model, int]]:
+        """Fetches descendants of the given node down to the given depth
+        using one path prefix query capped by depth.
+
+        :param query_set: Base query set to get objects from.
+        :param node: Node object or ID. None - root level.
+        :param depth: Maximum depth of descendants.
+        :param limit: Maximum number of objects (first in tree order). None - no limit.
+
+        """
+        depth_field = self.depth_field
+
+        if node is None:
+            base_depth = self.root_depth - 1
+            query_set = query_set.filter(**{f'{depth_field}__lte': base_depth + depth})
+
+        else:
+            if not isinstance(node, Model):
+                node = query_set.model._default_manager.db_manager(query_set.db).get(pk=node)
+
+            base_depth = getattr(node, depth_field)
+            query_set = self.filter_subtree(query_set, node).filter(**{f'{depth_field}__lte': base_depth + depth})
+
+        query_set = query_set.order_by(self.path_field)
+
+        if limit is not None:
+            query_set = query_set[:limit]
+
+        return [(obj, getattr(obj, depth_field) - base_depth) for obj in query_set]
+
+    def get_child_count_subquery(self, query_set: QuerySet) -> Coalesce:
+        """Returns an expression counting immediate children of an outer query row.
+
+        :param query_set:
+
+        """
+        path_field = self.path_field
+        depth_field = self.depth_field
+
+        return get_count_subquery(query_set.model._default_manager.filter(**{
+            f'{path_field}__startswith': OuterRef(path_field),
+            depth_field: OuterRef(depth_field) + 1,
+        }))
+
+    def get_ancestor_paths(self, obj: Model) -> List[str]:
+        """Returns paths of all ancestors of the given object starting from the root.
+
+        :param obj:
+
+        """
+        path = getattr(obj, self.path_field)
+        step_length = self.step_length
+
+        return [path[:end] for end in range(step_length, len(path), step_length)]
+
+    def get_children_stats(self, query_set: QuerySet, objs: List[Model]) -> Dict[Any, Tuple[int, Optional[int]]]:
+        """Returns (immediate children, None) counts for the given objects
+        indexed by objects IDs using one grouped query.
 
-    def hook_filter_queryset(self, changelist: 'HierarchicalChangeList', query_set: QuerySet) -> QuerySet:
-        """Triggered by `ChangeList.get_queryset()`."""
+        :param query_set: Base query set to count children in.
+        :param objs:
 
-        if self.pid is None:
-            changelist.params.pop(self.pid_field, None)
+        """
+        path_field = self.path_field
+        depth_field = self.depth_field
 
-        return query_set
+        prefixes = Q()
 
-    def hook_get_results(self, changelist: 'HierarchicalChangeList'):
-        """Triggered by `ChangeList.get_results()`."""
+        for obj in objs:
+            prefixes |= Q(**{f'{path_field}__startswith': getattr(obj, path_field)})
 
-        result_list = list(changelist.result_list)
+        stats_qs = query_set.filter(
+            prefixes,
+            **{f'{depth_field}__in': {getattr(obj, depth_field) + 1 for obj in objs}}
+        ).order_by().annotate(
+            parent_path=Substr(path_field, 1, Length(path_field) - self.step_length)
+        ).values_list('parent_path').annotate(cnt=models.Count('pk'))
 
-        if self.pid:
-            # Render to upper level link.
-            parent = changelist.model.objects.get(pk=self.pid)
-            parent = changelist.model(pk=getattr(parent, self.pid_field_real, None))
-            setattr(parent, self.UPPER_LEVEL_MODEL_ATTR, True)
-            result_list = [parent] + result_list
+        stats = {item[0]: item[1] for item in stats_qs}
 
-        # Get children stats.
-        kwargs_filter = {f'{self.pid_field}__in': result_list}
+        return {obj.pk: (stats.get(getattr(obj, path_field), 0), None) for obj in objs}
 
-        stats_qs = changelist.model.objects.filter(
-            **kwargs_filter).values_list(self.pid_field).annotate(cnt=models.Count(self.pid_field))
+    def fetch_path(self, query_set: QuerySet, node: Any) -> List[Model]:
+        """Fetches objects from the root down to the given node (inclusive)
+        using one query with path lookup.
 
-        stats = {item[0]: item[1] for item in stats_qs}
+        :param query_set: Base query set to get objects from.
+        :param node: Node object or ID.
 
-        for item in result_list:
+        """
+        path_field = self.path_field
 
-            if hasattr(item, self.CHILD_COUNT_MODEL_ATTR):
-                continue
+        if not isinstance(node, Model):
+            node = query_set.get(pk=node)
 
-            try:
-                setattr(item, self.CHILD_COUNT_MODEL_ATTR, stats[item.pk])
+        paths = self.get_ancestor_paths(node) + [getattr(node, path_field)]
 
-            except KeyError:
-                setattr(item, self.CHILD_COUNT_MODEL_ATTR, 0)
+        return list(query_set.filter(**{f'{path_field}__in': paths}).order_by(path_field))
 
-        changelist.result_list = result_list
+    def fetch_paths(self, query_set: QuerySet, objs: List[Model]) -> Dict[Any, List[Model]]:
+        """Fetches objects from the root down to every given object (inclusive)
+        indexed by objects IDs using one query with path lookup.
 
+        :param query_set: Base query set to get objects from.
+        :param objs:
 
-class NestedSet(Hierarchy):
+        """
+        path_field = self.path_field
+        ancestor_paths = {obj.pk: self.get_ancestor_paths(obj) for obj in objs}
+        paths = set().union(*ancestor_paths.values())
 
-    def __init__(
-            self,
-            left_field: str = 'lft',
-            right_field: str = 'rgt',
-            level_field: str = 'level',
-            root_level: int = 0
-    ):
-        self.pid = None
-        self.parent = None
-        self.left_field = left_field
-        self.right_field = right_field
-        self.level_field = level_field
-        self.root_level = root_level
+        ancestors = {}
 
-    def get_range_clause(self, obj: Model) -> Tuple[int, int]:
-        return getattr(obj, self.left_field), getattr(obj, self.right_field)
+        if paths:
+            ancestors = {getattr(obj, path_field): obj for obj in query_set.filter(**{f'{path_field}__in': paths})}
 
-    def get_immediate_children_filter(self, obj: Model) -> Dict:
-        flt = {
-            f'{self.left_field}__range': self.get_range_clause(obj),
-            self.level_field: getattr(obj, self.level_field) + 1
+        return {
+            obj.pk: [ancestors[path] for path in ancestor_paths[obj.pk] if path in ancestors] + [obj]
+            for obj in objs
         }
-        return flt
 
     def hook_get_queryset(self, changelist: 'HierarchicalChangeList', request: HttpRequest):
         """Triggered by `ChangeList.get_queryset()`."""
 
-        changelist.check_field_exists(self.left_field)
-        changelist.check_field_exists(self.right_field)
+        changelist.check_field_exists(self.path_field)
+        changelist.check_field_exists(self.depth_field)
+
+        context = changelist.hierarchy_context
 
         pid = self.get_pid_from_request(changelist, request)
-        self.pid = pid
+        context.pid = pid
 
-        # Get parent item first.
-        qs = changelist.root_queryset
+        if pid:
+            context.parent = self.get_read_queryset(changelist.root_queryset).get(pk=pid)
 
         if changelist.query:
             # Do not restrict search to current sub.
             return
 
         if pid:
-            self.parent = qs.get(pk=pid)
-            changelist.params.update(self.get_immediate_children_filter(self.parent))
+            changelist.params.update(self.get_immediate_children_filter(context.parent))
 
         else:
-            changelist.params[self.level_field] = self.root_level
-            self.parent = qs.get(**{
-                key: val for key, val in changelist.params.items()
-                if not key.startswith('_') and key != 'q'
-            })
+            changelist.params[self.depth_field] = self.root_depth
 
-    def hook_get_results(self, changelist: 'HierarchicalChangeList'):
-        """Triggered by `ChangeList.get_results()`."""
 
-        # Poor NestedSet guys they've punished themselves once chosen that approach,
-        # and now we punish them again with all those DB hits.
+class ClosureTable(Hierarchy):
+
+    def __init__(
+            self,
+            closure_model: Union[str, Type[Model]],
+            ancestor_field: str = 'ancestor',
+            descendant_field: str = 'descendant',
+            depth_field: str = 'depth',
+            **kwargs
+    ):
+        """
+        :param closure_model: Model (or its `app_label.ModelName` string) storing
+            ancestor-descendant pairs.
 
-        result_list = list(changelist.result_list)
+        :param ancestor_field: Name of a closure model field pointing to an ancestor.
+        :param descendant_field: Name of a closure model field pointing to a descendant.
+        :param depth_field: Name of a closure model field containing the distance between nodes.
+        :param kwargs: Common hierarchy options. See `Hierarchy.__init__()`.
 
-        left = self.left_field
-        right = self.right_field
+        """
+        super().__init__(**kwargs)
+        self._closure_model = closure_model
+        self.ancestor_field = ancestor_field
+        self.descendant_field = descendant_field
+        self.depth_field = depth_field
 
-        # Get children stats.
-        filter_kwargs = {f'{left}': models.F(f'{right}') - 1}  # Leaf nodes only.
-        filter_kwargs.update(self.get_immediate_children_filter(self.parent))
+    @property
+    def closure_model(self) -> Type[Model]:
+        closure_model = self._closure_model
 
-        stats_qs = changelist.result_list.filter(**filter_kwargs).values_list('id')
-        leafs = [item[0] for item in stats_qs]
+        if isinstance(closure_model, str):
+            closure_model = apps.get_model(closure_model)
+            self._closure_model = closure_model
 
-        for result in result_list:
+        return closure_model
 
-            if result.pk in leafs:
-                setattr(result, self.CHILD_COUNT_MODEL_ATTR, 0)
-            else:
-                # Too much pain to get real stats, so that'll suffice.
-                setattr(result, self.CHILD_COUNT_MODEL_ATTR, '>1')
+    def get_closure_queryset(self, query_set: QuerySet) -> QuerySet:
+        """Returns closure model query set using the same database as the given one.
 
-        if self.pid:
-            # Render to upper level link.
-            parent = self.parent
+        :param query_set:
 
-            filter_kwargs = {
-                f'{left}__lt': getattr(parent, left),
-                f'{right}__gt': getattr(parent, right),
-            }
+        """
+        return self.closure_model._default_manager.using(query_set.db).order_by()
 
-            try:
-                grandparent_id = changelist.model.objects.filter(
-                    **filter_kwargs
-                ).order_by(f'-{left}')[0].pk
+    def get_descendants_ids(self, query_set: QuerySet, pk: Any, depth: Optional[int] = None) -> QuerySet:
+        """Returns closure query set of descendants IDs for the given node.
+
+        :param query_set:
+        :param pk: Node ID.
+        :param depth: Exact depth of descendants. None - any depth.
+
+        """
+        depth_filter = {f'{self.depth_field}__gt': 0} if depth is None else {self.depth_field: depth}
+
+        return self.get_closure_queryset(query_set).filter(
+            **{self.ancestor_field: pk},
+            **depth_filter
+        ).values(self.descendant_field)
+
+    def get_child_count_subquery(self, query_set: QuerySet) -> Coalesce:
+        """Returns an expression counting immediate children of an outer query row.
+
+        :param query_set:
+
+        """
+        return get_count_subquery(self.get_closure_queryset(query_set).filter(**{
+            self.ancestor_field: OuterRef('pk'),
+            self.depth_field: 1,
+        }))
+
+    def filter_subtree(self, query_set: QuerySet, node: Any) -> QuerySet:
+        """Returns query set narrowed to all descendants of the given node
+        using closure table.
+
+        :param query_set:
+        :param node: Node object or ID.
+
+        """
+        pk = node.pk if isinstance(node, Model) else node
+        return query_set.filter(pk__in=self.get_descendants_ids(query_set, pk))
+
+    def get_subtrees_sql(self, query_set: QuerySet, pks: List[Any]) -> Tuple[str, Tuple]:
+        """Returns SQL and params for a query selecting (origin_id, node_id) pairs
+        for all nodes of subtrees of the given nodes (the nodes themselves included)
+        from closure table.
+
+        :param query_set:
+        :param pks: Subtree roots IDs.
+
+        """
+        opts = query_set.model._meta
+        closure_opts = self.closure_model._meta
+        qn = connections[query_set.db].ops.quote_name
+
+        table = qn(opts.db_table)
+        pk_column = qn(opts.pk.column)
+        closure_table = qn(closure_opts.db_table)
+        ancestor_column = qn(closure_opts.get_field(self.ancestor_field).column)
+        descendant_column = qn(closure_opts.get_field(self.descendant_field).column)
+
+        placeholders = ', '.join(['%s'] * len(pks))
+
+        sql = (
+            f'SELECT {ancestor_column} AS origin_id, {descendant_column} AS node_id FROM {closure_table} '
+            f'WHERE {ancestor_column} IN ({placeholders}) '
+            # Closure table may have no rows linking nodes to themselves.
+            f'UNION '
+            f'SELECT {pk_column}, {pk_column} FROM {table} WHERE {pk_column} IN ({placeholders})'
+        )
+
+        return sql, tuple(pks) + tuple(pks)
+
+    def iter_children(self, query_set: QuerySet, pks: List[Any], batch_size: int) -> Iterator[Tuple[Any, Model]]:
+        """Yields (parent ID, object) pairs for immediate children of the given nodes
+        using one query joined with closure table.
+
+        :param query_set:
+        :param pks: Nodes IDs.
+        :param batch_size: Number of objects to fetch from DB at once.
+
+        """
+        closure_qs = self.get_closure_queryset(query_set).filter(**{self.depth_field: 1})
+
+        children = query_set.filter(
+            pk__in=closure_qs.filter(**{f'{self.ancestor_field}__in': pks}).values(self.descendant_field)
+        ).annotate(
+            _closure_parent=Subquery(
+                closure_qs.filter(**{self.descendant_field: OuterRef('pk')}).values(self.ancestor_field)[:1]
+            )
+        ).order_by('_closure_parent', 'pk').iterator(chunk_size=batch_size)
+
+        for obj in children:
+            yield obj._closure_parent, obj
+
+    def fetch_tree(
+            self,
+            query_set: QuerySet,
+            node: Any,
+            depth: int,
+            limit: Optional[int] = None
+    ) -> List[Tuple[Model, int]]:
+        """Fetches descendants of the given node down to the given depth
+        using one depth-limited recursive CTE query over immediate links of closure table
+        (limit is applied by DB) and a query for objects.
+
+        :param query_set: Base query set to get objects from.
+        :param node: Node object or ID. None - root level.
+        :param depth: Maximum depth of descendants.
+        :param limit: Maximum number of objects (first in tree order). None - no limit.
+
+        """
+        pk = node.pk if isinstance(node, Model) else node
+
+        opts = query_set.model._meta
+        closure_opts = self.closure_model._meta
+        qn = connections[query_set.db].ops.quote_name
+
+        table = qn(opts.db_table)
+        pk_column = qn(opts.pk.column)
+        closure_table = qn(closure_opts.db_table)
+        ancestor_column = qn(closure_opts.get_field(self.ancestor_field).column)
+        descendant_column = qn(closure_opts.get_field(self.descendant_field).column)
+        depth_column = qn(closure_opts.get_field(self.depth_field).column)
+
+        if pk is None:
+            # Root items have no ancestors.
+            seed = (
+                f'SELECT t.{pk_column} FROM {table} t WHERE NOT EXISTS ('
+                f'SELECT 1 FROM {closure_table} c '
+                f'WHERE c.{descendant_column} = t.{pk_column} AND c.{depth_column} > 0)'
+            ), ()
+
+        else:
+            pk = opts.pk.to_python(pk)
+            seed = (
+                f'SELECT {descendant_column} FROM {closure_table} '
+                f'WHERE {ancestor_column} = %s AND {depth_column} = 1'
+            ), (pk,)
+
+        sql, params = get_tree_sql(
+            closure_table, descendant_column, ancestor_column, seed, depth,
+            condition=f' AND e.{depth_column} = 1', limit=limit)
+
+        return fetch_tree_rows(query_set, sql, params, pk)
+
+    def get_children_stats(self, query_set: QuerySet, objs: List[Model]) -> Dict[Any, Tuple[int, Optional[int]]]:
+        """Returns (immediate children, all descendants) counts for the given objects
+        indexed by objects IDs using one grouped query.
+
+        :param query_set: Base query set to count children in.
+        :param objs:
+
+        """
+        ancestor_field = self.ancestor_field
+        depth_field = self.depth_field
+
+        stats_qs = self.get_closure_queryset(query_set).filter(**{
+            f'{ancestor_field}__in': [obj.pk for obj in objs],
+            f'{depth_field}__gt': 0,
+        }).values_list(ancestor_field).annotate(
+            children=models.Count('pk', filter=Q(**{depth_field: 1})),
+            descendants=models.Count('pk'),
+        )
+
+        stats = {item[0]: item[1:] for item in stats_qs}
+
+        return {obj.pk: stats.get(obj.pk, (0, 0)) for obj in objs}
+
+    def fetch_path(self, query_set: QuerySet, node: Any) -> List[Model]:
+        """Fetches objects from the root down to the given node (inclusive)
+        using one query joined with closure table.
+
+        :param query_set: Base query set to get objects from.
+        :param node: Node object or ID.
+
+        """
+        pk = node.pk if isinstance(node, Model) else node
+
+        closure_qs = self.get_closure_queryset(query_set).filter(**{self.descendant_field: pk})
+
+        path_qs = query_set.filter(
+            Q(pk=pk) | Q(pk__in=closure_qs.values(self.ancestor_field))
+        ).annotate(
+            _closure_depth=Coalesce(
+                Subquery(
+                    closure_qs.filter(**{self.ancestor_field: OuterRef('pk')}).values(self.depth_field)[:1]
+                ),
+                0
+            )
+        ).order_by('-_closure_depth')
+
+        return list(path_qs)
+
+    def fetch_paths(self, query_set: QuerySet, objs: List[Model]) -> Dict[Any, List[Model]]:
+        """Fetches objects from the root down to every given object (inclusive)
+        indexed by objects IDs using one closure table query joined with ancestors.
+
+        :param query_set: Base query set to get objects from.
+        :param objs:
+
+        """
+        ancestor_field = self.ancestor_field
+        descendant_field = self.descendant_field
+        depth_field = self.depth_field
+
+        relations = self.get_closure_queryset(query_set).filter(**{
+            f'{descendant_field}__in': [obj.pk for obj in objs],
+            f'{depth_field}__gt': 0,
+        }).select_related(ancestor_field).order_by(f'-{depth_field}')
+
+        descendant_attr = self.closure_model._meta.get_field(descendant_field).attname
+        paths = {obj.pk: [] for obj in objs}
+
+        for relation in relations:
+            paths[getattr(relation, descendant_attr)].append(getattr(relation, ancestor_field))
+
+        for obj in objs:
+            paths[obj.pk].append(obj)
+
+        return paths
+
+    def watch_changes(self, model: Type[Model], stats_cache: Optional[StatsCache] = None):
+        """Connects signal handlers invalidating caches on model objects save and delete.
+
+        Closure rows are usually written after a node is saved,
+        so they are watched too: a row invalidates stats of its ancestor.
+
+        :param model:
+        :param stats_cache:
+
+        """
+        super().watch_changes(model, stats_cache)
+
+        if stats_cache is None:
+            return
+
+        ancestor_attr = self.closure_model._meta.get_field(self.ancestor_field).attname
+
+        def on_closure_change(sender, instance, **kwargs):
+            stats_cache.delete_many(model, [getattr(instance, ancestor_attr)])
+
+        uid = f'admirarchy_{id(self)}_{model._meta.label_lower}_closure'
+
+        connect = self.connect_signal
+        connect(model, signals.post_save, on_closure_change, sender=self.closure_model, dispatch_uid=f'{uid}_post_save')
+        connect(
+            model, signals.post_delete, on_closure_change, sender=self.closure_model, dispatch_uid=f'{uid}_post_delete')
+
+    def hook_get_queryset(self, changelist: 'HierarchicalChangeList', request: HttpRequest):
+        """Triggered by `ChangeList.get_queryset()`."""
+
+        pid = self.get_pid_from_request(changelist, request)
+        changelist.hierarchy_context.pid = pid
+
+    def hook_filter_queryset(self, changelist: 'HierarchicalChangeList', query_set: QuerySet) -> QuerySet:
+        """Triggered by `ChangeList.get_queryset()`."""
+
+        if changelist.query:
+            # Do not restrict search to current sub.
+            return query_set
+
+        return self.filter_children(query_set, changelist.hierarchy_context.pid)
+
+    def filter_children(self, query_set: QuerySet, node: Any) -> QuerySet:
+        """Returns query set narrowed to immediate children of the given node.
+
+        :param query_set:
+        :param node: Node object or ID. None - root level.
+
+        """
+        pk = node.pk if isinstance(node, Model) else node
+
+        if pk:
+            return query_set.filter(pk__in=self.get_descendants_ids(query_set, pk, depth=1))
+
+        # Root items have no ancestors.
+        return query_set.filter(~Exists(self.get_closure_queryset(query_set).filter(**{
+            self.descendant_field: OuterRef('pk'),
+            f'{self.depth_field}__gt': 0,
+        })))
+
+
+class ChildCountMaintainer:
+    """Keeps denormalized children count field (see `Hierarchy.child_count_field`)
+    up to date on objects creation, deletion and moves using atomic `F()` updates.
+
+    .. note:: Bulk operations (e.g. `QuerySet.update()`) do not send signals,
+        use `admirarchy_child_counts` management command to repair counts.
+
+    """
+    def __init__(self, model: Type[Model], hierarchy: Hierarchy):
+        self.model = model
+        self.hierarchy = hierarchy
+
+    def shift(self, pid: Any, delta: int):
+        """Atomically adds delta to children count of the given node.
+
+        :param pid: Node ID.
+        :param delta:
+
+        """
+        if pid is None:
+            return
+
+        field = self.hierarchy.child_count_field
+        self.model._default_manager.filter(pk=pid).update(**{field: models.F(field) + delta})
+
+    def is_position_kept(self, update_fields: Optional[Iterable[str]]) -> bool:
+        """Returns True if a save of the given fields can not move a node.
+
+        :param update_fields: Fields passed to `Model.save()`. None - all fields.
+
+        """
+        if update_fields is None:
+            return False
+
+        position_fields = self.hierarchy.get_position_fields()
+
+        if position_fields is None:
+            return False
+
+        opts = self.model._meta
+        names = set()
+
+        for field_name in position_fields:
+            field = opts.get_field(field_name)
+            names.update((field.name, field.attname))
+
+        return not names.intersection(update_fields)
+
+    def on_pre_save(self, sender, instance, raw=False, update_fields=None, **kwargs):
+        instance._admirarchy_pid_old = None
+
+        if raw or instance._state.adding or self.is_position_kept(update_fields):
+            return
+
+        instance._admirarchy_pid_old = self.hierarchy.get_parent_id(sender, instance)
+
+    def on_post_save(self, sender, instance, created=False, raw=False, update_fields=None, **kwargs):
+        if raw or (not created and self.is_position_kept(update_fields)):
+            return
+
+        pid_old = getattr(instance, '_admirarchy_pid_old', None)
+        pid_new = self.hierarchy.get_saved_parent_id(sender, instance)
+
+        if created or pid_old != pid_new:
+            self.shift(pid_old, -1)
+            self.shift(pid_new, 1)
+
+    def on_pre_delete(self, sender, instance, **kwargs):
+        instance._admirarchy_pid_old = self.hierarchy.get_parent_id(sender, instance)
+
+    def on_post_delete(self, sender, instance, **kwargs):
+        self.shift(getattr(instance, '_admirarchy_pid_old', None), -1)
+
+    @property
+    def dispatch_uid(self) -> str:
+        return f'admirarchy_child_count_{id(self.hierarchy)}_{self.model._meta.label_lower}'
+
+    def connect(self):
+        """Connects signal handlers. They are also disconnected
+        by `Hierarchy.disconnect_signals()`.
+
+        """
+        model = self.model
+        uid = self.dispatch_uid
+        connect = self.hierarchy.connect_signal
+
+        connect(model, signals.pre_save, self.on_pre_save, sender=model, dispatch_uid=f'{uid}_pre_save')
+        connect(model, signals.post_save, self.on_post_save, sender=model, dispatch_uid=f'{uid}_post_save')
+        connect(model, signals.pre_delete, self.on_pre_delete, sender=model, dispatch_uid=f'{uid}_pre_delete')
+        connect(model, signals.post_delete, self.on_post_delete, sender=model, dispatch_uid=f'{uid}_post_delete')
+
+    def disconnect(self):
+        """Disconnects signal handlers."""
+        model = self.model
+        uid = self.dispatch_uid
+
+        for signal_name in ('pre_save', 'post_save', 'pre_delete', 'post_delete'):
+            getattr(signals, signal_name).disconnect(sender=model, dispatch_uid=f'{uid}_{signal_name}')
+
+    def recount(self, pks: Set[Any], using: Optional[str] = None):
+        """Recomputes children counts for the given nodes with one update.
+
+        :param pks: Nodes IDs.
+        :param using: Database alias.
+
+        """
+        query_set = self.model._default_manager.db_manager(using).all()
+
+        query_set.filter(pk__in=pks).update(**{
+            self.hierarchy.child_count_field: self.hierarchy.get_child_count_subquery(query_set)
+        })
+
+    def repair(self, batch_size: int = 1000) -> int:
+        """Recomputes children counts for all the objects in bulk.
+        Returns a number of processed objects.
+
+        :param batch_size: Number of objects to update with one query.
+
+        """
+        model = self.model
+        field = self.hierarchy.child_count_field
+        query_set = model._default_manager.all()
+
+        count_expr = self.hierarchy.get_child_count_subquery(query_set)
+
+        processed = 0
+        last_pk = None
+
+        while True:
+            batch_qs = query_set.order_by('pk')
+
+            if last_pk is not None:
+                batch_qs = batch_qs.filter(pk__gt=last_pk)
+
+            pks = list(batch_qs.values_list('pk', flat=True)[:batch_size])
+
+            if not pks:
+                break
+
+            query_set.filter(pk__in=pks).update(**{field: count_expr})
+
+            processed += len(pks)
+            last_pk = pks[-1]
+
+        return processed
+
+
+class NestedSetBuilder:
+    """Rebuilds nested set numbering (see `NestedSet`) from a parent
+    foreign key and verifies it.
+
+    Rows are read and written in batches, so that neither model instances
+    nor the whole tree structure are kept in memory.
+
+    """
+    def __init__(self, model: Type[Model], hierarchy: 'NestedSet', parent_field: Optional[str] = 'parent'):
+        """
+        :param model:
+        :param hierarchy:
+        :param parent_field: Name of a foreign key field pointing to a parent.
+            None - verify numbering only, not checking parents.
+
+        """
+        self.model = model
+        self.hierarchy = hierarchy
+        self.parent_field = parent_field
+
+    @property
+    def parent_attname(self) -> str:
+        return self.model._meta.get_field(self.parent_field).attname
+
+    def rebuild(self, batch_size: int = 1000, progress: Optional[Callable[[int], None]] = None) -> Tuple[int, int]:
+        """Renumbers all the objects walking the tree depth-first,
+        children are ordered by ID. Every root starts a new tree if
+        hierarchy has `tree_id_field`, otherwise all roots share numbering.
+
+        Children are read per parent in batches (leaves are not queried),
+        so memory use only depends on tree depth and batch size.
+        Every batch update is committed separately, so numbering is inconsistent
+        until rebuild is complete.
+
+        Returns a tuple (processed objects count, unreachable objects count).
+        Unreachable are objects with dangling parents or within cycles,
+        they are left intact.
+
+        :param batch_size: Number of objects to read and to update with one query.
+        :param progress: Callable accepting a number of objects processed so far.
+            Called after every batch update.
+
+        """
+        model = self.model
+        hierarchy = self.hierarchy
+        query_set = model._default_manager.all()
+        parent_attname = self.parent_attname
+
+        total = query_set.count()
+
+        children_qs = query_set.annotate(
+            admirarchy_has_children=Exists(query_set.filter(**{parent_attname: OuterRef('pk')}))
+        ).order_by('pk')
+
+        def iter_children(pid: Any) -> Iterator[Tuple[Any, bool]]:
+            # Keyset batches of (child ID, has children) pairs.
+            last_pk = None
+
+            while True:
+                batch_qs = children_qs.filter(**{parent_attname: pid})
+
+                if last_pk is not None:
+                    batch_qs = batch_qs.filter(pk__gt=last_pk)
+
+                rows = list(batch_qs.values_list('pk', 'admirarchy_has_children')[:batch_size])
+                yield from rows
+
+                if len(rows) < batch_size:
+                    return
+
+                last_pk = rows[-1][0]
+
+        def get_pending(pk: Any, has_children: bool) -> Iterator[Tuple[Any, bool]]:
+            return iter_children(pk) if has_children else iter(())
+
+        fields = [hierarchy.left_field, hierarchy.right_field, hierarchy.level_field]
+        tree_id_field = hierarchy.tree_id_field
+
+        if tree_id_field:
+            fields.append(tree_id_field)
+
+        using = router.db_for_write(model)
+        processed = 0
+        batch = []
+
+        def flush():
+            nonlocal processed, batch
+
+            with transaction.atomic(using=using):
+                query_set.bulk_update(batch, fields)
+
+            processed += len(batch)
+            batch = []
+
+            if progress:
+                progress(processed)
+
+        counter = 0
+
+        for tree_id, (root, root_has_children) in enumerate(iter_children(None), 1):
+
+            if tree_id_field:
+                counter = 0
+
+            counter += 1
+            stack = [(root, counter, get_pending(root, root_has_children))]
+
+            while stack:
+                pk, left, pending = stack[-1]
+                child = next(pending, None)
+
+                if child is not None:
+                    counter += 1
+                    stack.append((child[0], counter, get_pending(*child)))
+                    continue
+
+                stack.pop()
+                counter += 1
+
+                obj = model(pk=pk)
+                setattr(obj, hierarchy.left_field, left)
+                setattr(obj, hierarchy.right_field, counter)
+                setattr(obj, hierarchy.level_field, hierarchy.root_level + len(stack))
+
+                if tree_id_field:
+                    setattr(obj, tree_id_field, tree_id)
+
+                batch.append(obj)
+
+                if len(batch) >= batch_size:
+                    flush()
+
+        if batch:
+            flush()
+
+        return processed, total - processed
+
+    def verify(self, batch_size: int = 1000) -> Iterator[str]:
+        """Streams objects in tree order yielding descriptions
+        of numbering problems: overlaps, gaps (unless numbering is spread),
+        level and parent mismatches.
+
+        :param batch_size: Number of objects to read with one query.
+
+        """
+        hierarchy = self.hierarchy
+        left_field = hierarchy.left_field
+        right_field = hierarchy.right_field
+        tree_id_field = hierarchy.tree_id_field
+        parent_attname = self.parent_attname if self.parent_field else None
+        spread = hierarchy.spread  # Gaps are expected.
+
+        fields = ['pk', left_field, right_field, hierarchy.level_field, tree_id_field, parent_attname]
+        ordering = [tree_id_field, left_field] if tree_id_field else [left_field]
+
+        rows = self.model._default_manager.order_by(*ordering).values_list(
+            *[field for field in fields if field]).iterator(chunk_size=batch_size)
+
+        stack = []  # Open ancestors (pk, rgt) of the current row.
+        expected = 1  # Next number expected.
+        current_tree = None
+
+        def close(until: Optional[int] = None) -> Iterator[str]:
+            nonlocal expected
+
+            while stack and (until is None or stack[-1][1] < until):
+                pk, right = stack.pop()
+
+                if right < expected or (right > expected and not spread):
+                    yield f'{pk}: {"gap" if right > expected else "overlap"} at {right_field}={right} (expected {expected})'
+
+                expected = right + 1
+
+        for row in rows:
+            row = dict(zip([field for field in fields if field], row))
+
+            pk, left, right, level = row['pk'], row[left_field], row[right_field], row[hierarchy.level_field]
+            tree = row.get(tree_id_field)
+
+            if tree != current_tree:
+                yield from close()
+                current_tree = tree
+                expected = 1
+
+            yield from close(until=left)
+
+            if left < expected or (left > expected and not spread):
+                yield f'{pk}: {"gap" if left > expected else "overlap"} at {left_field}={left} (expected {expected})'
+
+            if right <= left:
+                yield f'{pk}: invalid range {left_field}={left} {right_field}={right}'
+
+            elif stack and right > stack[-1][1]:
+                yield f'{pk}: overlap with {stack[-1][0]} at {right_field}={right}'
+
+            expected_level = hierarchy.root_level + len(stack)
+
+            if level != expected_level:
+                yield f'{pk}: level mismatch {level} (expected {expected_level})'
 
-            except IndexError:
-                grandparent_id = None
+            if parent_attname:
+                expected_parent = stack[-1][0] if stack else None
 
-            if grandparent_id != parent.pk:
-                parent = changelist.model(pk=grandparent_id)
+                if row[parent_attname] != expected_parent:
+                    yield f'{pk}: parent mismatch {row[parent_attname]} (expected {expected_parent})'
 
-            setattr(parent, self.UPPER_LEVEL_MODEL_ATTR, True)
-            result_list = [parent] + result_list
+            stack.append((pk, max(right, left)))
+            expected = left + 1
 
-        changelist.result_list = result_list
+        yield from close()